@@ -43,6 +43,20 @@ export const animeService = {
         return response.json();
     },
 
+    // episodes: list or ranges, e.g. "1-12" or "5,6,7"
+    getAnimeEpisodesBatch: async (title: string, episodes: string) => {
+        const response = await fetch(
+            `${process.env.NEXT_PUBLIC_STREAM_API_URL}/stream/batch?title=${encodeURIComponent(title)}&episodes=${encodeURIComponent(episodes)}`
+        );
+
+        if (!response.ok) {
+            const errorData = await response.json().catch(() => ({}));
+            throw new Error(errorData.detail || `Batch Fetch Error: ${response.status}`);
+        }
+
+        return response.json();
+    },
+
     // Admin functions
     uploadAnimePoster: async (id: string | number, file: File) => {
         const formData = new FormData();
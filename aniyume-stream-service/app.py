@@ -1,23 +1,73 @@
-from fastapi import FastAPI, HTTPException, Query, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Query, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional, Dict
-from anicli_api.source.animego import Extractor
-from difflib import SequenceMatcher
+from typing import List, Optional, Dict, Tuple
+from anicli_api.source.animego import Extractor, Search
 import asyncio
-import re
+import json
+import os
+import time
 from datetime import datetime, timedelta
 from collections import OrderedDict
 import logging
+from contextlib import asynccontextmanager
 from cache_manager import cache
-from monitoring import router as monitoring_router, metrics_middleware
+from catalog import AnimeCatalog, EpisodeRecord
+from title_index import TitleIndex, normalize_title, is_movie, title_features, similarity, card_key
+from singleflight import make_single_flight
+from prefetch import PrefetchScheduler
+from warmer import PopularityWarmer
+from http_cache import build_entry, cached_response, dump_json
+from video_cache import VideoEntry, FRESH, STALE, EXPIRED, parse_quality
+from monitoring import (
+    router as monitoring_router, metrics_middleware, record_stage, video_cache_total,
+    start_loop_lag_monitor, stop_loop_lag_monitor,
+)
+from upstream import upstream, UpstreamUnavailable
+from proxy import router as proxy_router, close_client as close_proxy_client, get_client as get_proxy_client
+from hls import router as hls_router, segments as hls_segments, open_segments, close_segments
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Aniyume Streams Service")
+# Число процессов uvicorn; общие кэш, single-flight и прогрев - через Redis
+WORKERS = int(os.getenv("WORKERS", "1"))
+# 0 - готовность без Redis (memory-кэш отдельно в каждом воркере)
+REDIS_REQUIRED = os.getenv("REDIS_REQUIRED", "1" if WORKERS > 1 else "0") == "1"
+
+# Флаг готовности: выставляется в конце startup
+state = {"ready": False}
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    get_extractor()
+    start_loop_lag_monitor()
+    if not await cache.connect():
+        level = logging.ERROR if REDIS_REQUIRED else logging.WARNING
+        logger.log(level, f"⚠️ Redis unavailable at startup, retrying every {cache.health_interval}s")
+    cache.start_health_checks()
+    if cache.snapshot is not None:
+        cache.snapshot.start()
+    get_proxy_client()
+    await open_segments()
+    prefetcher.start()
+    warmer.start()
+    state["ready"] = True
+    logger.info(f"🚀 Worker {os.getpid()} ready")
+    try:
+        yield
+    finally:
+        state["ready"] = False
+        await warmer.stop()
+        await prefetcher.stop()
+        await close_proxy_client()
+        await close_segments()
+        await cache.aclose()
+        await stop_loop_lag_monitor()
+
+app = FastAPI(title="Aniyume Streams Service", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,8 +80,25 @@ app.add_middleware(
 # Register Monitoring
 app.include_router(monitoring_router)
 app.middleware("http")(metrics_middleware)
+app.include_router(proxy_router)
+app.include_router(hls_router)
+
+def create_extractor():
+    """animego по умолчанию; STREAM_EXTRACTOR=fake - локальная замена для нагрузочных тестов"""
+    if os.getenv("STREAM_EXTRACTOR", "animego") == "fake":
+        from fake_extractor import FakeExtractor
+        logger.warning("🧪 Using fake upstream extractor")
+        return FakeExtractor.from_env()
+    return Extractor()
 
-extractor = Extractor()
+_extractor = None
+
+def get_extractor():
+    """Extractor создается при первом обращении (на старте), а не при импорте"""
+    global _extractor
+    if _extractor is None:
+        _extractor = create_extractor()
+    return _extractor
 
 # ========== MODELS ==========
 class StreamingEpisode(BaseModel):
@@ -46,49 +113,24 @@ class StreamingEpisode(BaseModel):
 class StreamingResponseModel(BaseModel):
     anime_title: str
     total_episodes: int
+    offset: int = 0
+    next_offset: Optional[int] = None
     streaming_episodes: List[StreamingEpisode]
-    load_time: float
 
-# ========== SMART SEARCH ==========
-def normalize_title(title: str) -> str:
-    """Нормализация названия"""
-    title = title.lower().strip()
-    title = re.sub(r'\s+', ' ', title)
-    title = re.sub(r'[^\w\s]', '', title)
-    return title
-
-def is_movie(title: str) -> bool:
-    """Определение фильма"""
-    movie_keywords = [
-        'фильм', 'movie', 'film', 'поезд', 'бесконечный',
-        'train', 'infinity', 'муген', 'mugen', 'часть', 'part'
-    ]
-    return any(kw in title.lower() for kw in movie_keywords)
+class TitlesRequest(BaseModel):
+    titles: List[str]
 
-def calculate_similarity(query: str, title: str) -> float:
-    """Улучшенный расчет схожести"""
-    query_norm = normalize_title(query)
-    title_norm = normalize_title(title)
-    
-    # Штраф за фильм если ищется сериал
-    penalty = 0.3 if is_movie(title) and not is_movie(query) else 0
-    
-    # Базовая схожесть
-    base_ratio = SequenceMatcher(None, query_norm, title_norm).ratio()
-    
-    # Бонус за совпадение слов
-    query_words = set(query_norm.split())
-    title_words = set(title_norm.split())
-    word_overlap = len(query_words & title_words) / max(len(query_words), 1)
-    
-    return max(0, (base_ratio * 0.6 + word_overlap * 0.4) - penalty)
+class WarmRequest(TitlesRequest):
+    episodes: int = 1
 
+# ========== SMART SEARCH ==========
 def find_best_match(results, query):
     """Умный выбор лучшего результата"""
     if not results:
         return None
     
-    scored = [(res, calculate_similarity(query, res.title)) for res in results]
+    query_features = title_features(query)
+    scored = [(res, similarity(query_features, title_features(res.title))) for res in results]
     scored.sort(key=lambda x: x[1], reverse=True)
     
     logger.info(f"🔍 Search results for '{query}':")
@@ -108,147 +150,674 @@ def find_best_match(results, query):
     return best_match
 
 # ========== CORE FUNCTIONS ==========
-async def get_anime_episodes(title: str):
-    """Получение эпизодов с Redis кэшированием (Safe Mode)"""
-    # Caching removed for anime objects due to pickle serialization issues with RLock
-    # cache_key = f"anime:{normalize_title(title)}"
-    # try:
-    #     cached = cache.get(cache_key)
-    #     if cached:
-    #         logger.info(f"⚡ Redis Cache HIT for: {title}")
-    #         return cached
-    # except Exception as e:
-    #     logger.error(f"⚠️ Cache GET failed: {e}")
+CATALOG_TTL = 7200
+# Жесткий TTL ссылки и мягкий, после которого она обновляется в фоне
+VIDEO_TTL = int(os.getenv("VIDEO_TTL", "10800"))
+VIDEO_SOFT_TTL = int(os.getenv("VIDEO_SOFT_TTL", "3600"))
+# Сколько после жесткого TTL ссылку еще можно отдать, если upstream недоступен
+VIDEO_STALE_IF_ERROR = int(os.getenv("VIDEO_STALE_IF_ERROR", "3600"))
+
+# Параллельное разрешение источников: сколько опрашивать, сколько ждать,
+# и качество, которого достаточно для ответа без ожидания остальных
+VIDEO_SOURCE_BUDGET = int(os.getenv("VIDEO_SOURCE_BUDGET", "3"))
+VIDEO_RESOLVE_DEADLINE = float(os.getenv("VIDEO_RESOLVE_DEADLINE", "5"))
+VIDEO_GOOD_QUALITY = int(os.getenv("VIDEO_GOOD_QUALITY", "720"))
+
+# Пакетное разрешение эпизодов
+BATCH_MAX_EPISODES = int(os.getenv("BATCH_MAX_EPISODES", "50"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "10"))
+
+# Фоновый прогрев следующих эпизодов
+PREFETCH_DEPTH = int(os.getenv("PREFETCH_DEPTH", "2"))
+
+# Прогрев популярных тайтлов: записи обновляются за WARMER_LEAD секунд до истечения
+WARMER_LEAD = int(os.getenv("WARMER_LEAD", "600"))
+WARMER_INTERVAL = float(os.getenv("WARMER_INTERVAL", "60"))
+WARMER_BUDGET = int(os.getenv("WARMER_BUDGET", "20"))
+
+# Готовый ответ /streams: время жизни в кэше и для клиентов/nginx
+STREAMS_RESPONSE_TTL = int(os.getenv("STREAMS_RESPONSE_TTL", "300"))
+STREAMS_CACHE_CONTROL = f"public, max-age={int(os.getenv('STREAMS_MAX_AGE', '60'))}"
+# Страницы /streams: размер окна вокруг эпизода (around) и максимальный limit
+STREAMS_WINDOW = int(os.getenv("STREAMS_WINDOW", "50"))
+STREAMS_MAX_LIMIT = int(os.getenv("STREAMS_MAX_LIMIT", "500"))
+
+# Массовые операции с кэшем (/cache/warm, /cache/invalidate)
+BULK_MAX_TITLES = int(os.getenv("BULK_MAX_TITLES", "100"))
+BULK_MAX_EPISODES = 10
+
+# Объединение одинаковых конкурентных запросов к upstream
+catalog_flight = make_single_flight("catalog", cache)
+video_flight = make_single_flight("video", cache)
+
+# Запрос/алиас -> карточка аниме, чтобы повторный поиск не ходил в a_search
+title_index = TitleIndex(cache)
+
+def catalog_cache_key(key: str) -> str:
+    return f"anime:{key}"
+
+def anime_key(catalog: AnimeCatalog) -> str:
+    """Ключ аниме (slug карточки) - тег всех его записей в кэше"""
+    return card_key(catalog.url, catalog.title)
+
+async def load_cached_catalog(cache_key: str, track: bool = True) -> Optional[AnimeCatalog]:
+    try:
+        return AnimeCatalog.from_cache(await cache.aget(cache_key, track=track))
+    except Exception as e:
+        logger.error(f"⚠️ Cache GET failed: {e}")
+        return None
+
+async def load_cached_video(cache_key: str, track: bool = True) -> Optional[VideoEntry]:
+    """track=False - чтение для фоновых проверок: без метрик и учета попаданий"""
+    try:
+        return VideoEntry.from_cache(await cache.aget(cache_key, track=track))
+    except Exception as e:
+        logger.error(f"⚠️ Cache GET failed: {e}")
+    return None
+
+async def load_usable_video(cache_key: str) -> Optional["ResolvedVideo"]:
+    """Запись из кэша, если она еще не истекла (опрос single-flight, без метрик)"""
+    entry = await load_cached_video(cache_key, track=False)
+    if entry and entry.state(VIDEO_SOFT_TTL, VIDEO_TTL) != EXPIRED:
+        return entry, ""
+    return None
+
+async def load_indexed_catalog(
+    title: str, card: Optional[dict] = None, track: bool = True
+) -> Optional[AnimeCatalog]:
+    """Каталог по известной карточке (через индекс названий)"""
+    card = card or await title_index.lookup(title, track=track)
+    if not card:
+        return None
+    return await load_cached_catalog(catalog_cache_key(card["key"]), track=track)
+
+def upstream_unavailable(e: UpstreamUnavailable) -> HTTPException:
+    """503 с Retry-After, пока breaker этапа не пропускает запросы"""
+    return HTTPException(
+        status_code=503,
+        detail="Upstream temporarily unavailable",
+        headers={"Retry-After": str(max(1, int(e.retry_after)))},
+    )
+
+async def get_anime_episodes(title: str) -> AnimeCatalog:
+    """Получение каталога эпизодов с Redis кэшированием"""
+    card = await title_index.lookup(title)
+    # Без карточки повторный lookup только исказит счетчики промахов
+    cached = await load_indexed_catalog(title, card) if card else None
+    if cached:
+        logger.info(f"⚡ Redis Cache HIT for: {title}")
+        warmer.observe_hit(catalog_cache_key(card["key"]))
+        return cached
     
-    logger.info(f"🔄 Fetching anime: {title}")
-    results = await extractor.a_search(title)
+    try:
+        return await catalog_flight.do(
+            normalize_title(title),
+            lambda: fetch_catalog(title, card),
+            lookup=lambda: load_indexed_catalog(title, track=False),
+        )
+    except UpstreamUnavailable as e:
+        # Каталога нет в кэше, а upstream сейчас не опрашиваем - быстрый отказ
+        logger.warning(f"🔌 {e} for: {title}")
+        raise upstream_unavailable(e)
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Upstream timeout")
+
+def build_search_card(card: dict):
+    """Карточка поиска из индекса названий, без запроса a_search"""
+    extractor = get_extractor()
+    build = getattr(extractor, "build_search", None)
+    if build is not None:
+        return build(card["title"], card.get("thumbnail", ""), card["url"])
+    return Search(
+        title=card["title"], thumbnail=card.get("thumbnail", ""), url=card["url"],
+        **extractor._kwargs_http
+    )
+
+async def fetch_catalog(title: str, card: Optional[dict] = None) -> AnimeCatalog:
+    """Загрузка списка эпизодов из upstream; поиск только для неизвестных названий"""
+    if card:
+        logger.info(f"🔗 Known card for '{title}': {card['title']}")
+        anime_card = build_search_card(card)
+    else:
+        logger.info(f"🔄 Fetching anime: {title}")
+        results = await upstream.call("search", lambda: get_extractor().a_search(title))
+        
+        if not results:
+            raise HTTPException(status_code=404, detail="Anime not found")
+        
+        anime_card = find_best_match(results, title)
     
-    if not results:
-        raise HTTPException(status_code=404, detail="Anime not found")
+    anime_details = await upstream.call("anime", anime_card.a_get_anime)
+    episodes = await upstream.call("episodes", anime_details.a_get_episodes)
     
-    anime_card = find_best_match(results, title)
-    anime_details = await anime_card.a_get_anime()
-    episodes = anime_details.get_episodes()
+    catalog = AnimeCatalog.from_anicli(anime_card, anime_details, episodes)
+    key = card_key(anime_card.url, anime_card.title)
     
-    result = (anime_details, episodes)
+    try:
+        await cache.aset(catalog_cache_key(key), catalog, ttl_seconds=CATALOG_TTL, tag=key)
+        await title_index.register(
+            {"key": key, "title": anime_card.title, "url": anime_card.url, "thumbnail": anime_card.thumbnail},
+            [title, anime_card.title, catalog.title],
+        )
+        logger.info(f"📦 Cached {len(catalog.episodes)} episodes for: {catalog.title}")
+    except Exception as e:
+        logger.error(f"⚠️ Cache SET failed: {e}")
     
-    # Caching of complex objects is disabled
-    # try:
-    #     cache.set(cache_key, result, ttl_seconds=7200)
-    #     logger.info(f"📦 Cached {len(episodes)} episodes for: {anime_details.title}")
-    # except Exception as e:
-    #     logger.error(f"⚠️ Cache SET failed (Serialization Error): {e}")
+    return catalog
+
+def video_cache_key(catalog: AnimeCatalog, ep_num: str) -> str:
+    return f"video:{anime_key(catalog)}:{ep_num}"
+
+def streams_cache_key(
+    catalog: AnimeCatalog, preload: int, preload_start: int, start: int, end: int
+) -> Optional[str]:
+    """Ключ готового ответа только для типовых окон: весь список и страницы по
+    STREAMS_WINDOW с кратным началом. Иначе offset/limit клиента дают O(серий²) ключей.
+
+    preload_start в ключе: окно around= может совпасть со страницей offset,
+    но предзагружены в нем другие эпизоды.
+    """
+    total = len(catalog.episodes)
+    whole = start == 0 and end == total
+    page = start % STREAMS_WINDOW == 0 and (end - start == STREAMS_WINDOW or end == total)
+    if not (whole or page):
+        return None
+    return f"streams:{anime_key(catalog)}:{preload}:{preload_start}:{start}:{end}"
+
+# Ссылки на задачи фонового обновления, чтобы их не собрал GC
+refresh_tasks: set = set()
+
+# Итог разрешения эпизода: запись или None и причина ("no_sources", "no_videos", "error")
+ResolvedVideo = Tuple[Optional[VideoEntry], str]
+
+def serve_cached_video(
+    catalog: AnimeCatalog, episode: EpisodeRecord, entry: Optional[VideoEntry], track: bool = True
+) -> Optional[VideoEntry]:
+    """Stale-while-revalidate: свежую и устаревшую запись отдаем сразу, истекшую - нет.
+
+    track=False - фоновый вызов (prefetch): попадания считаем только для клиентов.
+    """
+    state = entry.state(VIDEO_SOFT_TTL, VIDEO_TTL) if entry else "miss"
+    if track:
+        video_cache_total.labels(state=state).inc()
     
-    return result
+    if track and state in (FRESH, STALE):
+        warmer.observe_hit(video_cache_key(catalog, episode.num))
+    if state == FRESH:
+        logger.info(f"⚡ Video cache HIT: EP{episode.num}")
+        return entry
+    if state == STALE:
+        logger.info(f"♻️ Video cache STALE: EP{episode.num}, refreshing in background")
+        schedule_video_refresh(catalog, episode, entry)
+        return entry
+    return None
 
-async def resolve_video_url_fast(episode, title: str, ep_num: str):
-    """Быстрое разрешение URL с кэшированием (Safe Mode)"""
-    cache_key = f"video:{normalize_title(title)}:{ep_num}"
+async def load_fresher_video(cache_key: str, stale: VideoEntry) -> Optional[ResolvedVideo]:
+    """Запись новее stale - значит, ее уже обновил другой воркер"""
+    entry = await load_cached_video(cache_key, track=False)
+    if entry and entry.fetched_at > stale.fetched_at:
+        return entry, ""
+    return None
+
+def schedule_video_refresh(catalog: AnimeCatalog, episode: EpisodeRecord, stale: VideoEntry):
+    flight_key = (anime_key(catalog), episode.num)
+    if video_flight.in_flight(flight_key):
+        return
+    cache_key = video_cache_key(catalog, episode.num)
+    # lookup включает межпроцессную блокировку: устаревшую запись обновляет один воркер
+    task = asyncio.create_task(video_flight.do(
+        flight_key,
+        lambda: fetch_video_entry(catalog, episode, cache_key),
+        lookup=lambda: load_fresher_video(cache_key, stale),
+    ))
+    refresh_tasks.add(task)
+    task.add_done_callback(refresh_done)
+
+def refresh_done(task: asyncio.Task):
+    refresh_tasks.discard(task)
+    # Открытый breaker: клиент уже получил устаревшую запись, обновим позже
+    if not task.cancelled() and task.exception() is not None:
+        logger.warning(f"♻️ Background refresh skipped: {task.exception()}")
+
+async def resolve_video_entry(
+    catalog: AnimeCatalog,
+    episode: EpisodeRecord,
+    check_cache: bool = True,
+    stale: Optional[VideoEntry] = None,
+    track: bool = True,
+) -> ResolvedVideo:
+    """Запись эпизода со всеми вариантами: из кэша или из upstream"""
+    ep_num = episode.num
+    cache_key = video_cache_key(catalog, ep_num)
     
-    try:
-        cached = cache.get(cache_key)
+    # check_cache=False, если вызывающий уже проверил кэш (например, через mget)
+    if check_cache:
+        stale = await load_cached_video(cache_key, track)
+        cached = serve_cached_video(catalog, episode, stale, track)
         if cached:
-            logger.info(f"⚡ Video cache HIT: EP{ep_num}")
-            return tuple(cached) if isinstance(cached, list) else cached
-    except Exception as e:
-        logger.error(f"⚠️ Cache GET failed: {e}")
+            return cached, ""
     
+    return await video_flight.do(
+        (anime_key(catalog), ep_num),
+        lambda: fetch_video_entry(catalog, episode, cache_key, stale),
+        lookup=lambda: load_usable_video(cache_key),
+    )
+
+async def resolve_video_url_fast(
+    catalog: AnimeCatalog,
+    episode: EpisodeRecord,
+    check_cache: bool = True,
+    stale: Optional[VideoEntry] = None,
+    track: bool = True,
+) -> Tuple[str, str]:
+    """Быстрое разрешение URL с кэшированием (Safe Mode)"""
+    entry, reason = await resolve_video_entry(catalog, episode, check_cache, stale, track)
+    return entry.as_tuple() if entry else ("", reason)
+
+def stale_if_error(entry: Optional[VideoEntry]) -> Optional[VideoEntry]:
+    """Истекшая запись, которую еще можно отдать при недоступном upstream"""
+    if entry and entry.state(VIDEO_SOFT_TTL, VIDEO_TTL + VIDEO_STALE_IF_ERROR) != EXPIRED:
+        video_cache_total.labels(state="stale_if_error").inc()
+        return entry
+    return None
+
+async def fetch_source_variants(source) -> List[dict]:
+    """Варианты видео одного источника (озвучки)"""
+    videos = await upstream.call("videos", source.a_get_videos)
+    return [
+        {"url": v.url, "quality": parse_quality(v.quality), "source": source.title}
+        for v in videos or []
+        if v.url
+    ]
+
+def rank_variants(found: Dict[int, List[dict]]) -> List[dict]:
+    """Лучшее качество первым; при равенстве - порядок источников upstream"""
+    variants, seen = [], set()
+    for index in sorted(found):
+        for variant in found[index]:
+            if variant["url"] not in seen:
+                seen.add(variant["url"])
+                variants.append(variant)
+    variants.sort(key=lambda v: v["quality"], reverse=True)
+    return variants
+
+async def store_video(catalog: AnimeCatalog, cache_key: str, entry: VideoEntry):
+    # Не кэшируем дольше, чем живет сама подписанная ссылка;
+    # после VIDEO_TTL запись хранится только как запасная на время сбоя
+    ttl = entry.ttl(VIDEO_TTL + VIDEO_STALE_IF_ERROR)
+    if ttl > 0:
+        try:
+            await cache.aset(cache_key, entry, ttl_seconds=ttl, tag=anime_key(catalog))
+        except Exception as e:
+            logger.error(f"⚠️ Cache SET failed: {e}")
+
+def collect_variants(done, tasks: Dict[asyncio.Future, int], found: Dict[int, List[dict]], errors: list):
+    for task in done:
+        if task.cancelled():
+            continue
+        error = task.exception()
+        if error is None:
+            found[tasks[task]] = task.result()
+        else:
+            errors.append(error)
+
+async def complete_variants(catalog: AnimeCatalog, pending, tasks, found, deadline: float, cache_key: str):
+    """Дожидается остальных источников до дедлайна и дописывает полный список в кэш"""
+    loop = asyncio.get_running_loop()
+    done, pending = await asyncio.wait(pending, timeout=max(0, deadline - loop.time()))
+    for task in pending:
+        task.cancel()
+    known = sum(len(v) for v in found.values())
+    collect_variants(done, tasks, found, [])
+    if sum(len(v) for v in found.values()) > known:
+        await store_video(catalog, cache_key, VideoEntry.from_variants(rank_variants(found)))
+
+async def fetch_video_entry(
+    catalog: AnimeCatalog,
+    episode: EpisodeRecord,
+    cache_key: str,
+    stale: Optional[VideoEntry] = None,
+) -> ResolvedVideo:
+    """Получение ссылки на видео из upstream: источники опрашиваются параллельно.
+
+    Ответ - как только есть вариант не хуже VIDEO_GOOD_QUALITY (или по дедлайну),
+    остальные источники дописываются в кэш в фоне.
+    """
+    ep_num = episode.num
     logger.info(f"🎬 Resolving video: EP{ep_num}")
     
     try:
-        sources = await episode.a_get_sources()
+        sources = await upstream.call("sources", catalog.to_episode(episode, get_extractor()).a_get_sources)
         if not sources:
-            return "", "no_sources"
+            return None, "no_sources"
         
-        videos = await sources[0].a_get_videos()
-        if not videos:
-            return "", "no_videos"
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + VIDEO_RESOLVE_DEADLINE
+        tasks = {
+            asyncio.ensure_future(fetch_source_variants(source)): index
+            for index, source in enumerate(sources[:VIDEO_SOURCE_BUDGET])
+        }
+        found: Dict[int, List[dict]] = {}
+        errors: list = []
+        pending = set(tasks)
+        while pending and loop.time() < deadline:
+            done, pending = await asyncio.wait(
+                pending, timeout=deadline - loop.time(), return_when=asyncio.FIRST_COMPLETED
+            )
+            collect_variants(done, tasks, found, errors)
+            if any(v["quality"] >= VIDEO_GOOD_QUALITY for vs in found.values() for v in vs):
+                break
         
-        # Сортировка по качеству
-        def quality_score(v):
-            q = str(v.quality).lower()
-            scores = {'1080': 1080, '720': 720, '480': 480, '360': 360, '240': 240}
-            for key, val in scores.items():
-                if key in q:
-                    return val
-            return 0
+        variants = rank_variants(found)
+        if pending:
+            if variants:
+                task = asyncio.create_task(complete_variants(catalog, pending, tasks, found, deadline, cache_key))
+                refresh_tasks.add(task)
+                task.add_done_callback(refresh_tasks.discard)
+            else:
+                for task in pending:
+                    task.cancel()
         
-        videos.sort(key=quality_score, reverse=True)
-        best = videos[0]
+        if not variants:
+            if errors:
+                raise errors[0]
+            if pending:
+                raise asyncio.TimeoutError(f"no source resolved in {VIDEO_RESOLVE_DEADLINE}s")
+            return None, "no_videos"
         
-        result = (best.url, str(best.quality))
+        entry = VideoEntry.from_variants(variants)
+        await store_video(catalog, cache_key, entry)
         
-        try:
-            cache.set(cache_key, result, ttl_seconds=10800)
-        except Exception as e:
-            logger.error(f"⚠️ Cache SET failed: {e}")
-            
-        logger.info(f"✅ Resolved EP{ep_num}: {result[1]}")
-        return result
+        logger.info(f"✅ Resolved EP{ep_num}: {entry.quality} ({len(found)}/{len(tasks)} sources)")
+        return entry, ""
         
+    except UpstreamUnavailable as e:
+        # Запрос не отправлялся: без запасной записи это 503, а не "нет видео"
+        fallback = stale_if_error(stale)
+        if fallback:
+            logger.warning(f"♻️ Serving expired video for EP{ep_num}: {e}")
+            return fallback, ""
+        raise
     except Exception as e:
-        logger.error(f"❌ Error resolving EP{ep_num}: {e}")
-        return "", "error"
+        logger.error(f"❌ Error resolving EP{ep_num}: {e!r}")
+        fallback = stale_if_error(stale)
+        if fallback:
+            logger.warning(f"♻️ Serving expired video for EP{ep_num} while upstream is failing")
+            return fallback, ""
+        return None, "error"
+
+# ========== PREFETCH ==========
+async def is_video_warm(catalog: AnimeCatalog, episode: EpisodeRecord) -> bool:
+    """Эпизод уже свежий в кэше или его прямо сейчас разрешает другой запрос"""
+    if video_flight.in_flight((anime_key(catalog), episode.num)):
+        return True
+    entry = await load_cached_video(video_cache_key(catalog, episode.num), track=False)
+    return entry is not None and entry.state(VIDEO_SOFT_TTL, VIDEO_TTL) == FRESH
+
+async def prefetch_video(catalog: AnimeCatalog, episode: EpisodeRecord) -> Tuple[str, str]:
+    return await resolve_video_url_fast(catalog, episode, track=False)
+
+prefetcher = PrefetchScheduler(
+    resolve=prefetch_video,
+    is_warm=is_video_warm,
+    concurrency=int(os.getenv("PREFETCH_CONCURRENCY", "2")),
+    queue_size=int(os.getenv("PREFETCH_QUEUE_SIZE", "100")),
+)
+
+def schedule_prefetch(catalog: AnimeCatalog, after_num: Optional[str]):
+    """Прогрев PREFETCH_DEPTH эпизодов после after_num (None - с начала)"""
+    if PREFETCH_DEPTH <= 0:
+        return
+    if after_num is None:
+        episodes = catalog.episodes[:PREFETCH_DEPTH]
+    else:
+        episodes = catalog.episodes_after(after_num, PREFETCH_DEPTH)
+    prefetcher.schedule(catalog, episodes)
+
+# ========== POPULARITY WARMER ==========
+async def warm_catalog(title: str) -> Tuple[Optional[AnimeCatalog], Optional[str]]:
+    """Каталог для прогрева; обновляется, если истечет в ближайшие WARMER_LEAD секунд"""
+    card = await title_index.lookup(title, track=False)
+    cached = await load_indexed_catalog(title, card, track=False) if card else None
+    if cached and time.time() - cached.fetched_at < CATALOG_TTL - WARMER_LEAD:
+        return cached, None
+    if cached is None:
+        # UpstreamUnavailable не перехватываем: прогрев останавливает цикл, а не тратит бюджет
+        catalog = await catalog_flight.do(
+            normalize_title(title),
+            lambda: fetch_catalog(title, card),
+            lookup=lambda: load_indexed_catalog(title, track=False),
+        )
+    else:
+        # Кэшированный каталог еще действителен, но нужен новый: годится только более свежий
+        catalog = await catalog_flight.do(
+            normalize_title(title),
+            lambda: fetch_catalog(title, card),
+            lookup=lambda: load_fresher_catalog(title, card, cached),
+        )
+    return catalog, catalog_cache_key(anime_key(catalog))
+
+async def load_fresher_catalog(title: str, card: dict, stale: AnimeCatalog) -> Optional[AnimeCatalog]:
+    """Каталог новее stale - его уже обновил другой воркер"""
+    catalog = await load_indexed_catalog(title, card, track=False)
+    if catalog and catalog.fetched_at > stale.fetched_at:
+        return catalog
+    return None
+
+async def warm_video(catalog: AnimeCatalog, episode: EpisodeRecord) -> Optional[str]:
+    """Обновление ссылки, если она устареет в ближайшие WARMER_LEAD секунд"""
+    if video_flight.in_flight((anime_key(catalog), episode.num)):
+        return None
+    cache_key = video_cache_key(catalog, episode.num)
+    entry = await load_cached_video(cache_key, track=False)
+    if entry and entry.state(
+        VIDEO_SOFT_TTL - WARMER_LEAD, VIDEO_TTL - WARMER_LEAD, expiry_margin=60 + WARMER_LEAD
+    ) == FRESH:
+        return None
+    resolved, reason = await resolve_video_entry(catalog, episode, check_cache=False, stale=entry)
+    if resolved is None:
+        raise RuntimeError(f"no video source resolved: {reason}")
+    # Прежняя запись (stale-if-error) или ссылка, которую нельзя сохранить, - не обновление
+    if resolved is entry or resolved.ttl(VIDEO_TTL + VIDEO_STALE_IF_ERROR) <= 0:
+        raise RuntimeError("upstream failed, expired entry kept")
+    return cache_key
+
+async def warmer_budget() -> int:
+    """Бюджет цикла прогрева на все воркеры.
+
+    С Redis кэш общий: прогревает один воркер, удерживающий аренду, с полным бюджетом.
+    Без Redis у каждого воркера свой кэш, а upstream общий - бюджет делится поровну.
+    """
+    if cache.use_redis:
+        # Аренда переживает пару циклов: лидер продлевает ее в начале каждого
+        return WARMER_BUDGET if await cache.alease("warmer", WARMER_INTERVAL * 3) else 0
+    return max(1, WARMER_BUDGET // WORKERS)
+
+warmer = PopularityWarmer(
+    warm_catalog=warm_catalog,
+    warm_video=warm_video,
+    interval=WARMER_INTERVAL,
+    budget=WARMER_BUDGET,
+    top_k=int(os.getenv("WARMER_TOP_K", "20")),
+    latest_episodes=int(os.getenv("WARMER_LATEST_EPISODES", "1")),
+    hot_episodes=int(os.getenv("WARMER_HOT_EPISODES", "2")),
+    half_life=float(os.getenv("WARMER_HALF_LIFE", "3600")),
+    warmed_ttl=VIDEO_TTL,
+    upstream_degraded=upstream.degraded,
+    cycle_budget=warmer_budget,
+)
+
+# ========== STREAMING MODE ==========
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+def format_stream_event(mode: str, event: str, data: dict) -> str:
+    """Одна запись потока: строка NDJSON или событие SSE"""
+    if mode == "sse":
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+    return json.dumps({"type": event, **data}, ensure_ascii=False) + "\n"
+
+def episode_item(ep: EpisodeRecord, url: str = "", quality: str = "default") -> dict:
+    return {
+        "title": ep.title or f"Эпизод {ep.num}",
+        "num": ep.num,
+        "url": url,
+        "quality": quality,
+        "duration": 0,
+        "thumbnail": "",
+        "ready": bool(url),
+    }
+
+def episode_window(
+    catalog: AnimeCatalog, offset: int, limit: Optional[int], around: Optional[str]
+) -> Tuple[int, int, int]:
+    """Окно [start, end) списка эпизодов и индекс первого предзагружаемого.
+
+    around - окно из limit (или STREAMS_WINDOW) серий с этим эпизодом в середине,
+    предзагрузка начинается с него; иначе окно offset/limit (без limit - до конца).
+    """
+    total = len(catalog.episodes)
+    if around is not None:
+        index = next((i for i, ep in enumerate(catalog.episodes) if ep.num == str(around)), None)
+        if index is None:
+            raise HTTPException(status_code=404, detail="Episode not found")
+        size = limit or STREAMS_WINDOW
+        start = max(0, min(index - size // 2, total - size))
+        return start, min(total, start + size), index
+    start = min(offset, total)
+    end = total if limit is None else min(total, start + limit)
+    return start, end, start
+
+def record_app_time(start_time: datetime):
+    """Время сборки ответа - этап app в Server-Timing (при SERVER_TIMING=1)"""
+    record_stage("app", (datetime.now() - start_time).total_seconds())
+
+def page_info(catalog: AnimeCatalog, start: int, end: int) -> dict:
+    total = len(catalog.episodes)
+    return {
+        "total_episodes": total,
+        "offset": start,
+        "next_offset": end if end < total else None,
+    }
+
+async def stream_episodes(
+    catalog: AnimeCatalog, window: List[EpisodeRecord], preload_eps: List[EpisodeRecord],
+    page: dict, mode: str, start_time: datetime
+):
+    """Сначала заголовок и список эпизодов окна, затем ссылки по мере разрешения"""
+    yield format_stream_event(mode, "anime", {
+        "anime_title": catalog.title,
+        **page,
+        "streaming_episodes": [episode_item(ep) for ep in window],
+    })
+    
+    async def resolve(ep: EpisodeRecord):
+        try:
+            return ep, await resolve_video_url_fast(catalog, ep)
+        except Exception as e:
+            logger.error(f"❌ Error streaming EP{ep.num}: {e}")
+            return ep, ("", "error")
+    
+    tasks = [asyncio.ensure_future(resolve(ep)) for ep in preload_eps]
+    for next_done in asyncio.as_completed(tasks):
+        ep, (url, quality) = await next_done
+        yield format_stream_event(mode, "episode", {
+            "num": ep.num,
+            "url": url,
+            "quality": quality,
+            "ready": bool(url),
+        })
+    
+    load_time = (datetime.now() - start_time).total_seconds()
+    logger.info(f"⏱️ Total stream time: {load_time:.2f}s")
+    yield format_stream_event(mode, "done", {"load_time": round(load_time, 2)})
 
 # ========== ENDPOINTS ==========
 @app.get("/streams", response_model=StreamingResponseModel)
 async def get_streams(
+    request: Request,
+    background_tasks: BackgroundTasks,
     title: str = Query(..., description="Anime title"),
-    preload: int = Query(1, ge=0, le=5, description="Number of episodes to preload")
+    preload: int = Query(1, ge=0, le=5, description="Number of episodes to preload"),
+    stream: Optional[str] = Query(
+        None, pattern="^(ndjson|sse)$",
+        description="Stream the episode list first and each preloaded URL as it resolves"
+    ),
+    offset: int = Query(0, ge=0, description="Index of the first episode in the page"),
+    limit: Optional[int] = Query(
+        None, ge=1, le=STREAMS_MAX_LIMIT, description="Page size; all episodes from offset if omitted"
+    ),
+    around: Optional[str] = Query(
+        None, description="Episode number to center the page on; preload starts from it"
+    )
 ):
-    """Основной эндпоинт с предзагрузкой первых эпизодов"""
+    """Основной эндпоинт с предзагрузкой первых эпизодов окна"""
     start_time = datetime.now()
+    warmer.record(title)
     
     try:
-        anime_details, episodes = await get_anime_episodes(title)
-        items: List[StreamingEpisode] = []
+        catalog = await get_anime_episodes(title)
         
-        # Параллельная загрузка первых N эпизодов
-        preload_count = min(preload, len(episodes))
-        preload_tasks = []
+        # Материализуется и предзагружается только запрошенное окно
+        start, end, preload_start = episode_window(catalog, offset, limit, around)
+        window = catalog.episodes[start:end]
+        preload_eps = catalog.episodes[preload_start:min(end, preload_start + preload)]
+        page = page_info(catalog, start, end)
         
-        for i, ep in enumerate(episodes):
-            if i < preload_count:
-                preload_tasks.append(
-                    resolve_video_url_fast(ep, anime_details.title, str(ep.num))
-                )
+        # Прогрев эпизодов сразу за окном предзагрузки
+        last_num = preload_eps[-1].num if preload_eps else None
+        background_tasks.add_task(schedule_prefetch, catalog, last_num)
         
-        # Ждем загрузки всех preload эпизодов
-        preloaded_urls = await asyncio.gather(*preload_tasks, return_exceptions=True)
-        
-        # Формируем список эпизодов
-        for i, ep in enumerate(episodes):
-            url = ""
-            quality = "default"
-            ready = False
-            
-            if i < preload_count:
-                result = preloaded_urls[i]
-                if isinstance(result, tuple):
-                    url, quality = result
-                    ready = bool(url)
-            
-            items.append(
-                StreamingEpisode(
-                    title=ep.title or f"Эпизод {ep.num}",
-                    num=str(ep.num),
-                    url=url,
-                    quality=quality,
-                    ready=ready,
-                    duration=0,
-                    thumbnail=""
-                )
+        if stream:
+            return StreamingResponse(
+                stream_episodes(catalog, window, preload_eps, page, stream, start_time),
+                media_type=STREAM_MEDIA_TYPES[stream],
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
             )
         
+        # Готовый ответ действителен, пока каталог в кэше тот же
+        response_key = streams_cache_key(catalog, len(preload_eps), preload_start, start, end)
+        cached = await cache.aget(response_key) if response_key else None
+        if cached and cached.get("catalog") == catalog.fetched_at:
+            record_app_time(start_time)
+            return cached_response(request, cached, STREAMS_CACHE_CONTROL, {"X-Cache": "HIT"})
+        
+        # Ждем загрузки всех preload эпизодов
+        preloaded_urls = await asyncio.gather(
+            *(resolve_video_url_fast(catalog, ep) for ep in preload_eps),
+            return_exceptions=True,
+        )
+        resolved = {
+            ep.num: result for ep, result in zip(preload_eps, preloaded_urls)
+            if isinstance(result, tuple)
+        }
+        
+        # Список эпизодов сразу в dict: модели Pydantic на сотни серий заметно медленнее
+        items = [episode_item(ep, *resolved.get(ep.num, ("", "default"))) for ep in window]
+        
         load_time = (datetime.now() - start_time).total_seconds()
         logger.info(f"⏱️ Total load time: {load_time:.2f}s")
         
-        return StreamingResponseModel(
-            anime_title=anime_details.title,
-            total_episodes=len(items),
-            streaming_episodes=items,
-            load_time=round(load_time, 2)
-        )
+        # Время сборки не в теле: иначе у одинаковых ответов разные ETag
+        entry = build_entry(dump_json({
+            "anime_title": catalog.title,
+            **page,
+            "streaming_episodes": items,
+        }), catalog=catalog.fetched_at)
+        
+        # Ответ с неразрешенными ссылками не кэшируем: следующий запрос может получить их
+        complete = len(resolved) == len(preload_eps) and all(url for url, _ in resolved.values())
+        if complete:
+            if response_key:
+                await cache.aset(response_key, entry, ttl_seconds=STREAMS_RESPONSE_TTL, tag=anime_key(catalog))
+            cache_control = STREAMS_CACHE_CONTROL
+        else:
+            cache_control = "no-cache"
+        record_app_time(start_time)
+        return cached_response(request, entry, cache_control, {"X-Cache": "MISS"})
         
     except HTTPException:
         raise
@@ -258,30 +827,50 @@ async def get_streams(
 
 @app.get("/stream/episode")
 async def get_episode_stream(
+    background_tasks: BackgroundTasks,
     title: str = Query(...),
-    episode_num: str = Query(...)
+    episode_num: str = Query(...),
+    quality: Optional[str] = Query(None, description="Preferred quality, e.g. 720 or 1080p")
 ):
     """Загрузка конкретного эпизода"""
     try:
         logger.info(f"📥 Request: {title} - EP{episode_num}")
+        warmer.record(title, episode_num)
         
-        _, episodes = await get_anime_episodes(title)
+        catalog = await get_anime_episodes(title)
         
-        target_ep = next((ep for ep in episodes if str(ep.num) == episode_num), None)
+        target_ep = catalog.find_episode(episode_num)
         
         if not target_ep:
             raise HTTPException(status_code=404, detail="Episode not found")
         
-        url, quality = await resolve_video_url_fast(target_ep, title, episode_num)
+        try:
+            entry, _ = await resolve_video_entry(catalog, target_ep)
+        except UpstreamUnavailable as e:
+            logger.warning(f"🔌 {e} for: {title} EP{episode_num}")
+            raise upstream_unavailable(e)
+        url, resolved_quality = entry.pick(parse_quality(quality)) if entry else ("", "")
         
         if not url:
             raise HTTPException(status_code=404, detail="Video source unavailable")
         
+        # Ранжированный список остальных вариантов: смена качества и
+        # переключение на другой источник без нового запроса к upstream
+        alternatives = [
+            {"url": v["url"], "quality": str(v["quality"]), "source": v["source"]}
+            for v in entry.variants
+            if v["url"] != url
+        ]
+        
+        # Следующие серии прогреваются после отправки ответа
+        background_tasks.add_task(schedule_prefetch, catalog, target_ep.num)
+        
         return {
             "url": url,
-            "quality": quality,
+            "quality": resolved_quality,
             "num": episode_num,
-            "ready": True
+            "ready": True,
+            "alternatives": alternatives,
         }
         
     except HTTPException:
@@ -290,16 +879,182 @@ async def get_episode_stream(
         logger.error(f"❌ Error: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+def parse_episode_numbers(spec: str) -> List[str]:
+    """Разбор списка эпизодов вида "1,2,5-8" с сохранением порядка"""
+    nums: List[str] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, _, end = part.partition("-")
+            if not (start.strip().isdigit() and end.strip().isdigit()):
+                raise HTTPException(status_code=400, detail=f"Invalid episode range: {part}")
+            first, last = int(start), int(end)
+            if last < first or last - first >= BATCH_MAX_EPISODES:
+                raise HTTPException(status_code=400, detail=f"Invalid episode range: {part}")
+            nums.extend(str(n) for n in range(first, last + 1))
+        else:
+            nums.append(part)
+        if len(nums) > BATCH_MAX_EPISODES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Too many episodes, max {BATCH_MAX_EPISODES} per request"
+            )
+    return list(dict.fromkeys(nums))
+
+@app.get("/stream/batch")
+async def get_episode_batch(
+    title: str = Query(..., description="Anime title"),
+    episodes: str = Query(..., description="Episode numbers and ranges, e.g. 1,2,5-8"),
+    concurrency: int = Query(
+        BATCH_CONCURRENCY, ge=1, le=BATCH_MAX_CONCURRENCY,
+        description="Max episodes resolved in parallel"
+    )
+):
+    """Пакетная загрузка эпизодов: один поиск и один mget на весь запрос"""
+    start_time = datetime.now()
+    nums = parse_episode_numbers(episodes)
+    if not nums:
+        raise HTTPException(status_code=400, detail="No episodes requested")
+    warmer.record(title)
+    
+    try:
+        catalog = await get_anime_episodes(title)
+        by_num = {ep.num: ep for ep in catalog.episodes}
+        targets = [by_num[num] for num in nums if num in by_num]
+        missing = [num for num in nums if num not in by_num]
+        
+        cached = await cache.amget([video_cache_key(catalog, ep.num) for ep in targets])
+        results: Dict[str, tuple] = {}
+        pending = []
+        entries: Dict[str, Optional[VideoEntry]] = {}
+        for ep, value in zip(targets, cached):
+            entries[ep.num] = VideoEntry.from_cache(value)
+            usable = serve_cached_video(catalog, ep, entries[ep.num])
+            if usable:
+                results[ep.num] = usable.as_tuple()
+            else:
+                pending.append(ep)
+        
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def resolve(ep: EpisodeRecord):
+            async with semaphore:
+                return await resolve_video_url_fast(catalog, ep, check_cache=False, stale=entries[ep.num])
+        
+        resolved = await asyncio.gather(*(resolve(ep) for ep in pending), return_exceptions=True)
+        for ep, result in zip(pending, resolved):
+            results[ep.num] = result if isinstance(result, tuple) else ("", "error")
+        
+        load_time = (datetime.now() - start_time).total_seconds()
+        logger.info(
+            f"📦 Batch {catalog.title}: {len(targets)} episodes, "
+            f"{len(targets) - len(pending)} cached, {load_time:.2f}s"
+        )
+        
+        return {
+            "anime_title": catalog.title,
+            "episodes": [
+                {
+                    "num": ep.num,
+                    "url": results[ep.num][0],
+                    "quality": results[ep.num][1],
+                    "ready": bool(results[ep.num][0]),
+                }
+                for ep in targets
+            ],
+            "missing": missing,
+            "load_time": round(load_time, 2),
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"❌ Error in get_episode_batch: {e}", exc_info=True)
+        raise HTTPException(status_code=500, detail=str(e))
+
+async def invalidate_title(title: str) -> dict:
+    """Удаление каталога, ссылок и алиасов аниме по индексу его ключей"""
+    card = await title_index.lookup(title)
+    await title_index.forget(title)
+    if not card:
+        return {"title": title, "cached": False, "deleted": 0}
+    deleted = await cache.ainvalidate(card["key"])
+    logger.info(f"🧹 Invalidated {deleted} keys for: {card['title']}")
+    return {"title": title, "cached": True, "anime": card["title"], "deleted": deleted}
+
+def check_bulk_titles(titles: List[str]) -> List[str]:
+    titles = list(dict.fromkeys(t.strip() for t in titles if t.strip()))
+    if not titles:
+        raise HTTPException(status_code=400, detail="No titles given")
+    if len(titles) > BULK_MAX_TITLES:
+        raise HTTPException(status_code=400, detail=f"Too many titles, max {BULK_MAX_TITLES} per request")
+    return titles
+
 @app.post("/cache/clear")
 async def clear_cache(title: Optional[str] = None):
     """Очистка кэша"""
     if title:
-        key = f"anime:{normalize_title(title)}"
-        cache.delete(key)
-        return {"message": f"Cache cleared for: {title}"}
+        result = await invalidate_title(title)
+        return {"message": f"Cache cleared for: {title}", **result}
+    
+    # Только ключи сервиса: Redis общий с Laravel API
+    deleted = await cache.aclear_all()
+    return {"message": "All caches cleared", "deleted": deleted}
+
+@app.post("/cache/invalidate")
+async def invalidate_titles(request: TitlesRequest):
+    """Массовый сброс кэша по списку названий"""
+    titles = check_bulk_titles(request.titles)
+    results = await asyncio.gather(*(invalidate_title(title) for title in titles))
+    return {"titles": results, "deleted": sum(r["deleted"] for r in results)}
+
+@app.post("/cache/warm")
+async def warm_titles(request: WarmRequest):
+    """Массовый прогрев: каталоги сразу, первые эпизоды - через очередь prefetch"""
+    titles = check_bulk_titles(request.titles)
+    episodes = max(0, min(request.episodes, BULK_MAX_EPISODES))
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
     
-    cache.clear_all()
-    return {"message": "All caches cleared"}
+    async def warm(title: str) -> dict:
+        async with semaphore:
+            try:
+                catalog = await get_anime_episodes(title)
+            except HTTPException as e:
+                return {"title": title, "status": "error", "detail": e.detail}
+            except Exception as e:
+                logger.error(f"⚠️ Warm failed for {title}: {e}")
+                return {"title": title, "status": "error", "detail": str(e)}
+            scheduled = prefetcher.schedule(catalog, catalog.episodes[:episodes])
+            return {
+                "title": title,
+                "status": "ok",
+                "anime": catalog.title,
+                "total_episodes": len(catalog.episodes),
+                "episodes_scheduled": scheduled,
+            }
+    
+    results = await asyncio.gather(*(warm(title) for title in titles))
+    return {"titles": results, "warmed": sum(r["status"] == "ok" for r in results)}
+
+@app.get("/cache/stats")
+async def cache_stats():
+    """Статистика кэша и объединения запросов"""
+    return {
+        **cache.stats(),
+        "singleflight": {
+            "catalog": catalog_flight.stats(),
+            "video": video_flight.stats(),
+        },
+        "title_index": title_index.stats(),
+        "prefetch": prefetcher.stats(),
+        "warmer": warmer.stats(),
+        "hls_segments": hls_segments.stats(),
+        # Счетчики вызовов есть только у подменного extractor
+        "upstream": dict(getattr(get_extractor(), "calls", {})),
+        "upstream_governor": upstream.stats(),
+    }
 
 @app.get("/health")
 async def health_check():
@@ -310,6 +1065,21 @@ async def health_check():
         "redis": cache.use_redis
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Готовность принимать трафик: startup завершен, пул Redis прогрет"""
+    redis_ok = cache.use_redis or not REDIS_REQUIRED
+    ready = state["ready"] and redis_ok
+    body = {"ready": ready, "startup": state["ready"], "redis": cache.use_redis, "pid": os.getpid()}
+    return JSONResponse(body, status_code=200 if ready else 503)
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=9000, log_level="info")
\ No newline at end of file
+    if WORKERS > 1:
+        # Метрики всех процессов собираются через общий каталог prometheus_client
+        if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+            import tempfile
+            os.environ["PROMETHEUS_MULTIPROC_DIR"] = tempfile.mkdtemp(prefix="aniyume-metrics-")
+        uvicorn.run("app:app", host="0.0.0.0", port=9000, log_level="info", workers=WORKERS)
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=9000, log_level="info")
\ No newline at end of file
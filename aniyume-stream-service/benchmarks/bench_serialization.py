@@ -0,0 +1,105 @@
+"""Сравнение pickle (старый формат кэша) и serializer на типичных записях.
+
+Для каждой записи: байты в Redis, время записи и чтения. pickle получает
+те же объекты (AnimeCatalog, VideoEntry), что и serializer.
+
+Запуск: python benchmarks/bench_serialization.py [--rounds 2000]
+"""
+import argparse
+import os
+import pickle
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serializer  # noqa: E402
+from catalog import AnimeCatalog, EpisodeRecord  # noqa: E402
+from video_cache import VideoEntry  # noqa: E402
+
+DUBBERS = {"1": "AniLibria", "2": "StudioBand", "3": "AniDUB", "4": "Субтитры", "5": "Dream Cast"}
+
+
+def make_catalog(episodes: int, movie: bool = False) -> AnimeCatalog:
+    """Каталог как из animego: id эпизодов, русские названия, у фильма - плееры"""
+    rng = random.Random(episodes)
+    base = rng.randint(10_000, 99_999)
+    videos = [
+        {"data_provide_dubbing": key, "player": f"//kodik.info/serial/{base}/{rng.getrandbits(64):x}/720p"}
+        for key in DUBBERS
+    ] if movie else []
+    return AnimeCatalog(
+        title="Клинок, рассекающий демонов: Бесконечный поезд" if movie else "Магическая битва",
+        anime_id=str(base),
+        url=f"https://animego.me/anime/magicheskaya-bitva-{base}",
+        thumbnail=f"https://animego.me/upload/anime/images/{rng.getrandbits(64):x}.jpg",
+        dubbers=DUBBERS,
+        episodes=[
+            EpisodeRecord(id=str(base * 1000 + n), num=str(n), title=f"{n} серия", videos=videos)
+            for n in range(1, episodes + 1)
+        ],
+    )
+
+
+def make_video(variants: int) -> VideoEntry:
+    expires = int(time.time()) + 6 * 3600
+    ranked = [
+        {
+            "url": f"https://cloud.kodik-storage.com/useruploads/{i:08x}/{q}.mp4:hls:manifest.m3u8?expires={expires}",
+            "quality": q,
+            "source": list(DUBBERS.values())[i % len(DUBBERS)],
+        }
+        for i in range(variants)
+        for q in (1080, 720, 480)
+    ]
+    return VideoEntry.from_variants(ranked)
+
+
+CASES = [
+    ("catalog 12 ep", make_catalog(12)),
+    ("catalog 24 ep", make_catalog(24)),
+    ("catalog 220 ep", make_catalog(220)),
+    ("catalog 1100 ep", make_catalog(1100)),
+    ("movie (players)", make_catalog(1, movie=True)),
+    ("video, 1 source", make_video(1)),
+    ("video, 3 sources", make_video(3)),
+    ("title card", {"key": "magicheskaya-bitva-2014", "title": "Магическая битва",
+                    "url": "/anime/magicheskaya-bitva-2014", "thumbnail": ""}),
+]
+
+
+def timed(fn, value, rounds: int) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(value)
+    return (time.perf_counter() - start) / rounds * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'entry':<18} {'format':<12} {'bytes':>8} {'encode us':>10} {'decode us':>10}")
+    totals = {"pickle": 0, "serializer": 0}
+    for name, value in CASES:
+        rows = []
+        data = pickle.dumps(value)
+        rows.append(("pickle", len(data), timed(pickle.dumps, value, args.rounds), timed(pickle.loads, data, args.rounds)))
+        data = serializer.dumps(value)
+        assert serializer.loads(data) == value
+        rows.append(("serializer", len(data), timed(serializer.dumps, value, args.rounds),
+                     timed(serializer.loads, data, args.rounds)))
+        for fmt, size, encode_us, decode_us in rows:
+            totals[fmt] += size
+            print(f"{name:<18} {fmt:<12} {size:>8} {encode_us:>10.1f} {decode_us:>10.1f}")
+        print(f"{'':<18} {'ratio':<12} {rows[1][1] / rows[0][1]:>8.2f}")
+
+    print()
+    print(f"total bytes: pickle {totals['pickle']}, serializer {totals['serializer']} "
+          f"({totals['serializer'] / totals['pickle']:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Сравнение ранжирования и скорости: SequenceMatcher (старый путь) vs триграммы.
+
+Запуск: python benchmarks/bench_title_match.py [--rounds 200]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from difflib import SequenceMatcher
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from title_index import calculate_similarity, title_features, normalize_title, is_movie  # noqa: E402
+
+# Типичная выдача animego: русские названия, фильмы, продолжения
+CANDIDATES = [
+    "Клинок, рассекающий демонов", "Клинок, рассекающий демонов: Бесконечный поезд (фильм)",
+    "Клинок, рассекающий демонов: Квартал красных фонарей", "Клинок, рассекающий демонов: Деревня кузнецов",
+    "Kimetsu no Yaiba", "Kimetsu no Yaiba: Mugen Ressha-hen", "Demon Slayer: Kimetsu no Yaiba",
+    "Наруто", "Наруто: Ураганные хроники", "Naruto Shippuden", "Naruto the Movie: Ninja Clash",
+    "Боруто: Новое поколение Наруто", "Атака титанов", "Атака титанов: Финал. Часть 2",
+    "Shingeki no Kyojin", "Shingeki no Kyojin: The Final Season Part 2", "Attack on Titan",
+    "Тетрадь смерти", "Death Note", "Death Note: Relight", "Ван-Пис", "One Piece Film: Red",
+    "One Piece", "Магическая битва", "Jujutsu Kaisen 0 Movie", "Jujutsu Kaisen",
+    "Токийский гуль", "Tokyo Ghoul:re", "Tokyo Ghoul", "Ходячий замок", "Shinmai Maou no Testament BURST",
+    "Завещание нового короля демонов", "Shinmai Maou no Testament", "Сага о Винланде", "Vinland Saga",
+]
+QUERIES = [
+    "Kimetsu no Yaiba", "Demon Slayer", "Naruto", "Naruto Shippuden", "Shingeki no Kyojin",
+    "Attack on Titan", "Death Note", "One Piece", "Jujutsu Kaisen", "Tokyo Ghoul",
+    "Shinma Maou no Testament BURST", "Vinland Saga", "Тетрадь смерти", "Атака титанов",
+]
+
+
+def legacy_normalize(title: str) -> str:
+    title = title.lower().strip()
+    title = re.sub(r'\s+', ' ', title)
+    title = re.sub(r'[^\w\s]', '', title)
+    return title
+
+
+def legacy_is_movie(title: str) -> bool:
+    movie_keywords = [
+        'фильм', 'movie', 'film', 'поезд', 'бесконечный',
+        'train', 'infinity', 'муген', 'mugen', 'часть', 'part'
+    ]
+    return any(kw in title.lower() for kw in movie_keywords)
+
+
+def legacy_similarity(query: str, title: str) -> float:
+    """Прежний calculate_similarity из app.py"""
+    query_norm = legacy_normalize(query)
+    title_norm = legacy_normalize(title)
+    penalty = 0.3 if legacy_is_movie(title) and not legacy_is_movie(query) else 0
+    base_ratio = SequenceMatcher(None, query_norm, title_norm).ratio()
+    query_words = set(query_norm.split())
+    title_words = set(title_norm.split())
+    word_overlap = len(query_words & title_words) / max(len(query_words), 1)
+    return max(0, (base_ratio * 0.6 + word_overlap * 0.4) - penalty)
+
+
+def rank(score, query):
+    return sorted(CANDIDATES, key=lambda title: score(query, title), reverse=True)
+
+
+def clear_caches():
+    for fn in (title_features, normalize_title, is_movie):
+        fn.cache_clear()
+
+
+def timed(score, rounds: int, cold: bool) -> float:
+    start = time.perf_counter()
+    for _ in range(rounds):
+        if cold:
+            clear_caches()
+        for query in QUERIES:
+            for title in CANDIDATES:
+                score(query, title)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    top1 = 0
+    top3 = 0
+    print(f"{'query':<32} {'SequenceMatcher':<40} {'trigram':<40}")
+    for query in QUERIES:
+        legacy = rank(legacy_similarity, query)
+        fast = rank(calculate_similarity, query)
+        top1 += legacy[0] == fast[0]
+        top3 += len(set(legacy[:3]) & set(fast[:3]))
+        marker = "" if legacy[0] == fast[0] else "  *"
+        print(f"{query:<32} {legacy[0][:38]:<40} {fast[0][:38]:<40}{marker}")
+
+    pairs = len(QUERIES) * len(CANDIDATES) * args.rounds
+    legacy_time = timed(legacy_similarity, args.rounds, cold=False)
+    cold_time = timed(calculate_similarity, args.rounds, cold=True)
+    warm_time = timed(calculate_similarity, args.rounds, cold=False)
+
+    print()
+    print(f"top-1 agreement: {top1}/{len(QUERIES)}, top-3 overlap: {top3 / (3 * len(QUERIES)):.0%}")
+    print(f"{'matcher':<26} {'total, s':>10} {'us/pair':>10} {'speedup':>9}")
+    for name, elapsed in (
+        ("SequenceMatcher", legacy_time),
+        ("trigram (cold caches)", cold_time),
+        ("trigram (warm caches)", warm_time),
+    ):
+        print(f"{name:<26} {elapsed:>10.3f} {elapsed / pairs * 1e6:>10.2f} {legacy_time / elapsed:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
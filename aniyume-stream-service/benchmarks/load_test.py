@@ -0,0 +1,228 @@
+"""Нагрузочный тест stream-сервиса на локальном FakeExtractor.
+
+Приложение запускается в процессе (httpx + ASGITransport), upstream заменен
+FakeExtractor с заданной задержкой и долей ошибок, поэтому результаты
+воспроизводимы и не зависят от animego. Для каждого сценария и уровня
+конкурентности считаются p50/p95/p99, пропускная способность и число
+вызовов upstream по стадиям. Результаты сохраняются в JSON для сравнения
+между коммитами.
+
+    python benchmarks/load_test.py
+    python benchmarks/load_test.py --concurrency 1,8,32 --requests 300 --latency-ms 80
+    python benchmarks/load_test.py --compare benchmarks/results/<old>.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+SCENARIOS = ("streams", "episode", "episode_warm", "batch")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--concurrency", default="1,4,16,64", help="comma-separated levels")
+    parser.add_argument("--requests", type=int, default=200, help="requests per level")
+    parser.add_argument("--titles", type=int, default=20, help="distinct titles in the hot set")
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--jitter", type=float, default=0.3)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--catalog-size", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--redis", action="store_true", help="use REDIS_URL instead of the memory cache")
+    parser.add_argument("--output", help="result file (default: results/<commit>.json)")
+    parser.add_argument("--compare", help="previous result file to diff against")
+    return parser.parse_args()
+
+
+def configure_env(args):
+    """Настройки нужно выставить до импорта app"""
+    os.environ["STREAM_EXTRACTOR"] = "fake"
+    os.environ["FAKE_LATENCY_MS"] = str(args.latency_ms)
+    os.environ["FAKE_JITTER"] = str(args.jitter)
+    os.environ["FAKE_ERROR_RATE"] = str(args.error_rate)
+    os.environ["FAKE_CATALOG_SIZE"] = str(args.catalog_size)
+    os.environ["FAKE_SEED"] = str(args.seed)
+    # Фоновый прогрев искажает счетчики upstream в замерах
+    os.environ.setdefault("PREFETCH_DEPTH", "0")
+    os.environ.setdefault("WARMER_INTERVAL", "0")
+    if not args.redis:
+        os.environ["REDIS_URL"] = "redis://127.0.0.1:1"
+    sys.path.insert(0, ROOT)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class LoadTest:
+    def __init__(self, args):
+        import httpx
+        import app as service
+
+        self.args = args
+        self.service = service
+        self.httpx = httpx
+        self.rng = random.Random(args.seed)
+        self.titles = service.get_extractor().titles[:args.titles]
+
+    def pick_title(self) -> str:
+        # Zipf-подобное распределение: несколько тайтлов получают большую часть запросов
+        weights = [1 / (rank + 1) for rank in range(len(self.titles))]
+        return self.rng.choices(self.titles, weights=weights)[0]
+
+    def request_for(self, scenario: str):
+        title = self.pick_title()
+        if scenario == "streams":
+            return "/streams", {"title": title, "preload": 2}
+        if scenario == "batch":
+            return "/stream/batch", {"title": title, "episodes": "1-4"}
+        return "/stream/episode", {"title": title, "episode_num": "1"}
+
+    async def reset(self):
+        """Холодный старт между замерами: пустой кэш и счетчики"""
+        await self.service.cache.aclear_all()
+        self.service.get_extractor().calls.clear()
+
+    async def warm(self, client):
+        for title in self.titles:
+            await client.get("/stream/episode", params={"title": title, "episode_num": "1"})
+        self.service.get_extractor().calls.clear()
+
+    async def run_level(self, client, scenario: str, concurrency: int):
+        await self.reset()
+        if scenario == "episode_warm":
+            await self.warm(client)
+
+        latencies = []
+        errors = 0
+        queue = asyncio.Queue()
+        for _ in range(self.args.requests):
+            queue.put_nowait(self.request_for(scenario))
+
+        async def worker():
+            nonlocal errors
+            while True:
+                try:
+                    path, params = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                start = time.perf_counter()
+                try:
+                    response = await client.get(path, params=params)
+                    if response.status_code >= 400:
+                        errors += 1
+                except Exception:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+        return {
+            "scenario": scenario,
+            "concurrency": concurrency,
+            "requests": len(latencies),
+            "errors": errors,
+            "throughput_rps": round(len(latencies) / elapsed, 2),
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "mean_ms": round(statistics.mean(latencies) * 1000, 2) if latencies else 0.0,
+            "upstream_calls": dict(self.service.get_extractor().calls),
+        }
+
+    async def run(self):
+        results = []
+        transport = self.httpx.ASGITransport(app=self.service.app)
+        async with self.service.app.router.lifespan_context(self.service.app):
+            async with self.httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+                for scenario in self.args.scenarios.split(","):
+                    for level in (int(c) for c in self.args.concurrency.split(",")):
+                        result = await self.run_level(client, scenario, level)
+                        results.append(result)
+                        print_row(result)
+        return results
+
+
+def print_header():
+    print(f"{'scenario':<14}{'conc':>6}{'req':>6}{'err':>5}{'rps':>10}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}  upstream calls")
+
+
+def print_row(result):
+    calls = " ".join(f"{k}={v}" for k, v in sorted(result["upstream_calls"].items()))
+    print(f"{result['scenario']:<14}{result['concurrency']:>6}{result['requests']:>6}{result['errors']:>5}"
+          f"{result['throughput_rps']:>10.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+          f"{result['p99_ms']:>10.1f}  {calls}")
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    old = {(r["scenario"], r["concurrency"]): r for r in baseline["results"]}
+    print(f"\nvs {baseline['commit']} ({baseline_path}):")
+    print(f"{'scenario':<14}{'conc':>6}{'rps':>12}{'p95':>12}{'p99':>12}{'upstream':>12}")
+    for result in results:
+        prev = old.get((result["scenario"], result["concurrency"]))
+        if not prev:
+            continue
+
+        def delta(key):
+            return f"{(result[key] - prev[key]) / prev[key] * 100:+.1f}%" if prev[key] else "n/a"
+
+        upstream = sum(result["upstream_calls"].values()) - sum(prev["upstream_calls"].values())
+        print(f"{result['scenario']:<14}{result['concurrency']:>6}{delta('throughput_rps'):>12}"
+              f"{delta('p95_ms'):>12}{delta('p99_ms'):>12}{upstream:>+12d}")
+
+
+def main():
+    args = parse_args()
+    configure_env(args)
+    test = LoadTest(args)
+
+    print_header()
+    results = asyncio.run(test.run())
+
+    commit = git_commit()
+    output = args.output or os.path.join(RESULTS_DIR, f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+            "results": results,
+        }, f, indent=2)
+    print(f"\nSaved: {output}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
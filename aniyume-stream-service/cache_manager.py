@@ -1,56 +1,538 @@
 import redis
-import pickle
-from typing import Optional, Any
+import redis.asyncio as aioredis
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Any, Callable, Dict, List
 import os
 import logging
 
+import serializer
+from serializer import SerializationError
+from snapshot import CacheSnapshot
+
 logger = logging.getLogger(__name__)
 
+# Версия схемы ключей: увеличение делает старые ключи невидимыми (истекут по TTL)
+CACHE_KEY_VERSION = 1
+# Ключи пачками при очистке пространства имен
+SCAN_BATCH = 500
+
+# Аренда роли: берется, если свободна, и продлевается только владельцем
+LEASE_SCRIPT = """
+local owner = redis.call('get', KEYS[1])
+if not owner then
+    redis.call('set', KEYS[1], ARGV[1], 'PX', ARGV[2])
+    return 1
+end
+if owner == ARGV[1] then
+    redis.call('pexpire', KEYS[1], ARGV[2])
+    return 1
+end
+return 0
+"""
+
+class MemoryCache:
+    """In-process кэш с LRU-вытеснением и TTL на каждый ключ.
+
+    Ограничивается числом записей и (опционально) бюджетом в байтах;
+    размер записи оценивается по длине msgpack только при заданном бюджете.
+    Индекс тегов обновляется при любом удалении записи, включая вытеснение и истечение.
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # ключ -> (время истечения, значение, размер, тег)
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._tags: Dict[str, set] = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value, _, _ = entry
+            if expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: str, value: Any, ttl_seconds: float, tag: Optional[str] = None):
+        if ttl_seconds <= 0:
+            return
+        size = len(serializer.pack(value)) if self.max_bytes else 0
+        if self.max_bytes and size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (time.monotonic() + ttl_seconds, value, size, tag)
+            self.bytes += size
+            if tag is not None:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.max_entries or (self.max_bytes and self.bytes > self.max_bytes):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+
+    def delete_tag(self, tag: str) -> List[str]:
+        """Удаление всех живых записей тега; возвращает их ключи"""
+        with self._lock:
+            keys = list(self._tags.get(tag, ()))
+            for key in keys:
+                self._remove(key)
+            return keys
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+            self.bytes = 0
+
+    def _remove(self, key: str):
+        _, _, size, tag = self._data.pop(key)
+        self.bytes -= size
+        if tag is not None:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._data),
+            "tags": len(self._tags),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
 class CacheManager:
     def __init__(self):
-        redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379')
-        try:
-            # decode_responses=False ensures we get bytes for pickle
-            self.redis_client = redis.from_url(redis_url, decode_responses=False)
-            self.redis_client.ping()
-            self.use_redis = True
-            print("✅ Redis connected (Pickle mode)")
-        except Exception as e:
-            self.use_redis = False
-            self.memory_cache = {}
-            print(f"⚠️ Redis unavailable, using memory cache. Error: {e}")
-    
+        self.redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379')
+        # Ограничения для async-клиента: размер пула и таймаут одной операции
+        self.max_connections = int(os.getenv('REDIS_MAX_CONNECTIONS', '20'))
+        self.op_timeout = float(os.getenv('REDIS_OP_TIMEOUT', '0.5'))
+        self.async_client = None
+        # L1 перед Redis (или основное хранилище без Redis)
+        self.memory_cache = MemoryCache(
+            max_entries=int(os.getenv('MEMORY_CACHE_MAX_ENTRIES', '10000')),
+            max_bytes=int(os.getenv('MEMORY_CACHE_MAX_BYTES', '0')),
+        )
+        # Время жизни копии в L1; короткое, чтобы воркеры не расходились надолго
+        self.l1_ttl = float(os.getenv('CACHE_L1_TTL', '30'))
+        # Наблюдатели для метрик (подключаются в monitoring):
+        # on_operation(op, seconds, error) - каждая операция Redis,
+        # on_lookup(key, tier, hit) - каждое чтение ключа async API
+        self.on_operation: Optional[Callable[[str, float, Optional[BaseException]], None]] = None
+        self.on_lookup: Optional[Callable[[str, str, bool], None]] = None
+        # Все ключи сервиса в Redis под общим префиксом: тот же Redis использует Laravel API
+        self.namespace = f"{os.getenv('CACHE_NAMESPACE', 'aniyume:streams')}:v{CACHE_KEY_VERSION}"
+        # Подключение не при импорте, а в connect() на старте приложения;
+        # до него и при недоступном Redis работает memory-кэш
+        self.use_redis = False
+        self.redis_client = None
+        # Соединения, открываемые заранее в connect()
+        self.warm_connections = min(int(os.getenv('REDIS_WARM_CONNECTIONS', '4')), self.max_connections)
+        # Период проверки Redis: переключение на memory и обратно без рестарта
+        self.health_interval = float(os.getenv('REDIS_HEALTH_INTERVAL', '5'))
+        self._health_task: Optional[asyncio.Task] = None
+        # Снимок каталогов на диске: промахи после рестарта или сброса Redis
+        self.snapshot: Optional[CacheSnapshot] = CacheSnapshot.from_env()
+        # Владелец аренд alease: у каждого процесса свой
+        self.lease_token = uuid.uuid4().hex
+
+    # ========== ПОДКЛЮЧЕНИЕ ==========
+    def _create_async_client(self):
+        # Пул блокирующий: при исчерпании соединений ждем не дольше op_timeout.
+        # decode_responses=False: значения - байты serializer
+        pool = aioredis.BlockingConnectionPool.from_url(
+            self.redis_url,
+            max_connections=self.max_connections,
+            timeout=self.op_timeout,
+            socket_timeout=self.op_timeout,
+            socket_connect_timeout=self.op_timeout,
+            decode_responses=False,
+        )
+        return aioredis.Redis(connection_pool=pool)
+
+    async def _ping(self) -> bool:
+        try:
+            return bool(await asyncio.wait_for(self.async_client.ping(), timeout=self.op_timeout))
+        except Exception as e:
+            logger.debug(f"Redis ping failed: {e!r}")
+            return False
+
+    def _set_available(self, available: bool):
+        if available == self.use_redis:
+            return
+        self.use_redis = available
+        if available:
+            # Записи времени сбоя живут полный TTL, а L1 - не дольше l1_ttl:
+            # иначе воркер часами отдает свою копию вместо общей
+            self.memory_cache.clear()
+            print("✅ Redis connected (msgpack mode)")
+        else:
+            print("⚠️ Redis unavailable, using memory cache")
+
+    async def connect(self) -> bool:
+        """Одна попытка подключения (не дольше op_timeout) и прогрев пула"""
+        if self.async_client is None:
+            self.async_client = self._create_async_client()
+        available = await self._ping()
+        if available and self.warm_connections > 1:
+            # Параллельные ping открывают сразу несколько соединений пула
+            await asyncio.gather(*(self._ping() for _ in range(self.warm_connections)))
+        self._set_available(available)
+        return available
+
+    def start_health_checks(self):
+        if self._health_task is None and self.health_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop(), name="redis-health")
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            self._set_available(await self._ping())
+
+    def _sync_client(self):
+        """Синхронный клиент для скриптов: подключается при первом обращении"""
+        if self.redis_client is None:
+            try:
+                client = redis.from_url(
+                    self.redis_url, decode_responses=False,
+                    socket_timeout=self.op_timeout, socket_connect_timeout=self.op_timeout,
+                )
+                client.ping()
+                self.redis_client = client
+            except Exception as e:
+                print(f"⚠️ Redis unavailable, using memory cache. Error: {e}")
+                self.redis_client = False
+        return self.redis_client or None
+
+    def rkey(self, key: str) -> str:
+        """Полное имя ключа в Redis"""
+        return f"{self.namespace}:{key}"
+
+    def index_key(self, tag: str) -> str:
+        return self.rkey(f"idx:{tag}")
+
+    @staticmethod
+    def _decode(key: str, data: Optional[bytes]) -> Optional[Any]:
+        """Непонятная запись (старый pickle, другая версия схемы) - просто промах"""
+        if not data:
+            return None
+        try:
+            return serializer.loads(data)
+        except SerializationError as e:
+            logger.warning(f"⚠️ Skipping cache value {key}: {e}")
+            return None
+
+    @property
+    def use_l1(self) -> bool:
+        return self.use_redis and self.l1_ttl > 0
+
+    def _fill_l1(self, key: str, value: Any, ttl_seconds: float = None):
+        if self.use_l1 and value is not None:
+            ttl = self.l1_ttl if ttl_seconds is None else min(self.l1_ttl, ttl_seconds)
+            self.memory_cache.set(key, value, ttl)
+
+    # ========== SYNC API (скрипты) ==========
     def get(self, key: str) -> Optional[Any]:
         try:
-            if self.use_redis:
-                data = self.redis_client.get(key)
-                return pickle.loads(data) if data else None
+            client = self._sync_client()
+            if client is not None:
+                if self.use_l1:
+                    value = self.memory_cache.get(key)
+                    if value is not None:
+                        return value
+                data = client.get(self.rkey(key))
+                value = self._decode(key, data)
+                self._fill_l1(key, value)
+                return value
             return self.memory_cache.get(key)
         except Exception as e:
             print(f"❌ Cache GET error: {e}")
             return None
-    
+
     def set(self, key: str, value: Any, ttl_seconds: int = 3600):
         try:
-            if self.use_redis:
-                # Store as bytes
-                self.redis_client.setex(key, ttl_seconds, pickle.dumps(value))
+            client = self._sync_client()
+            if client is not None:
+                client.setex(self.rkey(key), ttl_seconds, serializer.dumps(value))
+                self._fill_l1(key, value, ttl_seconds)
             else:
-                self.memory_cache[key] = value
+                self.memory_cache.set(key, value, ttl_seconds)
         except Exception as e:
             print(f"❌ Cache SET error: {e}")
             # Don't crash main thread if cache fails
-    
+
     def delete(self, key: str):
-        if self.use_redis:
-            self.redis_client.delete(key)
-        else:
-            self.memory_cache.pop(key, None)
-    
+        self.memory_cache.delete(key)
+        client = self._sync_client()
+        if client is not None:
+            client.delete(self.rkey(key))
+
     def clear_all(self):
-        if self.use_redis:
-            self.redis_client.flushdb()
-        else:
-            self.memory_cache.clear()
+        """Удаляет только ключи своего пространства имен (не flushdb)"""
+        self.memory_cache.clear()
+        client = self._sync_client()
+        if client is not None:
+            batch = []
+            for key in client.scan_iter(match=f"{self.namespace}:*", count=SCAN_BATCH):
+                batch.append(key)
+                if len(batch) >= SCAN_BATCH:
+                    client.unlink(*batch)
+                    batch = []
+            if batch:
+                client.unlink(*batch)
+
+    # ========== ASYNC API (обработчики FastAPI) ==========
+    async def _run(self, op: str, coro):
+        start = time.perf_counter()
+        error = None
+        try:
+            return await asyncio.wait_for(coro, timeout=self.op_timeout)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            if self.on_operation is not None:
+                self.on_operation(op, time.perf_counter() - start, error)
+
+    def _lookup(self, key: str, tier: str, value: Any, track: bool = True) -> Any:
+        if track and self.on_lookup is not None:
+            self.on_lookup(key, tier, value is not None)
+        return value
+
+    async def _restore(self, key: str, track: bool = True) -> Optional[Any]:
+        """Запись из снимка на диске; возвращается в кэш с оставшимся TTL"""
+        if self.snapshot is None or not self.snapshot.accepts(key):
+            return None
+        try:
+            restored = await self.snapshot.get(key)
+        except Exception as e:
+            logger.error(f"❌ Snapshot GET error: {e!r}")
+            return None
+        if restored is None:
+            return None
+        data, ttl, tag = restored
+        value = self._decode(key, data)
+        if value is not None:
+            await self.amset({key: value}, ttl_seconds=int(ttl), tag=tag, snapshot=False)
+            self._lookup(key, "snapshot", value, track)
+        return value
+
+    async def aget(self, key: str, track: bool = True) -> Optional[Any]:
+        """track=False - фоновая проверка (прогрев, prefetch), не учитывается в метриках попаданий"""
+        try:
+            if self.use_redis:
+                if self.use_l1:
+                    value = self.memory_cache.get(key)
+                    if value is not None:
+                        return self._lookup(key, "l1", value, track)
+                data = await self._run("get", self.async_client.get(self.rkey(key)))
+                value = self._decode(key, data)
+                self._fill_l1(key, value)
+                self._lookup(key, "redis", value, track)
+            else:
+                value = self._lookup(key, "memory", self.memory_cache.get(key), track)
+        except Exception as e:
+            logger.error(f"❌ Cache GET error: {e!r}")
+            value = self._lookup(key, "redis", None, track)
+        if value is None:
+            value = await self._restore(key, track)
+        return value
+
+    async def alease(self, name: str, ttl_seconds: float) -> bool:
+        """Роль одного процесса на ttl_seconds (например, лидер прогрева).
+
+        Повторный вызов владельцем продлевает аренду; если он упал, роль
+        освобождается по TTL. Без Redis процесс один на свой кэш - всегда True.
+        """
+        if not self.use_redis:
+            return True
+        try:
+            owned = await self._run("eval", self.async_client.eval(
+                LEASE_SCRIPT, 1, self.rkey(f"lease:{name}"), self.lease_token, int(ttl_seconds * 1000)
+            ))
+            return bool(owned)
+        except Exception as e:
+            logger.error(f"❌ Cache LEASE error: {e!r}")
+            return False
+
+    async def aset(self, key: str, value: Any, ttl_seconds: int = 3600, tag: Optional[str] = None):
+        """tag - группа для ainvalidate (например, ключ аниме)"""
+        if tag is not None:
+            return await self.amset({key: value}, ttl_seconds=ttl_seconds, tag=tag)
+        try:
+            if self.use_redis:
+                await self._run("setex", self.async_client.setex(self.rkey(key), ttl_seconds, serializer.dumps(value)))
+                self._fill_l1(key, value, ttl_seconds)
+            else:
+                self.memory_cache.set(key, value, ttl_seconds)
+        except Exception as e:
+            logger.error(f"❌ Cache SET error: {e!r}")
+
+    async def amget(self, keys: List[str]) -> List[Optional[Any]]:
+        """Чтение нескольких ключей за один round trip"""
+        if not keys:
+            return []
+        try:
+            if not self.use_redis:
+                return [self._lookup(k, "memory", self.memory_cache.get(k)) for k in keys]
+            result = [self.memory_cache.get(k) if self.use_l1 else None for k in keys]
+            missing = [i for i, value in enumerate(result) if value is None]
+            for i, value in enumerate(result):
+                if value is not None:
+                    self._lookup(keys[i], "l1", value)
+            if missing:
+                values = await self._run("mget", self.async_client.mget([self.rkey(keys[i]) for i in missing]))
+                for i, data in zip(missing, values):
+                    result[i] = self._decode(keys[i], data)
+                    self._fill_l1(keys[i], result[i])
+                    self._lookup(keys[i], "redis", result[i])
+            return result
+        except Exception as e:
+            logger.error(f"❌ Cache MGET error: {e!r}")
+            return [None] * len(keys)
+
+    async def amset(
+        self, mapping: Dict[str, Any], ttl_seconds: int = 3600, tag: Optional[str] = None, snapshot: bool = True
+    ):
+        """Запись нескольких ключей с TTL одним pipeline (и добавление в индекс тега).
+
+        snapshot=False - не писать в снимок на диске (запись из него и восстановлена)
+        """
+        if not mapping:
+            return
+        try:
+            encoded = {}
+            if self.use_redis:
+                encoded = {key: serializer.dumps(value) for key, value in mapping.items()}
+            if snapshot and self.snapshot is not None:
+                for key, value in mapping.items():
+                    if self.snapshot.accepts(key):
+                        data = encoded.get(key) or serializer.dumps(value)
+                        self.snapshot.record(key, data, ttl_seconds, tag)
+            if self.use_redis:
+                pipe = self.async_client.pipeline(transaction=False)
+                for key, data in encoded.items():
+                    pipe.setex(self.rkey(key), ttl_seconds, data)
+                if tag is not None:
+                    # Индекс живет столько же, сколько самая долгая запись тега:
+                    # NX задает TTL новому множеству, GT только продлевает (Redis 7+)
+                    index = self.index_key(tag)
+                    pipe.sadd(index, *mapping)
+                    pipe.expire(index, ttl_seconds, nx=True)
+                    pipe.expire(index, ttl_seconds, gt=True)
+                await self._run("pipeline", pipe.execute())
+                for key, value in mapping.items():
+                    self._fill_l1(key, value, ttl_seconds)
+            else:
+                for key, value in mapping.items():
+                    self.memory_cache.set(key, value, ttl_seconds, tag)
+        except Exception as e:
+            logger.error(f"❌ Cache MSET error: {e!r}")
+
+    async def adelete(self, *keys: str):
+        if not keys:
+            return
+        for key in keys:
+            self.memory_cache.delete(key)
+        if self.snapshot is not None:
+            await self.snapshot.forget(keys)
+        try:
+            if self.use_redis:
+                await self._run("delete", self.async_client.delete(*[self.rkey(k) for k in keys]))
+        except Exception as e:
+            logger.error(f"❌ Cache DELETE error: {e!r}")
+
+    async def ainvalidate(self, tag: str) -> int:
+        """Удаление всех ключей тега: O(ключей тега), остальные данные не трогаются"""
+        if self.snapshot is not None:
+            await self.snapshot.forget_tag(tag)
+        # Записи с тегом в памяти (режим без Redis или сбой) - в любом режиме
+        local = self.memory_cache.delete_tag(tag)
+        if not self.use_redis:
+            return len(local)
+        try:
+            index = self.index_key(tag)
+            members = await self._run("smembers", self.async_client.smembers(index))
+            keys = [m.decode() if isinstance(m, bytes) else m for m in members]
+            for key in keys:
+                self.memory_cache.delete(key)
+            await self._run("unlink", self.async_client.unlink(index, *[self.rkey(k) for k in keys]))
+            return len(set(keys) | set(local))
+        except Exception as e:
+            logger.error(f"❌ Cache INVALIDATE error: {e!r}")
+            return len(local)
+
+    async def aclear_all(self) -> int:
+        """Очистка только своего пространства имен: SCAN + UNLINK пачками, без flushdb"""
+        self.memory_cache.clear()
+        if self.snapshot is not None:
+            await self.snapshot.clear()
+        if not self.use_redis:
+            return 0
+        deleted = 0
+        cursor = 0
+        try:
+            while True:
+                cursor, keys = await self._run("scan", self.async_client.scan(
+                    cursor, match=f"{self.namespace}:*", count=SCAN_BATCH
+                ))
+                if keys:
+                    deleted += await self._run("unlink", self.async_client.unlink(*keys))
+                if not cursor:
+                    return deleted
+        except Exception as e:
+            logger.error(f"❌ Cache CLEAR error after {deleted} keys: {e!r}")
+            return deleted
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": "redis" if self.use_redis else "memory",
+            "namespace": self.namespace,
+            "l1_enabled": self.use_l1,
+            "memory": self.memory_cache.stats(),
+            "snapshot": self.snapshot.stats() if self.snapshot is not None else None,
+        }
+
+    async def aclose(self):
+        if self.snapshot is not None:
+            await self.snapshot.stop()
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        if self.async_client is not None:
+            await self.async_client.aclose()
+            self.async_client = None
+        self.use_redis = False
 
 cache = CacheManager()
@@ -0,0 +1,126 @@
+from dataclasses import dataclass, field
+from typing import List, Dict, Any, Optional
+import time
+
+from anicli_api.source.animego import Episode
+
+# Версия формата записи: при изменении полей старые записи в кэше игнорируются
+CATALOG_VERSION = 1
+
+
+@dataclass
+class EpisodeRecord:
+    """Минимальные данные эпизода для вызова a_get_sources"""
+    id: str
+    num: str
+    title: str
+    # Для фильмов animego отдает плееры сразу на странице эпизода
+    videos: List[Dict[str, str]] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {"id": self.id, "num": self.num, "title": self.title}
+        if self.videos:
+            data["videos"] = self.videos
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "EpisodeRecord":
+        return cls(
+            id=str(data["id"]),
+            num=str(data["num"]),
+            title=data.get("title") or "",
+            videos=list(data.get("videos") or []),
+        )
+
+
+@dataclass
+class AnimeCatalog:
+    """Сериализуемая карточка аниме со списком эпизодов"""
+    title: str
+    anime_id: str
+    url: str = ""
+    thumbnail: str = ""
+    dubbers: Dict[str, str] = field(default_factory=dict)
+    episodes: List[EpisodeRecord] = field(default_factory=list)
+    fetched_at: float = field(default_factory=time.time)
+
+    def find_episode(self, num: str) -> Optional[EpisodeRecord]:
+        return next((ep for ep in self.episodes if ep.num == str(num)), None)
+
+    def episodes_after(self, num: str, count: int) -> List[EpisodeRecord]:
+        """Следующие count эпизодов после num (в порядке каталога)"""
+        for i, ep in enumerate(self.episodes):
+            if ep.num == str(num):
+                return self.episodes[i + 1:i + 1 + count]
+        return []
+
+    def to_episode(self, record: EpisodeRecord, extractor) -> Episode:
+        """Восстановление anicli Episode без повторного поиска"""
+        # Подменный extractor (бенчмарки) строит эпизоды сам
+        build = getattr(extractor, "build_episode", None)
+        if build is not None:
+            return build(self, record)
+        return Episode(
+            title=record.title,
+            ordinal=int(record.num),
+            dubbers=self.dubbers,
+            id=record.id,
+            videos=record.videos,
+            **extractor._kwargs_http,
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "v": CATALOG_VERSION,
+            "title": self.title,
+            "anime_id": self.anime_id,
+            "url": self.url,
+            "thumbnail": self.thumbnail,
+            "dubbers": self.dubbers,
+            "episodes": [ep.to_dict() for ep in self.episodes],
+            "fetched_at": self.fetched_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> Optional["AnimeCatalog"]:
+        if not isinstance(data, dict) or data.get("v") != CATALOG_VERSION:
+            return None
+        return cls(
+            title=data["title"],
+            anime_id=str(data["anime_id"]),
+            url=data.get("url", ""),
+            thumbnail=data.get("thumbnail", ""),
+            dubbers=dict(data.get("dubbers") or {}),
+            episodes=[EpisodeRecord.from_dict(ep) for ep in data.get("episodes", [])],
+            fetched_at=data.get("fetched_at", 0.0),
+        )
+
+    @classmethod
+    def from_cache(cls, data: Any) -> Optional["AnimeCatalog"]:
+        """Значение кэша: объект (serializer, L1) или словарь старого формата"""
+        if isinstance(data, cls):
+            return data
+        return cls.from_dict(data)
+
+    @classmethod
+    def from_anicli(cls, card, anime, episodes) -> "AnimeCatalog":
+        """Снимок объектов anicli (Search, Anime, [Episode]) в простые данные"""
+        dubbers: Dict[str, str] = {}
+        for ep in episodes:
+            dubbers.update(getattr(ep, "dubbers", None) or {})
+        return cls(
+            title=anime.title,
+            anime_id=str(getattr(anime, "id", "")),
+            url=getattr(card, "url", ""),
+            thumbnail=getattr(anime, "thumbnail", "") or "",
+            dubbers=dubbers,
+            episodes=[
+                EpisodeRecord(
+                    id=str(ep.id),
+                    num=str(ep.num),
+                    title=ep.title or "",
+                    videos=list(getattr(ep, "videos", None) or []),
+                )
+                for ep in episodes
+            ],
+        )
@@ -0,0 +1,16 @@
+"""Окружение тестов: подменный upstream, без Redis, снимка и фоновых задач"""
+import os
+import tempfile
+
+os.environ.setdefault("STREAM_EXTRACTOR", "fake")
+os.environ.setdefault("FAKE_LATENCY_MS", "0")
+# Порт 1 закрыт: кэш сразу переходит в memory-режим
+os.environ.setdefault("REDIS_URL", "redis://127.0.0.1:1")
+os.environ.setdefault("REDIS_HEALTH_INTERVAL", "0")
+os.environ.setdefault("CACHE_SNAPSHOT_PATH", "")
+os.environ.setdefault("WARMER_INTERVAL", "0")
+os.environ.setdefault("PREFETCH_DEPTH", "0")
+os.environ.setdefault("HLS_CACHE_DIR", tempfile.mkdtemp(prefix="aniyume-hls-test-"))
+
+# Ручные скрипты с походом в настоящий upstream, не тесты
+collect_ignore = ["debug_test.py", "test_proxy_local.py"]
@@ -0,0 +1,196 @@
+"""Локальная замена animego Extractor для нагрузочных тестов и бенчмарков.
+
+Включается переменной STREAM_EXTRACTOR=fake. Задержка, доля ошибок и размер
+каталога настраиваются через FAKE_* переменные; все вызовы upstream
+считаются в `calls` по стадиям (search, anime, episodes, sources, videos).
+"""
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Dict, List
+import asyncio
+import os
+import random
+import time
+
+WORDS = [
+    "blade", "demon", "titan", "note", "piece", "ghoul", "saga", "sword", "spirit", "academy",
+    "hunter", "alchemist", "kaisen", "slayer", "shadow", "garden", "testament", "dragon", "ninja", "chronicle",
+]
+
+
+class FakeUpstreamError(RuntimeError):
+    pass
+
+
+class FakeUpstream:
+    """Общие настройки и счетчики для всех объектов одного FakeExtractor"""
+
+    def __init__(self, latency: float, jitter: float, error_rate: float, seed: int):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.calls: Counter = Counter()
+
+    async def call(self, stage: str):
+        self.calls[stage] += 1
+        delay = self.latency
+        if self.jitter:
+            delay *= self.random.lognormvariate(0, self.jitter)
+        await asyncio.sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            raise FakeUpstreamError(f"fake {stage} failure")
+
+
+@dataclass
+class FakeVideo:
+    url: str
+    quality: int
+    type: str = "m3u8"
+    headers: Dict[str, str] = field(default_factory=dict)
+
+
+@dataclass
+class FakeSource:
+    upstream: FakeUpstream
+    title: str
+    url: str
+
+    async def a_get_videos(self) -> List[FakeVideo]:
+        await self.upstream.call("videos")
+        expires = int(time.time()) + 6 * 3600
+        return [
+            FakeVideo(url=f"{self.url}/{quality}.m3u8?expires={expires}", quality=quality)
+            for quality in (480, 720, 1080)
+        ]
+
+
+@dataclass
+class FakeEpisode:
+    upstream: FakeUpstream
+    anime_slug: str
+    id: str
+    ordinal: int
+    title: str
+    dubbers: Dict[str, str] = field(default_factory=dict)
+    videos: list = field(default_factory=list)
+
+    @property
+    def num(self) -> str:
+        return str(self.ordinal)
+
+    async def a_get_sources(self) -> List[FakeSource]:
+        await self.upstream.call("sources")
+        return [
+            FakeSource(self.upstream, title=dub, url=f"https://fake.cdn/{self.anime_slug}/{self.ordinal}/{dub_id}")
+            for dub_id, dub in self.dubbers.items()
+        ]
+
+
+@dataclass
+class FakeAnime:
+    upstream: FakeUpstream
+    id: str
+    slug: str
+    title: str
+    thumbnail: str
+    episode_count: int
+    description: str = ""
+
+    async def a_get_episodes(self) -> List[FakeEpisode]:
+        await self.upstream.call("episodes")
+        dubbers = {"1": "AniLibria", "2": "StudioBand"}
+        return [
+            FakeEpisode(
+                self.upstream, anime_slug=self.slug, id=f"{self.id}{n:05d}", ordinal=n,
+                title=f"Episode {n}", dubbers=dubbers,
+            )
+            for n in range(1, self.episode_count + 1)
+        ]
+
+
+@dataclass
+class FakeSearch:
+    upstream: FakeUpstream
+    title: str
+    thumbnail: str
+    url: str
+    episode_count: int = 12
+
+    async def a_get_anime(self) -> FakeAnime:
+        await self.upstream.call("anime")
+        slug = self.url.rstrip("/").rsplit("/", 1)[-1]
+        return FakeAnime(
+            self.upstream, id=slug.rsplit("-", 1)[-1], slug=slug, title=self.title,
+            thumbnail=self.thumbnail, episode_count=self.episode_count,
+        )
+
+
+class FakeExtractor:
+    """Детерминированный каталог из catalog_size тайтлов"""
+
+    def __init__(
+        self,
+        latency: float = 0.05,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        catalog_size: int = 200,
+        max_episodes: int = 200,
+        seed: int = 42,
+    ):
+        self.upstream = FakeUpstream(latency, jitter, error_rate, seed)
+        rng = random.Random(seed)
+        self.catalog = []
+        for i in range(catalog_size):
+            title = " ".join(rng.sample(WORDS, 2)).title() + f" {i}"
+            slug = title.lower().replace(" ", "-")
+            self.catalog.append((title, f"/anime/{slug}-{i}", rng.randint(1, max_episodes)))
+
+    @classmethod
+    def from_env(cls) -> "FakeExtractor":
+        return cls(
+            latency=float(os.getenv("FAKE_LATENCY_MS", "50")) / 1000,
+            jitter=float(os.getenv("FAKE_JITTER", "0")),
+            error_rate=float(os.getenv("FAKE_ERROR_RATE", "0")),
+            catalog_size=int(os.getenv("FAKE_CATALOG_SIZE", "200")),
+            max_episodes=int(os.getenv("FAKE_MAX_EPISODES", "200")),
+            seed=int(os.getenv("FAKE_SEED", "42")),
+        )
+
+    @property
+    def calls(self) -> Counter:
+        return self.upstream.calls
+
+    @property
+    def titles(self) -> List[str]:
+        return [title for title, _, _ in self.catalog]
+
+    @property
+    def _kwargs_http(self):
+        return {}
+
+    def _card(self, title: str, url: str, episode_count: int) -> FakeSearch:
+        return FakeSearch(self.upstream, title=title, thumbnail="", url=url, episode_count=episode_count)
+
+    async def a_search(self, query: str) -> List[FakeSearch]:
+        await self.upstream.call("search")
+        words = set(query.lower().split())
+        scored = [
+            (len(words & set(title.lower().split())), title, url, count)
+            for title, url, count in self.catalog
+        ]
+        scored = [item for item in scored if item[0]]
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [self._card(title, url, count) for _, title, url, count in scored[:5]]
+
+    # Восстановление объектов из кэшированного каталога (вместо классов animego)
+    def build_search(self, title: str, thumbnail: str, url: str) -> FakeSearch:
+        count = next((c for t, u, c in self.catalog if u == url), 12)
+        return self._card(title, url, count)
+
+    def build_episode(self, catalog, record) -> FakeEpisode:
+        slug = catalog.url.rstrip("/").rsplit("/", 1)[-1]
+        return FakeEpisode(
+            self.upstream, anime_slug=slug, id=record.id, ordinal=int(record.num),
+            title=record.title, dubbers=catalog.dubbers,
+        )
@@ -0,0 +1,234 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from urllib.parse import quote, urljoin, urlsplit
+from typing import Optional
+import asyncio
+import os
+import re
+import logging
+import httpx
+
+from cache_manager import cache
+from proxy import StreamSlot, open_upstream, relay, send_checked, validate_upstream_url
+from segment_store import SegmentStore, mmap_chunks
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/hls")
+
+HLS_CACHE_DIR = os.getenv("HLS_CACHE_DIR", "/tmp/aniyume-hls")
+HLS_CACHE_MAX_BYTES = int(os.getenv("HLS_CACHE_MAX_BYTES", str(1024 ** 3)))
+HLS_MAX_SEGMENT_BYTES = int(os.getenv("HLS_MAX_SEGMENT_BYTES", str(32 * 1024 ** 2)))
+HLS_PLAYLIST_TTL = int(os.getenv("HLS_PLAYLIST_TTL", "10"))
+HLS_MAX_PLAYLIST_BYTES = 2 * 1024 ** 2
+# Сегмент пишется на диск в потоке пачками не меньше этого размера
+HLS_WRITE_BUFFER_BYTES = 1024 ** 2
+# Период сверки с каталогом: лимит HLS_CACHE_MAX_BYTES общий для всех воркеров
+HLS_CACHE_SWEEP_INTERVAL = float(os.getenv("HLS_CACHE_SWEEP_INTERVAL", "60"))
+
+PLAYLIST_MEDIA_TYPE = "application/vnd.apple.mpegurl"
+SEGMENT_MEDIA_TYPES = {
+    ".ts": "video/mp2t",
+    ".m4s": "video/iso.segment",
+    ".mp4": "video/mp4",
+    ".m4a": "audio/mp4",
+    ".aac": "audio/aac",
+    ".vtt": "text/vtt",
+}
+
+# URI="..." внутри тегов (#EXT-X-KEY, #EXT-X-MAP, #EXT-X-MEDIA, ...)
+URI_ATTR = re.compile(r'URI="([^"]+)"')
+# Теги, URI которых указывает на другой плейлист, а не на сегмент
+PLAYLIST_URI_TAGS = ("#EXT-X-MEDIA", "#EXT-X-I-FRAME-STREAM-INF")
+
+segments = SegmentStore(HLS_CACHE_DIR, HLS_CACHE_MAX_BYTES)
+# Одновременные зрители одного эпизода делят одну загрузку сегмента
+segment_flight = SingleFlight("hls_segment")
+playlist_flight = SingleFlight("hls_playlist")
+_sweep_task: Optional[asyncio.Task] = None
+
+
+async def open_segments():
+    """Каталог сегментов открывается на старте, а не при импорте модуля"""
+    global _sweep_task
+    await asyncio.to_thread(segments.open)
+    if HLS_CACHE_SWEEP_INTERVAL > 0 and _sweep_task is None:
+        _sweep_task = asyncio.create_task(_sweep_loop(), name="hls-segment-sweep")
+
+
+async def _sweep_loop():
+    while True:
+        await asyncio.sleep(HLS_CACHE_SWEEP_INTERVAL)
+        try:
+            await asyncio.to_thread(segments.sweep)
+        except Exception as e:
+            logger.error(f"❌ HLS cache sweep failed: {e!r}")
+
+
+async def close_segments():
+    global _sweep_task
+    if _sweep_task is not None:
+        _sweep_task.cancel()
+        await asyncio.gather(_sweep_task, return_exceptions=True)
+        _sweep_task = None
+
+
+def playlist_link(url: str) -> str:
+    # Относительные ссылки работают и напрямую, и за префиксом nginx (/streams/)
+    return f"playlist?url={quote(url, safe='')}"
+
+
+def segment_link(url: str) -> str:
+    return f"segment?url={quote(url, safe='')}"
+
+
+def rewrite_playlist(text: str, base_url: str) -> str:
+    """Перевод всех URI плейлиста (master и variant) на эндпоинты сервиса"""
+    is_master = "#EXT-X-STREAM-INF" in text
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            lines.append(line)
+        elif stripped.startswith("#"):
+            make_link = playlist_link if stripped.startswith(PLAYLIST_URI_TAGS) else segment_link
+            lines.append(URI_ATTR.sub(
+                lambda m: f'URI="{make_link(urljoin(base_url, m.group(1)))}"', line
+            ))
+        else:
+            absolute = urljoin(base_url, stripped)
+            lines.append(playlist_link(absolute) if is_master else segment_link(absolute))
+    return "\n".join(lines) + "\n"
+
+
+async def read_playlist(url: str):
+    """Тело плейлиста не больше HLS_MAX_PLAYLIST_BYTES и конечный URL после редиректов"""
+    slot = await StreamSlot.acquire()
+    try:
+        response = await send_checked(url)
+        try:
+            if response.status_code != 200:
+                raise HTTPException(status_code=502, detail=f"Upstream returned {response.status_code}")
+            if int(response.headers.get("content-length") or 0) > HLS_MAX_PLAYLIST_BYTES:
+                raise HTTPException(status_code=502, detail="Upstream is not an HLS playlist")
+            body = bytearray()
+            async for chunk in response.aiter_bytes():
+                body += chunk
+                if len(body) > HLS_MAX_PLAYLIST_BYTES:
+                    raise HTTPException(status_code=502, detail="Upstream is not an HLS playlist")
+            return body.decode(response.encoding or "utf-8", errors="replace"), str(response.url)
+        finally:
+            await response.aclose()
+    except httpx.HTTPError as e:
+        logger.error(f"❌ Playlist fetch error: {e!r}")
+        raise HTTPException(status_code=502, detail="Upstream unavailable")
+    finally:
+        slot.release()
+
+
+async def fetch_playlist(url: str) -> str:
+    text, final_url = await read_playlist(url)
+    if not text.lstrip().startswith("#EXTM3U"):
+        raise HTTPException(status_code=502, detail="Upstream is not an HLS playlist")
+    # База для относительных ссылок - конечный URL после редиректов
+    rewritten = rewrite_playlist(text, final_url)
+    cache.memory_cache.set(f"hls:playlist:{url}", rewritten, HLS_PLAYLIST_TTL)
+    return rewritten
+
+
+def remove_file(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+async def fetch_segment(url: str, key: str) -> Optional[str]:
+    """Загрузка сегмента на диск; None, если сегмент слишком большой для кэша.
+
+    Файловые операции идут в пуле потоков, чтобы медленный диск не
+    останавливал event loop.
+    """
+    slot = await StreamSlot.acquire()
+    temp_path = segments.temp_path()
+    f = None
+    try:
+        response = await send_checked(url)
+        try:
+            if response.status_code != 200:
+                raise HTTPException(status_code=502, detail=f"Upstream returned {response.status_code}")
+            if int(response.headers.get("content-length") or 0) > HLS_MAX_SEGMENT_BYTES:
+                return None
+            f = await asyncio.to_thread(open, temp_path, "wb")
+            size = 0
+            buffer = bytearray()
+            async for chunk in response.aiter_raw():
+                size += len(chunk)
+                if size > HLS_MAX_SEGMENT_BYTES:
+                    return None
+                buffer += chunk
+                if len(buffer) >= HLS_WRITE_BUFFER_BYTES:
+                    await asyncio.to_thread(f.write, bytes(buffer))
+                    buffer.clear()
+            if buffer:
+                await asyncio.to_thread(f.write, bytes(buffer))
+            await asyncio.to_thread(f.close)
+        finally:
+            await response.aclose()
+        return await asyncio.to_thread(segments.commit, key, temp_path, size)
+    except httpx.HTTPError as e:
+        logger.error(f"❌ Segment fetch error: {e!r}")
+        raise HTTPException(status_code=502, detail="Upstream unavailable")
+    finally:
+        slot.release()
+        if f is not None:
+            if not f.closed:
+                await asyncio.to_thread(f.close)
+            # После commit временного файла уже нет
+            await asyncio.to_thread(remove_file, temp_path)
+
+
+def segment_media_type(url: str) -> str:
+    ext = os.path.splitext(urlsplit(url).path)[1].lower()
+    return SEGMENT_MEDIA_TYPES.get(ext, "application/octet-stream")
+
+
+def serve_segment(request: Request, path: str, media_type: str) -> Response:
+    headers = {"Cache-Control": "public, max-age=86400"}
+    # Range и серверы с pathsend (отдача файла самим сервером) - через FileResponse
+    if "range" in request.headers or "http.response.pathsend" in request.scope.get("extensions", {}):
+        return FileResponse(path, media_type=media_type, headers=headers)
+    headers["Content-Length"] = str(os.path.getsize(path))
+    headers["Accept-Ranges"] = "bytes"
+    return StreamingResponse(mmap_chunks(path), media_type=media_type, headers=headers)
+
+
+@router.get("/playlist")
+async def hls_playlist(url: str = Query(..., description="Upstream .m3u8 URL")):
+    """Плейлист HLS с переписанными ссылками на сегменты и вложенные плейлисты"""
+    await validate_upstream_url(url)
+    text = cache.memory_cache.get(f"hls:playlist:{url}")
+    if text is None:
+        text = await playlist_flight.do(url, lambda: fetch_playlist(url))
+    return Response(content=text, media_type=PLAYLIST_MEDIA_TYPE, headers={"Cache-Control": "no-cache"})
+
+
+@router.get("/segment")
+async def hls_segment(request: Request, url: str = Query(..., description="Upstream segment URL")):
+    """Сегмент из дискового кэша; при промахе - одна загрузка с origin на всех"""
+    await validate_upstream_url(url)
+    key = SegmentStore.key_for(url)
+    path = segments.get(key)
+    if path is None:
+        path = await segment_flight.do(key, lambda: fetch_segment(url, key))
+    if path is None:
+        # Не кэшируем: отдаем потоком напрямую
+        upstream, slot = await open_upstream(request, url)
+        return relay(upstream, slot)
+    try:
+        return serve_segment(request, path, segment_media_type(url))
+    except FileNotFoundError:
+        # Вытеснен между загрузкой и отдачей
+        upstream, slot = await open_upstream(request, url)
+        return relay(upstream, slot)
@@ -0,0 +1,94 @@
+"""Готовые HTTP-ответы в кэше: тело, ETag и сжатые варианты.
+
+Тело сериализуется и сжимается один раз при записи; при чтении остается
+выбрать вариант по Accept-Encoding или ответить 304 по If-None-Match.
+brotli используется, если установлен пакет `brotli`.
+"""
+from typing import Any, Dict, Optional
+import gzip
+import hashlib
+import json
+import os
+
+from fastapi import Request, Response
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Меньшие ответы не сжимаются: заголовки и время сжатия не окупаются
+RESPONSE_COMPRESS_MIN_BYTES = int(os.getenv("RESPONSE_COMPRESS_MIN_BYTES", "1024"))
+RESPONSE_GZIP_LEVEL = int(os.getenv("RESPONSE_GZIP_LEVEL", "6"))
+RESPONSE_BROTLI_QUALITY = int(os.getenv("RESPONSE_BROTLI_QUALITY", "5"))
+
+
+def dump_json(data: Any) -> bytes:
+    """Компактный JSON из обычных dict/list, без моделей Pydantic"""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def make_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def build_entry(body: bytes, **meta: Any) -> Dict[str, Any]:
+    """Запись кэша: тело, ETag, сжатые варианты и произвольные метаданные"""
+    entry = {"etag": make_etag(body), "body": body, "encodings": {}, **meta}
+    if len(body) >= RESPONSE_COMPRESS_MIN_BYTES:
+        entry["encodings"]["gzip"] = gzip.compress(body, RESPONSE_GZIP_LEVEL, mtime=0)
+        if brotli is not None:
+            entry["encodings"]["br"] = brotli.compress(body, quality=RESPONSE_BROTLI_QUALITY)
+    return entry
+
+
+def accepted_encodings(request: Request) -> set:
+    accepted = set()
+    for part in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = part.partition(";")
+        params = params.replace(" ", "")
+        try:
+            weight = float(params[2:]) if params.startswith("q=") else 1.0
+        except ValueError:
+            weight = 0.0
+        if name.strip() and weight > 0:
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def encoded_etag(etag: str, encoding: Optional[str]) -> str:
+    """У каждого варианта тела свой ETag: "<hash>", "<hash>-gzip", "<hash>-br" """
+    return f'{etag[:-1]}-{encoding}"' if encoding else etag
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    if header.strip() == "*":
+        return True
+    # Слабое сравнение (RFC 9110): префикс W/ игнорируется
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",")}
+    return etag in tags
+
+
+def cached_response(
+    request: Request,
+    entry: Dict[str, Any],
+    cache_control: str,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """200 с подходящим вариантом тела или 304, если ETag клиента совпал с ETag этого варианта"""
+    accepted = accepted_encodings(request)
+    encoding = next(
+        (name for name in ("br", "gzip") if name in accepted and name in entry["encodings"]),
+        None,
+    )
+    etag = encoded_etag(entry["etag"], encoding)
+    common = {"ETag": etag, "Cache-Control": cache_control, "Vary": "Accept-Encoding", **(headers or {})}
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers=common)
+    if encoding is None:
+        return Response(content=entry["body"], media_type="application/json", headers=common)
+    common["Content-Encoding"] = encoding
+    return Response(content=entry["encodings"][encoding], media_type="application/json", headers=common)
@@ -1,28 +1,239 @@
-from prometheus_client import Counter, Histogram, generate_latest, CONTENT_TYPE_LATEST
-from fastapi import Request, APIRouter, Response
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry
+from prometheus_client import multiprocess
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from fastapi import Request, APIRouter, Response, Depends, HTTPException, Query
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+import asyncio
+import hmac
+import logging
+import os
+import threading
 import time
+from cache_manager import cache
+from profiler import StackSampler, SlowRequestLog, collapse
 
 router = APIRouter()
 
 # Метрики
-requests_total = Counter('requests_total', 'Total requests', ['method', 'endpoint'])
-request_duration = Histogram('request_duration_seconds', 'Request duration')
+requests_total = Counter('requests_total', 'Total requests', ['method', 'endpoint', 'status'])
+request_duration = Histogram('request_duration_seconds', 'Request duration', ['method', 'endpoint'])
 errors_total = Counter('errors_total', 'Total errors', ['type'])
+# Этапы конвейера: search -> anime -> episodes -> sources -> videos, плюс операции Redis
+STAGE_BUCKETS = (.001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+stage_duration = Histogram('stage_duration_seconds', 'Duration of a pipeline stage call', ['stage', 'outcome'], buckets=STAGE_BUCKETS)
+stage_errors_total = Counter('stage_errors_total', 'Failed pipeline stage calls', ['stage', 'type'])
+cache_requests_total = Counter('cache_requests_total', 'Cache lookups by key family, tier and result', ['family', 'tier', 'result'])
+coalesced_total = Counter('singleflight_coalesced_total', 'Requests served by an in-flight upstream call', ['group'])
+prefetch_total = Counter('prefetch_total', 'Background prefetch tasks by outcome', ['result'])
+video_cache_total = Counter('video_cache_requests_total', 'Video URL cache lookups by entry state', ['state'])
+proxy_active_streams = Gauge('proxy_active_streams', 'Upstream streams currently relayed by /proxy')
+# Защита upstream (upstream.py)
+upstream_concurrency_limit = Gauge('upstream_concurrency_limit', 'Current adaptive limit on outstanding upstream calls')
+upstream_in_flight = Gauge('upstream_in_flight', 'Upstream calls currently in flight')
+upstream_breaker_state = Gauge('upstream_breaker_state', 'Upstream circuit breaker state by stage (0 closed, 1 half-open, 2 open)', ['stage'])
+upstream_breaker_transitions_total = Counter('upstream_breaker_transitions_total', 'Circuit breaker state changes', ['stage', 'state'])
+upstream_rejected_total = Counter('upstream_rejected_total', 'Upstream calls rejected without being sent', ['reason'])
+upstream_hedges_total = Counter('upstream_hedges_total', 'Hedged upstream attempts', ['stage', 'result'])
+# Задержка event loop: насколько позже срабатывает таймер (блокирующий код в loop)
+LOOP_LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+event_loop_lag = Histogram('event_loop_lag_seconds', 'Delay of a periodic event loop timer beyond its interval', buckets=LOOP_LAG_BUCKETS)
+event_loop_lag_last = Gauge('event_loop_lag_last_seconds', 'Most recent event loop lag measurement')
+# Прогрев популярных тайтлов (warmer.py)
+warmer_refresh_total = Counter('warmer_refresh_total', 'Popularity warmer checks by entry kind and outcome', ['kind', 'result'])
+warmer_served_total = Counter('warmer_served_total', 'Cache hits on entries refreshed by the popularity warmer', ['kind'])
+warmer_tracked_titles = Gauge('warmer_tracked_titles', 'Titles tracked as top-K candidates by the popularity warmer')
+
+class MemoryCacheCollector:
+    """Экспорт счетчиков in-process кэша (считаются в самом MemoryCache)"""
+
+    def collect(self):
+        stats = cache.memory_cache.stats()
+        for name in ('hits', 'misses', 'evictions', 'expirations'):
+            yield CounterMetricFamily(f'memory_cache_{name}', f'Memory cache {name}', value=stats[name])
+        yield GaugeMetricFamily('memory_cache_entries', 'Memory cache entries', value=stats['entries'])
+        yield GaugeMetricFamily('memory_cache_bytes', 'Memory cache estimated size', value=stats['bytes'])
+
+REGISTRY.register(MemoryCacheCollector())
+
+# Разбивка времени запроса по этапам в заголовке Server-Timing
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+# Диагностика (/debug/*): выключена по умолчанию, доступна только с токеном
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+if PROFILING_ENABLED and not PROFILING_TOKEN:
+    logging.getLogger(__name__).warning("⚠️ PROFILING_ENABLED without PROFILING_TOKEN: /debug/* will refuse every request")
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "60"))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+
+# Медленные запросы с разбивкой по этапам (собирается только при PROFILING_ENABLED)
+slow_requests = SlowRequestLog(
+    size=int(os.getenv("SLOW_REQUEST_LOG_SIZE", "100")),
+    threshold=float(os.getenv("SLOW_REQUEST_THRESHOLD", "1.0")),
+)
+# stage -> [суммарное время, число вызовов] для текущего запроса
+request_timings: ContextVar[Optional[Dict[str, list]]] = ContextVar("request_timings", default=None)
+
+def record_stage(stage: str, seconds: float, error: Optional[BaseException] = None):
+    outcome = "ok" if error is None else "error"
+    stage_duration.labels(stage=stage, outcome=outcome).observe(seconds)
+    if error is not None:
+        stage_errors_total.labels(stage=stage, type=type(error).__name__).inc()
+    timings = request_timings.get()
+    if timings is not None:
+        total = timings.setdefault(stage, [0.0, 0])
+        total[0] += seconds
+        total[1] += 1
+
+@contextmanager
+def track_stage(stage: str):
+    """Замер одного вызова этапа (работает и вокруг await)"""
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        record_stage(stage, time.perf_counter() - start, error)
+
+def record_redis_operation(op: str, seconds: float, error: Optional[BaseException]):
+    record_stage("redis", seconds, error)
+
+def record_cache_lookup(key: str, tier: str, hit: bool):
+    # Семейство - префикс ключа: anime, video, title, ...
+    family = key.split(":", 1)[0] if ":" in key else "other"
+    cache_requests_total.labels(family=family, tier=tier, result="hit" if hit else "miss").inc()
+
+cache.on_operation = record_redis_operation
+cache.on_lookup = record_cache_lookup
+
+def route_template(request: Request) -> str:
+    """Шаблон маршрута (/hls/segment), а не сырой путь - ограниченная кардинальность"""
+    route = request.scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+def format_server_timing(timings: Dict[str, list], total: float) -> str:
+    parts = [
+        f'{stage};desc="{count}x";dur={seconds * 1000:.1f}'
+        for stage, (seconds, count) in timings.items()
+    ]
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
 
 async def metrics_middleware(request: Request, call_next):
-    start_time = time.time()
+    start_time = time.perf_counter()
+    token = request_timings.set({} if SERVER_TIMING or PROFILING_ENABLED else None)
     
     try:
         response = await call_next(request)
-        requests_total.labels(method=request.method, endpoint=request.url.path).inc()
-        duration = time.time() - start_time
-        request_duration.observe(duration)
+        endpoint = route_template(request)
+        duration = time.perf_counter() - start_time
+        requests_total.labels(method=request.method, endpoint=endpoint, status=response.status_code).inc()
+        request_duration.labels(method=request.method, endpoint=endpoint).observe(duration)
+        if response.status_code >= 500:
+            errors_total.labels(type=f"http_{response.status_code}").inc()
+        timings = request_timings.get()
+        if timings is not None and SERVER_TIMING:
+            response.headers["Server-Timing"] = format_server_timing(timings, duration)
+        # Сам профиль всегда "медленный" - в журнал не пишем
+        if PROFILING_ENABLED and not endpoint.startswith("/debug/"):
+            slow_requests.add(
+                request.method, request.url.path, request.url.query, endpoint,
+                response.status_code, duration, timings,
+            )
         return response
     except Exception as e:
         errors_total.labels(type=type(e).__name__).inc()
         raise
+    finally:
+        request_timings.reset(token)
 
 # Эндпоинт метрик
+def metrics_registry():
+    """При нескольких воркерах (PROMETHEUS_MULTIPROC_DIR) - сумма по всем процессам"""
+    if not os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    # L1 у каждого воркера свой: отдаем состояние ответившего процесса
+    registry.register(MemoryCacheCollector())
+    return registry
+
 @router.get("/metrics")
 async def metrics():
-    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+    return Response(content=generate_latest(metrics_registry()), media_type=CONTENT_TYPE_LATEST)
+
+# ========== ДИАГНОСТИКА ==========
+_loop_lag_task: Optional[asyncio.Task] = None
+# Последний замер и максимум с запуска (для /debug/slow-requests)
+loop_lag_state = {"last": 0.0, "max": 0.0}
+
+async def monitor_loop_lag(interval: float):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lag = max(0.0, loop.time() - start - interval)
+        event_loop_lag.observe(lag)
+        event_loop_lag_last.set(lag)
+        loop_lag_state["last"] = lag
+        loop_lag_state["max"] = max(loop_lag_state["max"], lag)
+
+def start_loop_lag_monitor():
+    global _loop_lag_task
+    if _loop_lag_task is None and LOOP_LAG_INTERVAL > 0:
+        _loop_lag_task = asyncio.create_task(monitor_loop_lag(LOOP_LAG_INTERVAL), name="loop-lag")
+
+async def stop_loop_lag_monitor():
+    global _loop_lag_task
+    if _loop_lag_task is not None:
+        _loop_lag_task.cancel()
+        await asyncio.gather(_loop_lag_task, return_exceptions=True)
+        _loop_lag_task = None
+
+def require_profiling(request: Request):
+    """Без PROFILING_ENABLED эндпоинтов как бы нет; иначе нужен X-Admin-Token.
+
+    Без заданного PROFILING_TOKEN отказ всем: профиль и журнал запросов раскрывают внутренности.
+    """
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not PROFILING_TOKEN or not hmac.compare_digest(
+        request.headers.get("x-admin-token", ""), PROFILING_TOKEN
+    ):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+# Одновременно идет только один профиль
+_profile_lock = asyncio.Lock()
+
+@router.get("/debug/profile", dependencies=[Depends(require_profiling)])
+async def profile(
+    seconds: float = Query(10, gt=0, description="Sampling duration"),
+    interval_ms: float = Query(5, ge=1, le=100, description="Sampling interval"),
+):
+    """Сэмплы стека потока event loop в формате collapsed stacks (flamegraph)"""
+    if seconds > PROFILE_MAX_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be <= {PROFILE_MAX_SECONDS:g}")
+    if _profile_lock.locked():
+        raise HTTPException(status_code=409, detail="Profile already running")
+    async with _profile_lock:
+        sampler = StackSampler(threading.get_ident(), interval=interval_ms / 1000)
+        counts = await asyncio.to_thread(sampler.run, seconds)
+    return Response(
+        content=collapse(counts),
+        media_type="text/plain",
+        headers={"X-Profile-Samples": str(sum(counts.values()))},
+    )
+
+@router.get("/debug/slow-requests", dependencies=[Depends(require_profiling)])
+async def slow_requests_report(limit: int = Query(20, ge=1, le=1000)):
+    """Самые медленные из последних запросов дольше SLOW_REQUEST_THRESHOLD"""
+    return {
+        "threshold_ms": round(slow_requests.threshold * 1000, 1),
+        "requests": slow_requests.slowest(limit),
+        "loop_lag_ms": {name: round(value * 1000, 2) for name, value in loop_lag_state.items()},
+    }
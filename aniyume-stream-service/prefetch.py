@@ -0,0 +1,104 @@
+import asyncio
+import itertools
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from catalog import AnimeCatalog, EpisodeRecord
+from monitoring import prefetch_total
+
+logger = logging.getLogger(__name__)
+
+
+class PrefetchScheduler:
+    """Фоновый прогрев следующих эпизодов в кэш видео.
+
+    Очередь ограничена: при переполнении новые задачи отбрасываются, чтобы
+    прогрев не конкурировал с пользовательскими запросами. Общий бюджет
+    задается числом воркеров; ближайшие эпизоды обрабатываются первыми.
+    """
+
+    def __init__(
+        self,
+        resolve: Callable[[AnimeCatalog, EpisodeRecord], Awaitable[Any]],
+        is_warm: Callable[[AnimeCatalog, EpisodeRecord], Awaitable[bool]],
+        concurrency: int = 2,
+        queue_size: int = 100,
+    ):
+        self.resolve = resolve
+        self.is_warm = is_warm
+        self.concurrency = concurrency
+        self.queue: asyncio.PriorityQueue = asyncio.PriorityQueue(maxsize=queue_size)
+        self._seq = itertools.count()
+        self._pending: set = set()
+        self._workers: List[asyncio.Task] = []
+        self.stats_counts: Dict[str, int] = {
+            "scheduled": 0,
+            "duplicate": 0,
+            "dropped": 0,
+            "warm": 0,
+            "resolved": 0,
+            "failed": 0,
+        }
+
+    def _count(self, result: str):
+        self.stats_counts[result] += 1
+        prefetch_total.labels(result=result).inc()
+
+    def start(self):
+        if self._workers:
+            return
+        self._workers = [
+            asyncio.create_task(self._worker(), name=f"prefetch-{i}")
+            for i in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def schedule(self, catalog: AnimeCatalog, episodes: List[EpisodeRecord]) -> int:
+        """Постановка эпизодов в очередь без ожидания; возвращает число принятых"""
+        accepted = 0
+        for priority, ep in enumerate(episodes):
+            key = (catalog.title, ep.num)
+            if key in self._pending:
+                self._count("duplicate")
+                continue
+            try:
+                self.queue.put_nowait((priority, next(self._seq), catalog, ep))
+            except asyncio.QueueFull:
+                # Сброс нагрузки: прогрев не обязателен
+                self._count("dropped")
+                continue
+            self._pending.add(key)
+            self._count("scheduled")
+            accepted += 1
+        return accepted
+
+    async def _worker(self):
+        while True:
+            _, _, catalog, ep = await self.queue.get()
+            try:
+                if await self.is_warm(catalog, ep):
+                    self._count("warm")
+                    continue
+                url, _ = await self.resolve(catalog, ep)
+                self._count("resolved" if url else "failed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._count("failed")
+                logger.error(f"⚠️ Prefetch EP{ep.num} failed: {e}")
+            finally:
+                self._pending.discard((catalog.title, ep.num))
+                self.queue.task_done()
+
+    def stats(self) -> Dict[str, Optional[int]]:
+        return {
+            **self.stats_counts,
+            "queued": self.queue.qsize(),
+            "pending": len(self._pending),
+            "workers": len(self._workers),
+        }
@@ -0,0 +1,90 @@
+"""Инструменты диагностики задержек: сэмплирующий профайлер и журнал медленных запросов.
+
+Профайлер раз в interval секунд снимает стек потока event loop из
+отдельного потока (sys._current_frames), поэтому не требует перезапуска и
+не замедляет сам loop. Результат - collapsed stacks ("a;b;c 42"), формат
+flamegraph.pl, speedscope и inferno.
+"""
+from collections import Counter, deque
+from typing import Any, Deque, Dict, List, Optional
+import os
+import sys
+import threading
+import time
+
+
+class StackSampler:
+    """Сэмплы стека одного потока за заданное время"""
+
+    def __init__(self, thread_id: int, interval: float = 0.005, max_depth: int = 128):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_depth = max_depth
+
+    def _stack(self, frame) -> str:
+        parts = []
+        while frame is not None and len(parts) < self.max_depth:
+            code = frame.f_code
+            # Строка определения, а не текущая: одна функция - один узел графа
+            parts.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(parts))
+
+    def run(self, seconds: float) -> Counter:
+        """Блокирующий сбор; вызывается в отдельном потоке"""
+        counts: Counter = Counter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                counts[self._stack(frame)] += 1
+            del frame
+            time.sleep(self.interval)
+        return counts
+
+
+def collapse(counts: Counter) -> str:
+    return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+
+class SlowRequestLog:
+    """Кольцевой буфер последних запросов дольше threshold с разбивкой по этапам"""
+
+    def __init__(self, size: int = 100, threshold: float = 1.0):
+        self.threshold = threshold
+        self.entries: Deque[Dict[str, Any]] = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(
+        self,
+        method: str,
+        path: str,
+        query: str,
+        endpoint: str,
+        status: int,
+        duration: float,
+        timings: Optional[Dict[str, list]],
+    ):
+        if duration < self.threshold:
+            return
+        entry = {
+            "time": time.time(),
+            "method": method,
+            "path": path,
+            "query": query,
+            "endpoint": endpoint,
+            "status": status,
+            "duration_ms": round(duration * 1000, 1),
+            "stages": {
+                stage: {"ms": round(seconds * 1000, 1), "count": count}
+                for stage, (seconds, count) in (timings or {}).items()
+            },
+        }
+        with self._lock:
+            self.entries.append(entry)
+
+    def slowest(self, limit: int) -> List[Dict[str, Any]]:
+        with self._lock:
+            entries = list(self.entries)
+        entries.sort(key=lambda e: e["duration_ms"], reverse=True)
+        return entries[:limit]
@@ -0,0 +1,184 @@
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from typing import Dict, Optional
+from urllib.parse import urljoin, urlsplit
+import asyncio
+import ipaddress
+import os
+import logging
+import socket
+import httpx
+
+from monitoring import proxy_active_streams
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# Ограничения на один pod
+PROXY_MAX_STREAMS = int(os.getenv("PROXY_MAX_STREAMS", "64"))
+PROXY_QUEUE_TIMEOUT = float(os.getenv("PROXY_QUEUE_TIMEOUT", "2"))
+PROXY_CHUNK_SIZE = int(os.getenv("PROXY_CHUNK_SIZE", str(64 * 1024)))
+# Хосты плееров и CDN, на которые ведут ссылки animego (с поддоменами); остальные запрещены.
+# "*" - любой публичный хост (адрес все равно проверяется)
+DEFAULT_ALLOWED_HOSTS = "kodik.info,kodik.biz,kodik.cc,kodik-storage.com,aniboom.one,sibnet.ru"
+PROXY_ALLOWED_HOSTS = [
+    h.strip().lower() for h in os.getenv("PROXY_ALLOWED_HOSTS", DEFAULT_ALLOWED_HOSTS).split(",") if h.strip()
+]
+# Редиректы проходим сами, проверяя каждый переход
+PROXY_MAX_REDIRECTS = int(os.getenv("PROXY_MAX_REDIRECTS", "5"))
+
+FORWARD_REQUEST_HEADERS = ("range", "if-range", "if-none-match", "if-modified-since", "user-agent", "referer")
+PASS_RESPONSE_HEADERS = (
+    "content-type", "content-length", "content-range", "accept-ranges",
+    "etag", "last-modified", "cache-control", "expires",
+)
+
+_client: Optional[httpx.AsyncClient] = None
+_streams = asyncio.Semaphore(PROXY_MAX_STREAMS)
+
+
+def get_client() -> httpx.AsyncClient:
+    """Общий клиент с пулом keep-alive соединений"""
+    global _client
+    if _client is None or _client.is_closed:
+        _client = httpx.AsyncClient(
+            # Каждый переход проверяется в send_checked
+            follow_redirects=False,
+            timeout=httpx.Timeout(connect=5.0, read=30.0, write=10.0, pool=PROXY_QUEUE_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=PROXY_MAX_STREAMS,
+                max_keepalive_connections=PROXY_MAX_STREAMS,
+                keepalive_expiry=30.0,
+            ),
+            # Отдаем байты как есть, без перекодирования
+            headers={"Accept-Encoding": "identity"},
+        )
+    return _client
+
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def host_allowed(host: str) -> bool:
+    if "*" in PROXY_ALLOWED_HOSTS:
+        return True
+    return any(host == h or host.endswith("." + h) for h in PROXY_ALLOWED_HOSTS)
+
+
+def is_public_address(address: str) -> bool:
+    """Только глобальные адреса: без loopback, частных сетей, link-local (метаданные облака)"""
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if isinstance(ip, ipaddress.IPv6Address) and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+async def validate_upstream_url(url: str):
+    """Схема, хост из allow-list и все его адреса публичные; иначе 400/403"""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise HTTPException(status_code=400, detail="Invalid upstream URL")
+    host = parts.hostname.lower()
+    if not host_allowed(host):
+        raise HTTPException(status_code=403, detail="Upstream host not allowed")
+    try:
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, ValueError):
+        raise HTTPException(status_code=400, detail="Upstream host not resolvable")
+    if not infos or not all(is_public_address(info[4][0]) for info in infos):
+        logger.warning(f"🚫 Proxy to non-public address refused: {host}")
+        raise HTTPException(status_code=403, detail="Upstream address not allowed")
+
+
+async def send_checked(url: str, headers: Optional[Dict[str, str]] = None) -> httpx.Response:
+    """GET с потоковым телом; редиректы вручную, с проверкой каждого перехода"""
+    client = get_client()
+    for _ in range(PROXY_MAX_REDIRECTS + 1):
+        await validate_upstream_url(url)
+        response = await client.send(client.build_request("GET", url, headers=headers), stream=True)
+        if not response.is_redirect:
+            return response
+        await response.aclose()
+        url = urljoin(str(response.url), response.headers["location"])
+    raise HTTPException(status_code=502, detail="Too many upstream redirects")
+
+
+class StreamSlot:
+    """Слот в лимите одновременных потоков; освобождается ровно один раз"""
+
+    def __init__(self):
+        self.released = False
+
+    @classmethod
+    async def acquire(cls) -> "StreamSlot":
+        try:
+            await asyncio.wait_for(_streams.acquire(), timeout=PROXY_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(
+                status_code=503,
+                detail="Too many concurrent streams",
+                headers={"Retry-After": "1"},
+            )
+        proxy_active_streams.inc()
+        return cls()
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            _streams.release()
+            proxy_active_streams.dec()
+
+
+async def open_upstream(request: Request, url: str):
+    """Открытие потока к upstream с пробросом Range; возвращает (response, slot)"""
+    await validate_upstream_url(url)
+    headers = {k: v for k, v in request.headers.items() if k.lower() in FORWARD_REQUEST_HEADERS}
+    slot = await StreamSlot.acquire()
+    try:
+        upstream = await send_checked(url, headers)
+    except httpx.HTTPError as e:
+        slot.release()
+        logger.error(f"❌ Proxy upstream error: {e!r}")
+        raise HTTPException(status_code=502, detail="Upstream unavailable")
+    except BaseException:
+        slot.release()
+        raise
+    return upstream, slot
+
+
+def relay(upstream: httpx.Response, slot: StreamSlot) -> StreamingResponse:
+    """Потоковая передача ответа upstream кусками, без буферизации целиком"""
+
+    async def cleanup():
+        await upstream.aclose()
+        slot.release()
+
+    async def chunks():
+        try:
+            async for chunk in upstream.aiter_raw(PROXY_CHUNK_SIZE):
+                yield chunk
+        finally:
+            await cleanup()
+
+    headers = {k: v for k, v in upstream.headers.items() if k.lower() in PASS_RESPONSE_HEADERS}
+    return StreamingResponse(
+        chunks(),
+        status_code=upstream.status_code,
+        headers=headers,
+        # Страховка на случай, если клиент отключился до начала передачи
+        background=BackgroundTask(cleanup),
+    )
+
+
+@router.get("/proxy")
+async def proxy_stream(request: Request, url: str = Query(..., description="Upstream video URL")):
+    """Проксирование видео с поддержкой Range (206 / Content-Range)"""
+    upstream, slot = await open_upstream(request, url)
+    return relay(upstream, slot)
@@ -0,0 +1,170 @@
+import hashlib
+import mmap
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import AsyncIterator, Dict, Optional
+
+# Временные файлы моложе этого возраста может дописывать другой воркер
+STALE_TEMP_SECONDS = 600
+
+
+class SegmentStore:
+    """Дисковый LRU-кэш HLS сегментов с ограничением по размеру.
+
+    Индекс (ключ -> размер) хранится в памяти и сверяется с каталогом в
+    open() и sweep(); время доступа - mtime, его обновляет get(). Каталог
+    может быть общим для нескольких воркеров: файлы, скачанные другим
+    процессом, добавляются в индекс при первом обращении, а лимит на весь
+    каталог соблюдает периодический sweep().
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        # Без обращений к диску: каталог открывается на старте приложения
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.sweeps = 0
+
+    @staticmethod
+    def key_for(url: str) -> str:
+        return hashlib.sha256(url.encode()).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.sweep()
+
+    def sweep(self):
+        """Сверка с каталогом: учитываются файлы всех воркеров, и самые давние
+        удаляются, пока весь каталог больше max_bytes"""
+        entries = []
+        for name in os.listdir(self.directory):
+            path = self.path(name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # Недописанные временные файлы от прошлого запуска
+            if name.endswith(".tmp"):
+                if time.time() - stat.st_mtime > STALE_TEMP_SECONDS:
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+                continue
+            entries.append((stat.st_mtime, name, stat.st_size))
+        entries.sort()
+        total = sum(size for _, _, size in entries)
+        evicted = 0
+        while total > self.max_bytes and entries:
+            _, name, size = entries.pop(0)
+            total -= size
+            evicted += 1
+            try:
+                os.unlink(self.path(name))
+            except OSError:
+                pass
+        with self._lock:
+            # Файлы, сохраненные во время обхода, вернутся в индекс при обращении
+            self._index = OrderedDict((name, size) for _, name, size in entries)
+            self.bytes = total
+            self.evictions += evicted
+            self.sweeps += 1
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            path = self.path(key)
+            if key not in self._index:
+                try:
+                    size = os.path.getsize(path)
+                except OSError:
+                    self.misses += 1
+                    return None
+                # Сегмент скачал другой воркер
+                self._index[key] = size
+                self.bytes += size
+                self._evict(keep=key)
+                self._touch(path)
+                self.hits += 1
+                return path
+            if not os.path.exists(path):
+                # Файл удалили снаружи (или другой воркер)
+                self.bytes -= self._index.pop(key)
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self._touch(path)
+            self.hits += 1
+            return path
+
+    @staticmethod
+    def _touch(path: str):
+        # atime на noatime/relatime не обновляется - порядок для sweep() в mtime
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def temp_path(self) -> str:
+        return self.path(f"{uuid.uuid4().hex}.tmp")
+
+    def commit(self, key: str, temp_path: str, size: int) -> str:
+        """Атомарное добавление скачанного файла в кэш"""
+        path = self.path(key)
+        os.replace(temp_path, path)
+        with self._lock:
+            if key in self._index:
+                self.bytes -= self._index.pop(key)
+            self._index[key] = size
+            self.bytes += size
+            self._evict(keep=key)
+        return path
+
+    def _evict(self, keep: Optional[str] = None):
+        while self.bytes > self.max_bytes and self._index:
+            key, size = next(iter(self._index.items()))
+            if key == keep and len(self._index) == 1:
+                break
+            self._index.pop(key)
+            self.bytes -= size
+            self.evictions += 1
+            try:
+                os.unlink(self.path(key))
+            except OSError:
+                pass
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "entries": len(self._index),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "sweeps": self.sweeps,
+        }
+
+
+async def mmap_chunks(path: str, chunk_size: int = 256 * 1024) -> AsyncIterator[memoryview]:
+    """Чтение файла через mmap: куски отдаются как memoryview без копирования.
+
+    mmap не закрывается явно: сервер может еще держать последний кусок в
+    буфере сокета, отображение освобождается вместе с последней ссылкой.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return
+        view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+    for offset in range(0, size, chunk_size):
+        yield view[offset:offset + chunk_size]
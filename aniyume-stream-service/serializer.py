@@ -0,0 +1,133 @@
+"""Компактный формат значений кэша вместо pickle.
+
+Запись: 1 байт версии формата, 1 байт флагов, затем msgpack. Каталог и
+ссылка на видео упаковываются по схеме (позиционные массивы без имен
+полей) через ext-типы msgpack; большие записи сжимаются zlib.
+Чтение не исполняет код, поэтому безопасно для общего Redis.
+"""
+from typing import Any
+import os
+import zlib
+
+import msgpack
+
+from catalog import AnimeCatalog, EpisodeRecord, CATALOG_VERSION
+from video_cache import VideoEntry
+
+FORMAT_VERSION = 1
+FLAG_ZLIB = 0x01
+
+# Записи меньше порога не сжимаются: выигрыш не окупает время
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv("CACHE_COMPRESS_MIN_BYTES", "1024"))
+CACHE_COMPRESS_LEVEL = int(os.getenv("CACHE_COMPRESS_LEVEL", "1"))
+
+# Коды ext-типов; схема внутри каждого типа версионируется отдельно
+EXT_CATALOG = 1
+EXT_VIDEO = 2
+VIDEO_SCHEMA_VERSION = 1
+
+
+class SerializationError(ValueError):
+    """Неизвестный формат или версия схемы (старый pickle, чужие данные)"""
+
+
+def _encode_catalog(catalog: AnimeCatalog) -> bytes:
+    return msgpack.packb([
+        CATALOG_VERSION,
+        catalog.title,
+        catalog.anime_id,
+        catalog.url,
+        catalog.thumbnail,
+        catalog.dubbers,
+        catalog.fetched_at,
+        [[ep.id, ep.num, ep.title, ep.videos] for ep in catalog.episodes],
+    ], use_bin_type=True)
+
+
+def _decode_catalog(data: bytes) -> AnimeCatalog:
+    version, title, anime_id, url, thumbnail, dubbers, fetched_at, episodes = msgpack.unpackb(data, raw=False)
+    if version != CATALOG_VERSION:
+        raise SerializationError(f"catalog schema v{version}, expected v{CATALOG_VERSION}")
+    return AnimeCatalog(
+        title=title,
+        anime_id=anime_id,
+        url=url,
+        thumbnail=thumbnail,
+        dubbers=dubbers,
+        episodes=[EpisodeRecord(id=i, num=n, title=t, videos=v) for i, n, t, v in episodes],
+        fetched_at=fetched_at,
+    )
+
+
+def _encode_video(entry: VideoEntry) -> bytes:
+    return msgpack.packb([
+        VIDEO_SCHEMA_VERSION,
+        entry.url,
+        entry.quality,
+        entry.fetched_at,
+        entry.expires_at,
+        [[v["url"], v["quality"], v["source"]] for v in entry.variants],
+    ], use_bin_type=True)
+
+
+def _decode_video(data: bytes) -> VideoEntry:
+    version, url, quality, fetched_at, expires_at, variants = msgpack.unpackb(data, raw=False)
+    if version != VIDEO_SCHEMA_VERSION:
+        raise SerializationError(f"video schema v{version}, expected v{VIDEO_SCHEMA_VERSION}")
+    return VideoEntry(
+        url=url,
+        quality=quality,
+        fetched_at=fetched_at,
+        expires_at=expires_at,
+        variants=[{"url": u, "quality": q, "source": s} for u, q, s in variants],
+    )
+
+
+ENCODERS = {AnimeCatalog: (EXT_CATALOG, _encode_catalog), VideoEntry: (EXT_VIDEO, _encode_video)}
+DECODERS = {EXT_CATALOG: _decode_catalog, EXT_VIDEO: _decode_video}
+
+
+def _default(obj: Any) -> Any:
+    encoder = ENCODERS.get(type(obj))
+    if encoder is not None:
+        code, encode = encoder
+        return msgpack.ExtType(code, encode(obj))
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Cannot serialize {type(obj).__name__} for cache")
+
+
+def _ext_hook(code: int, data: bytes) -> Any:
+    decode = DECODERS.get(code)
+    if decode is None:
+        raise SerializationError(f"unknown ext type {code}")
+    return decode(data)
+
+
+def pack(value: Any) -> bytes:
+    """msgpack без заголовка и сжатия (оценка размера для L1)"""
+    return msgpack.packb(value, default=_default, use_bin_type=True)
+
+
+def dumps(value: Any) -> bytes:
+    body = pack(value)
+    flags = 0
+    if len(body) >= CACHE_COMPRESS_MIN_BYTES:
+        compressed = zlib.compress(body, CACHE_COMPRESS_LEVEL)
+        if len(compressed) < len(body):
+            body, flags = compressed, FLAG_ZLIB
+    return bytes((FORMAT_VERSION, flags)) + body
+
+
+def loads(data: bytes) -> Any:
+    if len(data) < 2 or data[0] != FORMAT_VERSION:
+        raise SerializationError("unknown cache value format")
+    body = memoryview(data)[2:]
+    try:
+        if data[1] & FLAG_ZLIB:
+            body = zlib.decompress(body)
+        return msgpack.unpackb(body, raw=False, ext_hook=_ext_hook)
+    except SerializationError:
+        raise
+    except Exception as e:
+        raise SerializationError(f"corrupted cache value: {e!r}") from e
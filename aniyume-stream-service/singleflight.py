@@ -0,0 +1,148 @@
+import asyncio
+import os
+import uuid
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from monitoring import coalesced_total
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Объединение одинаковых конкурентных запросов в один вызов upstream"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[Any]],
+        lookup: Optional[Callable[[], Awaitable[Any]]] = None,
+    ) -> Any:
+        # lookup используется только межпроцессной реализацией
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            coalesced_total.labels(group=self.name).inc()
+            # shield: отмена одного клиента не должна отменять общий вызов
+            return await asyncio.shield(task)
+
+        self.calls += 1
+        task = asyncio.ensure_future(fn())
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Если все ожидающие отменились, забираем исключение, чтобы не было warning
+        if not task.cancelled():
+            task.exception()
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
+
+
+# Снятие блокировки только владельцем (сравнение токена атомарно)
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+
+class RedisSingleFlight(SingleFlight):
+    """Single-flight между воркерами через короткую блокировку в Redis.
+
+    Внутри процесса запросы объединяются как в SingleFlight. Между процессами
+    лидер берет `lock:{key}` (SET NX PX), остальные ждут, пока значение
+    появится в кэше (`lookup`), и идут в upstream сами только если блокировка
+    исчезла без результата или истекло время ожидания.
+    """
+
+    def __init__(self, name: str, cache, lock_ttl: float = 30.0, poll_interval: float = 0.1):
+        super().__init__(name)
+        self.cache = cache
+        self.lock_ttl = lock_ttl
+        self.poll_interval = poll_interval
+        self.remote_waits = 0
+
+    async def do(
+        self,
+        key: Hashable,
+        fn: Callable[[], Awaitable[Any]],
+        lookup: Optional[Callable[[], Awaitable[Any]]] = None,
+    ) -> Any:
+        if not self.cache.use_redis or lookup is None:
+            return await super().do(key, fn)
+        return await super().do(key, lambda: self._locked(key, fn, lookup))
+
+    async def _locked(self, key, fn, lookup):
+        client = self.cache.async_client
+        lock_key = self.cache.rkey(f"lock:{self.name}:{key}")
+        token = uuid.uuid4().hex
+        ttl_ms = int(self.lock_ttl * 1000)
+
+        try:
+            acquired = await client.set(lock_key, token, nx=True, px=ttl_ms)
+        except Exception as e:
+            logger.error(f"⚠️ Single-flight lock failed: {e}")
+            return await fn()
+
+        if acquired:
+            try:
+                return await fn()
+            finally:
+                try:
+                    await client.eval(RELEASE_SCRIPT, 1, lock_key, token)
+                except Exception as e:
+                    logger.error(f"⚠️ Single-flight unlock failed: {e}")
+
+        # Другой воркер уже ходит в upstream: ждем его результат
+        self.remote_waits += 1
+        coalesced_total.labels(group=f"{self.name}_remote").inc()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.lock_ttl
+        while loop.time() < deadline:
+            await asyncio.sleep(self.poll_interval)
+            value = await lookup()
+            if value is not None:
+                return value
+            try:
+                if not await client.exists(lock_key):
+                    break
+            except Exception:
+                break
+        # Лидер упал или не закэшировал результат (ошибка) - идем сами
+        return await fn()
+
+    def stats(self) -> Dict[str, int]:
+        data = super().stats()
+        data["remote_waits"] = self.remote_waits
+        return data
+
+
+def make_single_flight(name: str, cache) -> SingleFlight:
+    """Выбор реализации: межпроцессная при SINGLEFLIGHT_REDIS=1 (по умолчанию при WORKERS > 1).
+
+    Redis подключается позже, на старте приложения; пока он недоступен,
+    RedisSingleFlight работает как локальный.
+    """
+    default = "1" if int(os.getenv("WORKERS", "1")) > 1 else "0"
+    if os.getenv("SINGLEFLIGHT_REDIS", default) == "1":
+        return RedisSingleFlight(name, cache)
+    return SingleFlight(name)
@@ -0,0 +1,249 @@
+"""Снимок каталогов и индекса названий на диске для теплого рестарта.
+
+Записи выбранных семейств ключей (anime:, title:) копятся в памяти и раз в
+interval секунд пишутся в SQLite (WAL, чтение через mmap). При старте
+ничего не загружается целиком: промах кэша по такому ключу проверяет снимок
+и возвращает запись в кэш с оставшимся TTL. Так после рестарта или сброса
+Redis известные тайтлы не идут в upstream.
+
+Удаления и инвалидации пишутся сразу, вместе с надгробием (ключ, тег или
+все) и его временем. Запись, сохраненная раньше надгробия, не читается -
+даже если другой воркер сбросит ее из своего буфера позже.
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires_at REAL NOT NULL,
+    tag TEXT,
+    stored_at REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS entries_tag ON entries (tag);
+CREATE INDEX IF NOT EXISTS entries_expires ON entries (expires_at);
+CREATE TABLE IF NOT EXISTS tombstones (
+    name TEXT PRIMARY KEY,
+    at REAL NOT NULL
+);
+"""
+
+# Запись старше надгробия своего ключа, тега или общего ("*") недействительна
+SHADOWED = """EXISTS (
+    SELECT 1 FROM tombstones t
+    WHERE t.name IN ('key:' || entries.key, 'tag:' || entries.tag, '*') AND t.at >= entries.stored_at
+)"""
+
+# (значение serializer, unix-время истечения, тег, время записи)
+Entry = Tuple[bytes, float, Optional[str], float]
+
+
+class CacheSnapshot:
+    """Журнал записей кэша в SQLite; файл может быть общим для воркеров"""
+
+    def __init__(
+        self,
+        path: str,
+        families: Iterable[str] = ("anime", "title"),
+        interval: float = 30,
+        mmap_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.path = path
+        self.families = set(families)
+        self.interval = interval
+        self.mmap_bytes = mmap_bytes
+        self._db: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        # Записи с прошлого сброса на диск
+        self._pending: Dict[str, Entry] = {}
+        # Надгробия, которые не удалось записать сразу: имя -> время
+        self._tombstones: Dict[str, float] = {}
+        # Надгробия хранятся, пока буферы других воркеров точно сброшены
+        self.tombstone_ttl = max(3600.0, interval * 10)
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.written = 0
+        self.flushes = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["CacheSnapshot"]:
+        path = os.getenv("CACHE_SNAPSHOT_PATH", "/tmp/aniyume-snapshot.db")
+        if not path:
+            return None
+        families = [f.strip() for f in os.getenv("CACHE_SNAPSHOT_FAMILIES", "anime,title").split(",") if f.strip()]
+        return cls(path, families, interval=float(os.getenv("CACHE_SNAPSHOT_INTERVAL", "30")))
+
+    def accepts(self, key: str) -> bool:
+        return key.split(":", 1)[0] in self.families
+
+    # ---------- изменения ----------
+    def record(self, key: str, data: bytes, ttl_seconds: float, tag: Optional[str] = None):
+        """Из event loop, без I/O: на диск попадет при следующем flush"""
+        now = time.time()
+        self._pending[key] = (data, now + ttl_seconds, tag, now)
+
+    async def forget(self, keys: Iterable[str]):
+        keys = [key for key in keys if self.accepts(key)]
+        for key in keys:
+            self._pending.pop(key, None)
+        await self._bury({f"key:{key}": time.time() for key in keys})
+
+    async def forget_tag(self, tag: str):
+        for key, entry in list(self._pending.items()):
+            if entry[2] == tag:
+                del self._pending[key]
+        await self._bury({f"tag:{tag}": time.time()})
+
+    async def clear(self):
+        self._pending.clear()
+        await self._bury({"*": time.time()})
+
+    async def _bury(self, tombstones: Dict[str, float]):
+        """Надгробия и удаление затронутых записей - сразу, не дожидаясь flush"""
+        if not tombstones:
+            return
+        try:
+            await asyncio.to_thread(self._write, {}, tombstones)
+        except Exception as e:
+            logger.error(f"❌ Snapshot invalidation failed, retrying on flush: {e!r}")
+            for name, at in tombstones.items():
+                self._tombstones[name] = max(at, self._tombstones.get(name, 0.0))
+
+    # ---------- SQLite (в отдельном потоке) ----------
+    def _connect(self) -> sqlite3.Connection:
+        if self._db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=5, check_same_thread=False, isolation_level=None)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(f"PRAGMA mmap_size={int(self.mmap_bytes)}")
+            columns = {row[1] for row in db.execute("PRAGMA table_info(entries)")}
+            if columns and "stored_at" not in columns:
+                # Файл от прежней версии без времени записи
+                db.execute("ALTER TABLE entries ADD COLUMN stored_at REAL NOT NULL DEFAULT 0")
+            db.executescript(SCHEMA)
+            self._db = db
+        return self._db
+
+    def _read(self, key: str) -> Optional[Entry]:
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT value, expires_at, tag, stored_at FROM entries"
+                f" WHERE key = ? AND expires_at > ? AND NOT {SHADOWED}",
+                (key, time.time()),
+            ).fetchone()
+        return (bytes(row[0]), row[1], row[2], row[3]) if row else None
+
+    def _buried_on_disk(self, key: str, entry: Entry) -> bool:
+        """Запись из буфера этого воркера, а надгробие мог записать другой"""
+        with self._lock:
+            row = self._connect().execute(
+                "SELECT max(at) FROM tombstones WHERE name IN (?, ?, '*')",
+                (f"key:{key}", f"tag:{entry[2]}"),
+            ).fetchone()
+        return row[0] is not None and row[0] >= entry[3]
+
+    def _write(self, pending: Dict[str, Entry], tombstones: Dict[str, float]) -> int:
+        now = time.time()
+        with self._lock:
+            db = self._connect()
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.executemany(
+                    "INSERT INTO tombstones (name, at) VALUES (?, ?)"
+                    " ON CONFLICT(name) DO UPDATE SET at = max(at, excluded.at)",
+                    list(tombstones.items()),
+                )
+                rows = [(k, e[0], e[1], e[2], e[3]) for k, e in pending.items()]
+                db.executemany(
+                    "INSERT OR REPLACE INTO entries (key, value, expires_at, tag, stored_at) VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+                db.execute(f"DELETE FROM entries WHERE expires_at <= ? OR {SHADOWED}", (now,))
+                db.execute("DELETE FROM tombstones WHERE at < ?", (now - self.tombstone_ttl,))
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+        return len(rows)
+
+    # ---------- async API ----------
+    def _buried(self, key: str, entry: Entry) -> bool:
+        """Надгробие, еще не записанное на диск, перекрывает запись"""
+        if not self._tombstones:
+            return False
+        at = max(self._tombstones.get(name, 0.0) for name in (f"key:{key}", f"tag:{entry[2]}", "*"))
+        return at >= entry[3]
+
+    async def get(self, key: str) -> Optional[Tuple[bytes, float, Optional[str]]]:
+        """(данные, оставшийся TTL, тег) или None"""
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = await asyncio.to_thread(self._read, key)
+        elif await asyncio.to_thread(self._buried_on_disk, key, entry):
+            entry = None
+        if entry is None or self._buried(key, entry):
+            self.misses += 1
+            return None
+        data, expires_at, tag, _ = entry
+        ttl = expires_at - time.time()
+        if ttl <= 1:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return data, ttl, tag
+
+    async def flush(self):
+        if not (self._pending or self._tombstones):
+            return
+        pending, self._pending = self._pending, {}
+        tombstones, self._tombstones = self._tombstones, {}
+        try:
+            self.written += await asyncio.to_thread(self._write, pending, tombstones)
+            self.flushes += 1
+        except Exception as e:
+            logger.error(f"❌ Snapshot write failed: {e!r}")
+            # Не потерять изменения: вернуть их, не затирая более новые
+            for key, entry in pending.items():
+                self._pending.setdefault(key, entry)
+            for name, at in tombstones.items():
+                self._tombstones[name] = max(at, self._tombstones.get(name, 0.0))
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self._loop(), name="cache-snapshot")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "pending": len(self._pending),
+            "hits": self.hits,
+            "misses": self.misses,
+            "written": self.written,
+            "flushes": self.flushes,
+        }
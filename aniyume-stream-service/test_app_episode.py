@@ -0,0 +1,105 @@
+import asyncio
+
+import httpx
+
+import app
+from catalog import AnimeCatalog, EpisodeRecord
+from upstream import CircuitBreaker, upstream
+from video_cache import VideoEntry
+
+
+def get_episode(**params) -> httpx.Response:
+    async def run():
+        async with app.app.router.lifespan_context(app.app):
+            transport = httpx.ASGITransport(app=app.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                await client.post("/cache/clear")
+                return await client.get("/stream/episode", params=params)
+    return asyncio.run(run())
+
+
+def title() -> str:
+    return app.get_extractor().titles[0]
+
+
+def test_episode_resolves():
+    response = get_episode(title=title(), episode_num="1")
+    assert response.status_code == 200
+    assert response.json()["ready"] is True
+
+
+def test_open_breaker_is_503_not_404(monkeypatch):
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, name="sources")
+    breaker.record(False)
+    monkeypatch.setitem(upstream.breakers, "sources", breaker)
+    response = get_episode(title=title(), episode_num="1")
+    assert response.status_code == 503
+    assert 1 <= int(response.headers["retry-after"]) <= 30
+
+
+def test_refresh_lookup_accepts_only_fresher_entry():
+    stale = VideoEntry(url="https://cdn.example/old.mp4", quality="720", fetched_at=1000.0)
+    fresh = VideoEntry(url="https://cdn.example/new.mp4", quality="720", fetched_at=2000.0)
+
+    async def run():
+        await app.cache.aset("video:test-refresh:1", stale, ttl_seconds=60)
+        before = await app.load_fresher_video("video:test-refresh:1", stale)
+        await app.cache.aset("video:test-refresh:1", fresh, ttl_seconds=60)
+        after = await app.load_fresher_video("video:test-refresh:1", stale)
+        await app.cache.adelete("video:test-refresh:1")
+        return before, after
+
+    before, after = asyncio.run(run())
+    assert before is None
+    assert after[0].url == fresh.url
+
+
+def test_stale_refresh_goes_through_locked_flight(monkeypatch):
+    calls = []
+
+    async def do(key, fn, lookup=None):
+        calls.append((key, lookup))
+        return None, "error"
+
+    monkeypatch.setattr(app.video_flight, "do", do)
+    catalog = AnimeCatalog(title="Test", anime_id="1", url="https://example/test")
+    episode = EpisodeRecord(id="1", num="1", title="")
+    stale = VideoEntry(url="https://cdn.example/old.mp4", quality="720", fetched_at=1000.0)
+
+    async def run():
+        app.schedule_video_refresh(catalog, episode, stale)
+        await asyncio.gather(*app.refresh_tasks)
+
+    asyncio.run(run())
+    assert len(calls) == 1
+    assert calls[0][1] is not None
+
+
+def test_background_checks_do_not_count_as_hits(monkeypatch):
+    observed = []
+    monkeypatch.setattr(app.warmer, "observe_hit", observed.append)
+
+    def video_hits() -> float:
+        return sum(
+            sample.value
+            for metric in app.video_cache_total.collect()
+            for sample in metric.samples
+            if sample.name.endswith("_total")
+        )
+
+    async def run():
+        catalog = await app.get_anime_episodes(title())
+        episode = catalog.episodes[0]
+        await app.resolve_video_entry(catalog, episode)
+        before = video_hits()
+        assert await app.is_video_warm(catalog, episode)
+        await app.prefetch_video(catalog, episode)
+        assert await app.warm_video(catalog, episode) is None
+        background = video_hits()
+        await app.resolve_video_entry(catalog, episode)
+        return before, background, video_hits()
+
+    before, background, after = asyncio.run(run())
+    assert background == before
+    assert after == before + 1
+    assert len([key for key in observed if key.startswith("video:")]) == 1
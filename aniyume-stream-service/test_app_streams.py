@@ -0,0 +1,126 @@
+import asyncio
+
+import httpx
+
+import app
+import monitoring
+from app import STREAMS_MAX_LIMIT, STREAMS_WINDOW
+
+
+def get_streams(**params) -> httpx.Response:
+    async def run():
+        async with app.app.router.lifespan_context(app.app):
+            transport = httpx.ASGITransport(app=app.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await client.get("/streams", params=params)
+    return asyncio.run(run())
+
+
+def title() -> str:
+    return app.get_extractor().titles[0]
+
+
+def nums(response: httpx.Response):
+    return [ep["num"] for ep in response.json()["streaming_episodes"]]
+
+
+def test_whole_list_without_limit():
+    data = get_streams(title=title(), preload=0).json()
+    assert data["offset"] == 0
+    assert data["next_offset"] is None
+    assert len(data["streaming_episodes"]) == data["total_episodes"]
+
+
+def test_offset_limit_page():
+    whole = nums(get_streams(title=title(), preload=0))
+    response = get_streams(title=title(), preload=0, offset=5, limit=10)
+    data = response.json()
+    assert response.status_code == 200
+    assert nums(response) == whole[5:15]
+    assert data["offset"] == 5
+    assert data["next_offset"] == 15
+    assert data["total_episodes"] == len(whole)
+
+
+def test_last_page_has_no_next_offset():
+    total = get_streams(title=title(), preload=0).json()["total_episodes"]
+    data = get_streams(title=title(), preload=0, offset=total - 3, limit=10).json()
+    assert len(data["streaming_episodes"]) == 3
+    assert data["next_offset"] is None
+
+
+def test_offset_past_the_end_is_empty():
+    total = get_streams(title=title(), preload=0).json()["total_episodes"]
+    data = get_streams(title=title(), preload=0, offset=total + 10, limit=5).json()
+    assert data["streaming_episodes"] == []
+    assert data["offset"] == total
+    assert data["next_offset"] is None
+
+
+def test_preload_resolves_only_page_start():
+    response = get_streams(title=title(), preload=2, offset=4, limit=5)
+    ready = [ep["ready"] for ep in response.json()["streaming_episodes"]]
+    assert ready == [True, True, False, False, False]
+
+
+def test_around_centers_window():
+    whole = nums(get_streams(title=title(), preload=0))
+    middle = len(whole) // 2
+    response = get_streams(title=title(), preload=1, around=whole[middle], limit=10)
+    page = nums(response)
+    assert page == whole[middle - 5:middle + 5]
+    first_ready = next(ep for ep in response.json()["streaming_episodes"] if ep["ready"])
+    assert first_ready["num"] == whole[middle]
+
+
+def test_around_near_start_and_end_is_clamped():
+    whole = nums(get_streams(title=title(), preload=0))
+    assert nums(get_streams(title=title(), preload=0, around=whole[0])) == whole[:STREAMS_WINDOW]
+    assert nums(get_streams(title=title(), preload=0, around=whole[-1], limit=10)) == whole[-10:]
+
+
+def test_around_unknown_episode_is_404():
+    assert get_streams(title=title(), preload=0, around="no-such-episode").status_code == 404
+
+
+def test_invalid_window_is_rejected():
+    assert get_streams(title=title(), offset=-1).status_code == 422
+    assert get_streams(title=title(), limit=0).status_code == 422
+    assert get_streams(title=title(), limit=STREAMS_MAX_LIMIT + 1).status_code == 422
+
+
+def test_around_window_does_not_reuse_offset_page_preloads():
+    whole = nums(get_streams(title=title(), preload=0))
+    page = get_streams(title=title(), preload=1, offset=STREAMS_WINDOW, limit=STREAMS_WINDOW)
+    target = whole[STREAMS_WINDOW + STREAMS_WINDOW // 2]
+    around = get_streams(title=title(), preload=1, around=target, limit=STREAMS_WINDOW)
+    assert nums(around) == nums(page)
+    ready = [ep["num"] for ep in around.json()["streaming_episodes"] if ep["ready"]]
+    assert ready == [target]
+
+
+def test_cache_clear_for_title_drops_cached_response():
+    async def run():
+        async with app.app.router.lifespan_context(app.app):
+            transport = httpx.ASGITransport(app=app.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                params = {"title": title(), "preload": 0}
+                await client.get("/streams", params=params)
+                hit = await client.get("/streams", params=params)
+                cleared = await client.post("/cache/clear", params={"title": title()})
+                after = await client.get("/streams", params=params)
+                return hit, cleared, after
+
+    hit, cleared, after = asyncio.run(run())
+    assert hit.headers["x-cache"] == "HIT"
+    assert cleared.json()["cached"] is True
+    assert cleared.json()["deleted"] >= 2
+    assert after.headers["x-cache"] == "MISS"
+
+
+def test_server_timing_only_when_enabled(monkeypatch):
+    assert "server-timing" not in get_streams(title=title(), preload=0).headers
+    monkeypatch.setattr(monitoring, "SERVER_TIMING", True)
+    header = get_streams(title=title(), preload=0).headers["server-timing"]
+    assert header.count("app;") == 1
+    assert "total;dur=" in header
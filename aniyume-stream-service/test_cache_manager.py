@@ -0,0 +1,115 @@
+import asyncio
+
+from cache_manager import CacheManager, MemoryCache
+
+
+class FakeRedis:
+    """Минимальный async-клиент: dict вместо Redis"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def setex(self, key, ttl, value):
+        self.data[key] = value
+
+    async def smembers(self, key):
+        return self.data.get(key, set())
+
+    async def unlink(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+
+def make_cache() -> CacheManager:
+    cache = CacheManager()
+    cache.snapshot = None
+    cache.async_client = FakeRedis()
+    return cache
+
+
+def test_memory_cache_lru_and_ttl():
+    memory = MemoryCache(max_entries=2)
+    memory.set("a", 1, 60)
+    memory.set("b", 2, 60)
+    memory.get("a")
+    memory.set("c", 3, 60)
+    assert memory.get("b") is None
+    assert memory.get("a") == 1
+    memory.set("d", 4, 0.001)
+    asyncio.run(asyncio.sleep(0.01))
+    assert memory.get("d") is None
+    assert memory.stats()["evictions"] == 2
+
+
+def test_outage_entries_dropped_when_redis_returns():
+    cache = make_cache()
+
+    async def run():
+        await cache.aset("anime:naruto", {"title": "Naruto"}, ttl_seconds=7200)
+        assert await cache.aget("anime:naruto") == {"title": "Naruto"}
+        cache._set_available(True)
+        return await cache.aget("anime:naruto")
+
+    assert asyncio.run(run()) is None
+    assert len(cache.memory_cache) == 0
+
+
+def test_invalidate_tag_in_memory_mode():
+    cache = make_cache()
+
+    async def run():
+        await cache.amset({"anime:naruto": 1, "video:naruto:1": 2}, ttl_seconds=60, tag="naruto")
+        await cache.aset("anime:bleach", 3, ttl_seconds=60, tag="bleach")
+        deleted = await cache.ainvalidate("naruto")
+        return deleted, [await cache.aget(k) for k in ("anime:naruto", "video:naruto:1", "anime:bleach")]
+
+    assert asyncio.run(run()) == (2, [None, None, 3])
+    assert cache.memory_cache.stats()["tags"] == 1
+
+
+def test_invalidate_tag_drops_outage_entries_with_redis():
+    cache = make_cache()
+
+    async def run():
+        # Записано во время сбоя: в памяти с тегом, в индексе Redis его нет
+        await cache.aset("anime:naruto", 1, ttl_seconds=60, tag="naruto")
+        cache.use_redis = True
+        deleted = await cache.ainvalidate("naruto")
+        cache.use_redis = False
+        return deleted, await cache.aget("anime:naruto")
+
+    assert asyncio.run(run()) == (1, None)
+
+
+def test_invalidate_survives_redis_errors():
+    cache = make_cache()
+
+    class Broken(FakeRedis):
+        async def smembers(self, key):
+            raise ConnectionError("redis down")
+
+    cache.async_client = Broken()
+    cache.use_redis = True
+    assert asyncio.run(cache.ainvalidate("naruto")) == 0
+
+
+def test_untracked_get_skips_lookup_metrics():
+    cache = make_cache()
+    seen = []
+    cache.on_lookup = lambda key, tier, hit: seen.append((key, tier, hit))
+
+    async def run():
+        await cache.aset("video:naruto:1", {"url": "u"}, ttl_seconds=60)
+        assert await cache.aget("video:naruto:1", track=False) == {"url": "u"}
+        assert await cache.aget("video:naruto:2", track=False) is None
+        return await cache.aget("video:naruto:1")
+
+    assert asyncio.run(run()) == {"url": "u"}
+    assert seen == [("video:naruto:1", "memory", True)]
+
+
+def test_lease_without_redis_is_always_held():
+    cache = make_cache()
+    assert asyncio.run(cache.alease("warmer", 60)) is True
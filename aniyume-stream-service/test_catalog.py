@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+from anicli_api.source.animego import Extractor
+
+from catalog import CATALOG_VERSION, AnimeCatalog, EpisodeRecord
+
+
+def anicli_objects():
+    card = SimpleNamespace(url="https://animego.example/anime/naruto-123")
+    anime = SimpleNamespace(title="Naruto", id=123, thumbnail=None)
+    episodes = [
+        SimpleNamespace(id=10, num=1, title="Enter: Naruto", dubbers={"1": "AniLibria"}, videos=None),
+        SimpleNamespace(id=11, num=2, title=None, dubbers={"2": "AniDub"}, videos=[{"url": "https://p/2"}]),
+    ]
+    return card, anime, episodes
+
+
+def test_from_anicli_keeps_plain_data():
+    catalog = AnimeCatalog.from_anicli(*anicli_objects())
+    assert catalog.title == "Naruto"
+    assert catalog.anime_id == "123"
+    assert catalog.url == "https://animego.example/anime/naruto-123"
+    assert catalog.thumbnail == ""
+    assert catalog.dubbers == {"1": "AniLibria", "2": "AniDub"}
+    assert catalog.episodes == [
+        EpisodeRecord(id="10", num="1", title="Enter: Naruto"),
+        EpisodeRecord(id="11", num="2", title="", videos=[{"url": "https://p/2"}]),
+    ]
+    assert catalog.fetched_at > 0
+
+
+def test_to_episode_rebuilds_anicli_episode():
+    catalog = AnimeCatalog.from_anicli(*anicli_objects())
+    episode = catalog.to_episode(catalog.episodes[1], Extractor())
+    assert episode.id == "11"
+    assert episode.num == "2"
+    assert episode.dubbers == catalog.dubbers
+    assert episode.videos == [{"url": "https://p/2"}]
+
+
+def test_to_episode_uses_extractor_builder():
+    catalog = AnimeCatalog.from_anicli(*anicli_objects())
+    extractor = SimpleNamespace(build_episode=lambda c, record: ("built", c.title, record.num))
+    assert catalog.to_episode(catalog.episodes[0], extractor) == ("built", "Naruto", "1")
+
+
+def test_dict_round_trip():
+    catalog = AnimeCatalog.from_anicli(*anicli_objects())
+    assert AnimeCatalog.from_cache(catalog.to_dict()) == catalog
+    assert AnimeCatalog.from_cache(catalog) is catalog
+
+
+def test_other_catalog_version_is_a_miss():
+    data = AnimeCatalog.from_anicli(*anicli_objects()).to_dict()
+    data["v"] = CATALOG_VERSION + 1
+    assert AnimeCatalog.from_cache(data) is None
+    assert AnimeCatalog.from_cache(None) is None
+
+
+def test_find_episode_and_episodes_after():
+    catalog = AnimeCatalog(
+        title="t", anime_id="1",
+        episodes=[EpisodeRecord(id=str(i), num=str(i), title="") for i in range(1, 6)],
+    )
+    assert catalog.find_episode(3).id == "3"
+    assert catalog.find_episode("9") is None
+    assert [ep.num for ep in catalog.episodes_after("2", 2)] == ["3", "4"]
+    assert catalog.episodes_after("9", 2) == []
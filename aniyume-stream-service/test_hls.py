@@ -0,0 +1,106 @@
+import os
+from urllib.parse import quote
+
+from hls import rewrite_playlist
+from segment_store import SegmentStore
+
+
+def playlist(url: str) -> str:
+    return f"playlist?url={quote(url, safe='')}"
+
+
+def segment(url: str) -> str:
+    return f"segment?url={quote(url, safe='')}"
+
+
+def test_master_playlist_links_variants_and_renditions():
+    text = (
+        "#EXTM3U\n"
+        '#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="a",URI="audio/ru.m3u8"\n'
+        "#EXT-X-STREAM-INF:BANDWIDTH=800000\n"
+        "hi/index.m3u8\n"
+        '#EXT-X-I-FRAME-STREAM-INF:BANDWIDTH=80000,URI="iframes.m3u8"\n'
+    )
+    lines = rewrite_playlist(text, "https://cdn.example/show/master.m3u8").splitlines()
+    assert lines[0] == "#EXTM3U"
+    assert lines[1] == f'#EXT-X-MEDIA:TYPE=AUDIO,GROUP-ID="a",URI="{playlist("https://cdn.example/show/audio/ru.m3u8")}"'
+    assert lines[2] == "#EXT-X-STREAM-INF:BANDWIDTH=800000"
+    assert lines[3] == playlist("https://cdn.example/show/hi/index.m3u8")
+    assert lines[4] == f'#EXT-X-I-FRAME-STREAM-INF:BANDWIDTH=80000,URI="{playlist("https://cdn.example/show/iframes.m3u8")}"'
+
+
+def test_media_playlist_links_segments_keys_and_maps():
+    text = (
+        "#EXTM3U\n"
+        "#EXT-X-TARGETDURATION:4\n"
+        '#EXT-X-KEY:METHOD=AES-128,URI="../key.bin"\n'
+        '#EXT-X-MAP:URI="init.mp4"\n'
+        "#EXTINF:4,\n"
+        "seg1.ts\n"
+        "\n"
+        "#EXTINF:4,\n"
+        "https://other.cdn/seg2.ts?tok=1\n"
+        "#EXT-X-ENDLIST"
+    )
+    rewritten = rewrite_playlist(text, "https://cdn.example/show/hi/index.m3u8")
+    lines = rewritten.splitlines()
+    assert rewritten.endswith("\n")
+    assert lines[1] == "#EXT-X-TARGETDURATION:4"
+    assert lines[2] == f'#EXT-X-KEY:METHOD=AES-128,URI="{segment("https://cdn.example/show/key.bin")}"'
+    assert lines[3] == f'#EXT-X-MAP:URI="{segment("https://cdn.example/show/hi/init.mp4")}"'
+    assert lines[5] == segment("https://cdn.example/show/hi/seg1.ts")
+    assert lines[6] == ""
+    assert lines[8] == segment("https://other.cdn/seg2.ts?tok=1")
+    assert lines[9] == "#EXT-X-ENDLIST"
+
+
+def test_relative_links_resolve_against_final_url():
+    rewritten = rewrite_playlist("#EXTM3U\n#EXTINF:4,\n/abs/seg.ts\n", "https://edge2.cdn.example/a/b/index.m3u8")
+    assert segment("https://edge2.cdn.example/abs/seg.ts") in rewritten
+
+
+def fill(store: SegmentStore, key: str, size: int, mtime: float):
+    temp = store.temp_path()
+    with open(temp, "wb") as f:
+        f.write(b"\0" * size)
+    path = store.commit(key, temp, size)
+    os.utime(path, (mtime, mtime))
+
+
+def test_store_constructor_does_not_touch_disk(tmp_path):
+    directory = tmp_path / "segments"
+    store = SegmentStore(str(directory), 100)
+    assert not directory.exists()
+    store.open()
+    assert directory.is_dir()
+
+
+def test_sweep_enforces_limit_across_workers(tmp_path):
+    first = SegmentStore(str(tmp_path), 100)
+    second = SegmentStore(str(tmp_path), 100)
+    first.open()
+    second.open()
+    fill(first, "a", 40, 1000)
+    fill(second, "b", 40, 1001)
+    fill(first, "c", 40, 1002)
+    fill(second, "d", 40, 1003)
+    # Каждый воркер видит только свои 80 байт, в каталоге - 160
+    assert sorted(os.listdir(tmp_path)) == ["a", "b", "c", "d"]
+
+    first.sweep()
+    assert sorted(os.listdir(tmp_path)) == ["c", "d"]
+    assert first.stats()["bytes"] == 80
+    assert first.get("d") is not None
+    assert second.get("b") is None
+
+
+def test_get_refreshes_access_time_for_sweep(tmp_path):
+    store = SegmentStore(str(tmp_path), 100)
+    store.open()
+    fill(store, "a", 40, 1000)
+    fill(store, "b", 40, 1001)
+    assert store.get("a") is not None
+    # Другой воркер с тем же каталогом: порядок вытеснения берется с диска
+    other = SegmentStore(str(tmp_path), 60)
+    other.sweep()
+    assert os.listdir(tmp_path) == ["a"]
@@ -0,0 +1,69 @@
+import gzip
+
+from starlette.requests import Request
+
+import http_cache
+from http_cache import build_entry, cached_response, dump_json
+
+
+def request(**headers) -> Request:
+    raw = [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]
+    return Request({"type": "http", "method": "GET", "path": "/streams", "headers": raw})
+
+
+def entry(size: int = 4096):
+    return build_entry(dump_json({"items": ["x" * 16] * (size // 16)}))
+
+
+def test_small_body_is_not_compressed():
+    small = build_entry(b"{}")
+    assert small["encodings"] == {}
+    response = cached_response(request(accept_encoding="gzip"), small, "no-cache")
+    assert "content-encoding" not in response.headers
+    assert response.headers["etag"] == small["etag"]
+
+
+def test_picks_best_accepted_encoding():
+    cached = entry()
+    assert cached_response(request(), cached, "no-cache").body == cached["body"]
+
+    response = cached_response(request(accept_encoding="gzip, deflate"), cached, "no-cache")
+    assert response.headers["content-encoding"] == "gzip"
+    assert gzip.decompress(response.body) == cached["body"]
+
+    if http_cache.brotli is not None:
+        response = cached_response(request(accept_encoding="gzip, br"), cached, "no-cache")
+        assert response.headers["content-encoding"] == "br"
+
+    response = cached_response(request(accept_encoding="gzip;q=0, identity"), cached, "no-cache")
+    assert "content-encoding" not in response.headers
+
+
+def test_each_encoding_has_its_own_etag():
+    cached = entry()
+    plain = cached_response(request(), cached, "no-cache").headers["etag"]
+    gzipped = cached_response(request(accept_encoding="gzip"), cached, "no-cache").headers["etag"]
+    assert plain == cached["etag"]
+    assert gzipped == cached["etag"][:-1] + '-gzip"'
+
+
+def test_if_none_match_returns_304_for_same_representation():
+    cached = entry()
+    etag = cached_response(request(accept_encoding="gzip"), cached, "public, max-age=60").headers["etag"]
+
+    response = cached_response(request(accept_encoding="gzip", if_none_match=etag), cached, "public, max-age=60")
+    assert response.status_code == 304
+    assert response.body == b""
+    assert response.headers["etag"] == etag
+    assert response.headers["cache-control"] == "public, max-age=60"
+
+    weak = cached_response(request(accept_encoding="gzip", if_none_match=f'"other", W/{etag}'), cached, "no-cache")
+    assert weak.status_code == 304
+
+
+def test_etag_of_other_encoding_does_not_match():
+    cached = entry()
+    gzipped = cached_response(request(accept_encoding="gzip"), cached, "no-cache").headers["etag"]
+    response = cached_response(request(if_none_match=gzipped), cached, "no-cache")
+    assert response.status_code == 200
+    assert response.body == cached["body"]
@@ -0,0 +1,98 @@
+import asyncio
+import socket
+
+import httpx
+import pytest
+from fastapi import HTTPException
+
+import proxy
+from proxy import is_public_address, send_checked, validate_upstream_url
+
+
+def status(url: str, resolved=None) -> int:
+    async def run():
+        if resolved is not None:
+            async def getaddrinfo(host, port, **kwargs):
+                return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port)) for address in resolved]
+            asyncio.get_running_loop().getaddrinfo = getaddrinfo
+        try:
+            await validate_upstream_url(url)
+        except HTTPException as e:
+            return e.status_code
+        return 200
+    return asyncio.run(run())
+
+
+@pytest.mark.parametrize("address, public", [
+    ("93.184.216.34", True),
+    ("2606:2800:220:1::1", True),
+    ("127.0.0.1", False),
+    ("10.0.0.5", False),
+    ("172.16.0.1", False),
+    ("192.168.1.1", False),
+    ("169.254.169.254", False),
+    ("::1", False),
+    ("fe80::1%eth0", False),
+    ("::ffff:127.0.0.1", False),
+    ("::ffff:10.0.0.1", False),
+    ("224.0.0.1", False),
+])
+def test_is_public_address(address, public):
+    assert is_public_address(address) is public
+
+
+@pytest.mark.parametrize("url", [
+    "ftp://kodik.info/video.mp4",
+    "file:///etc/passwd",
+    "http:///video.mp4",
+    "kodik.info/video.mp4",
+])
+def test_invalid_urls_are_rejected(url):
+    assert status(url) == 400
+
+
+def test_host_outside_allow_list_is_rejected(monkeypatch):
+    monkeypatch.setattr(proxy, "PROXY_ALLOWED_HOSTS", ["kodik.info"])
+    assert status("https://evil.example/video.mp4", ["93.184.216.34"]) == 403
+    assert status("https://kodik.info.evil.example/video.mp4", ["93.184.216.34"]) == 403
+    assert status("https://cdn.kodik.info/video.mp4", ["93.184.216.34"]) == 200
+    assert status("https://kodik.info/video.mp4", ["93.184.216.34"]) == 200
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1/",
+    "http://localhost:6379/",
+    "http://169.254.169.254/latest/meta-data/",
+    "http://10.0.0.5/video.mp4",
+    "http://[::1]/",
+    "http://[::ffff:127.0.0.1]/",
+])
+def test_non_public_targets_are_rejected(monkeypatch, url):
+    monkeypatch.setattr(proxy, "PROXY_ALLOWED_HOSTS", ["*"])
+    assert status(url) == 403
+
+
+def test_allowed_host_resolving_to_private_address_is_rejected(monkeypatch):
+    monkeypatch.setattr(proxy, "PROXY_ALLOWED_HOSTS", ["kodik.info"])
+    assert status("https://kodik.info/video.mp4", ["93.184.216.34", "10.0.0.5"]) == 403
+
+
+def test_redirect_to_private_address_is_refused(monkeypatch):
+    monkeypatch.setattr(proxy, "PROXY_ALLOWED_HOSTS", ["*"])
+    requested = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        requested.append(str(request.url))
+        return httpx.Response(302, headers={"location": "http://169.254.169.254/latest/meta-data/"})
+
+    async def run():
+        monkeypatch.setattr(proxy, "_client", httpx.AsyncClient(transport=httpx.MockTransport(handler)))
+        try:
+            with pytest.raises(HTTPException) as error:
+                await send_checked("http://93.184.216.34/video.mp4")
+            return error.value.status_code
+        finally:
+            await proxy._client.aclose()
+
+    assert asyncio.run(run()) == 403
+    assert requested == ["http://93.184.216.34/video.mp4"]
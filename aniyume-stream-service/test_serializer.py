@@ -0,0 +1,71 @@
+import pytest
+
+import serializer
+from catalog import AnimeCatalog, EpisodeRecord
+from serializer import FLAG_ZLIB, SerializationError
+from video_cache import VideoEntry
+
+
+def make_catalog(episodes: int = 3) -> AnimeCatalog:
+    return AnimeCatalog(
+        title="Naruto",
+        anime_id="123",
+        url="https://animego.example/anime/naruto-123",
+        thumbnail="https://animego.example/naruto.jpg",
+        dubbers={"1": "AniLibria"},
+        episodes=[
+            EpisodeRecord(id=str(i), num=str(i + 1), title=f"Episode {i + 1}")
+            for i in range(episodes)
+        ],
+        fetched_at=1700000000.5,
+    )
+
+
+def test_catalog_round_trip():
+    catalog = make_catalog()
+    catalog.episodes[0].videos = [{"url": "https://player.example/1", "name": "Kodik"}]
+    assert serializer.loads(serializer.dumps(catalog)) == catalog
+
+
+def test_video_entry_round_trip():
+    entry = VideoEntry(
+        url="https://cdn.example/1080.m3u8?expires=1900000000",
+        quality="1080",
+        fetched_at=1700000000.0,
+        expires_at=1900000000.0,
+        variants=[
+            {"url": "https://cdn.example/1080.m3u8?expires=1900000000", "quality": 1080, "source": "Kodik"},
+            {"url": "https://cdn.example/720.m3u8", "quality": 720, "source": "AniLibria"},
+        ],
+    )
+    assert serializer.loads(serializer.dumps(entry)) == entry
+
+
+def test_plain_values_round_trip():
+    value = {"etag": '"abc"', "body": b"\x00\x01", "encodings": {}, "items": [1, "2", None, 3.5]}
+    assert serializer.loads(serializer.dumps(value)) == value
+
+
+def test_large_values_are_compressed():
+    catalog = make_catalog(episodes=500)
+    data = serializer.dumps(catalog)
+    assert data[1] & FLAG_ZLIB
+    assert serializer.loads(data) == catalog
+
+
+def test_small_values_are_not_compressed():
+    assert serializer.dumps({"a": 1})[1] == 0
+
+
+@pytest.mark.parametrize("data", [b"", b"\x01", b"\x80\x04\x95", b"\x01\x00\xc1", b"\x01\x01not-zlib"])
+def test_unknown_or_corrupted_data_raises(data):
+    with pytest.raises(SerializationError):
+        serializer.loads(data)
+
+
+def test_unknown_ext_type_raises():
+    import msgpack
+
+    body = msgpack.packb(msgpack.ExtType(99, b""), use_bin_type=True)
+    with pytest.raises(SerializationError):
+        serializer.loads(bytes((serializer.FORMAT_VERSION, 0)) + body)
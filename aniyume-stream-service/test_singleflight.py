@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+from singleflight import RedisSingleFlight, SingleFlight
+
+
+def test_concurrent_calls_share_one_upstream_call():
+    flight = SingleFlight("test")
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "catalog"
+
+    async def run():
+        return await asyncio.gather(*(flight.do("naruto", fetch) for _ in range(10)))
+
+    assert asyncio.run(run()) == ["catalog"] * 10
+    assert len(calls) == 1
+    assert flight.stats() == {"calls": 1, "coalesced": 9, "in_flight": 0}
+
+
+def test_different_keys_are_not_coalesced():
+    flight = SingleFlight("test")
+
+    async def run():
+        return await asyncio.gather(
+            flight.do("a", lambda: asyncio.sleep(0.01, "a")),
+            flight.do("b", lambda: asyncio.sleep(0.01, "b")),
+        )
+
+    assert asyncio.run(run()) == ["a", "b"]
+    assert flight.calls == 2
+
+
+def test_error_reaches_every_waiter_and_is_not_cached():
+    flight = SingleFlight("test")
+    attempts = []
+
+    async def fail():
+        attempts.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        results = await asyncio.gather(*(flight.do("k", fail) for _ in range(3)), return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        with pytest.raises(RuntimeError):
+            await flight.do("k", fail)
+
+    asyncio.run(run())
+    assert len(attempts) == 2
+
+
+def test_cancelled_waiter_does_not_cancel_shared_call():
+    flight = SingleFlight("test")
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return "done"
+
+    async def run():
+        first = asyncio.ensure_future(flight.do("k", fetch))
+        second = asyncio.ensure_future(flight.do("k", fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert asyncio.run(run()) == "done"
+
+
+def test_redis_flight_without_redis_coalesces_locally():
+    class NoRedis:
+        use_redis = False
+
+    flight = RedisSingleFlight("test", NoRedis())
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "video"
+
+    async def lookup():
+        raise AssertionError("lookup is only polled across workers")
+
+    async def run():
+        return await asyncio.gather(*(flight.do("k", fetch, lookup=lookup) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["video"] * 5
+    assert len(calls) == 1
+
+
+def test_waits_for_other_worker_result():
+    class LockedClient:
+        async def set(self, key, value, nx=False, px=None):
+            return False
+
+        async def exists(self, key):
+            return 1
+
+    class SharedCache:
+        use_redis = True
+        async_client = LockedClient()
+
+        @staticmethod
+        def rkey(key):
+            return key
+
+    flight = RedisSingleFlight("test", SharedCache(), poll_interval=0.001)
+    polls = []
+
+    async def fetch():
+        raise AssertionError("leader is another worker")
+
+    async def lookup():
+        polls.append(1)
+        return "cached" if len(polls) >= 2 else None
+
+    assert asyncio.run(flight.do("k", fetch, lookup=lookup)) == "cached"
+    assert flight.stats()["remote_waits"] == 1
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+import serializer
+from cache_manager import CacheManager
+from snapshot import CacheSnapshot
+
+
+def snapshot(tmp_path) -> CacheSnapshot:
+    return CacheSnapshot(str(tmp_path / "snapshot.db"), interval=0)
+
+
+def test_entry_survives_restart_with_remaining_ttl(tmp_path):
+    async def run():
+        first = snapshot(tmp_path)
+        first.record("anime:naruto", b"catalog", 100, tag="naruto")
+        await first.flush()
+        await first.stop()
+        return await snapshot(tmp_path).get("anime:naruto")
+
+    data, ttl, tag = asyncio.run(run())
+    assert data == b"catalog"
+    assert tag == "naruto"
+    assert 95 < ttl <= 100
+
+
+def test_only_configured_families_are_accepted(tmp_path):
+    store = snapshot(tmp_path)
+    assert store.accepts("anime:naruto")
+    assert store.accepts("title:naruto")
+    assert not store.accepts("video:naruto:1")
+
+
+def test_tag_tombstone_hides_entry_flushed_later_by_other_worker(tmp_path):
+    async def run():
+        first, second = snapshot(tmp_path), snapshot(tmp_path)
+        first.record("anime:naruto", b"old", 100, tag="naruto")
+        await asyncio.sleep(0.01)
+        await second.forget_tag("naruto")
+        # Буфер первого воркера сбрасывается уже после инвалидации
+        assert await first.get("anime:naruto") is None
+        await first.flush()
+        return await first.get("anime:naruto"), await second.get("anime:naruto")
+
+    assert asyncio.run(run()) == (None, None)
+
+
+def test_entry_stored_after_tombstone_is_visible(tmp_path):
+    async def run():
+        store = snapshot(tmp_path)
+        await store.forget(["anime:naruto"])
+        await asyncio.sleep(0.01)
+        store.record("anime:naruto", b"new", 100, tag="naruto")
+        await store.flush()
+        return await snapshot(tmp_path).get("anime:naruto")
+
+    assert asyncio.run(run())[0] == b"new"
+
+
+def test_clear_hides_everything_written_before(tmp_path):
+    async def run():
+        store = snapshot(tmp_path)
+        store.record("anime:a", b"a", 100)
+        store.record("title:b", b"b", 100, tag="b")
+        await store.flush()
+        await asyncio.sleep(0.01)
+        await snapshot(tmp_path).clear()
+        return await store.get("anime:a"), await store.get("title:b")
+
+    assert asyncio.run(run()) == (None, None)
+
+
+def test_cache_miss_restores_entry_with_remaining_ttl_and_tag(tmp_path):
+    cache = CacheManager()
+    cache.snapshot = snapshot(tmp_path)
+
+    async def run():
+        cache.snapshot.record("anime:naruto", serializer.dumps({"title": "Naruto"}), 50, tag="naruto")
+        await cache.snapshot.flush()
+        value = await cache.aget("anime:naruto")
+        expires_at = cache.memory_cache._data["anime:naruto"][0]
+        deleted = await cache.ainvalidate("naruto")
+        return value, expires_at - time.monotonic(), deleted, await cache.aget("anime:naruto")
+
+    value, ttl, deleted, after = asyncio.run(run())
+    assert value == {"title": "Naruto"}
+    assert 45 < ttl <= 50
+    assert deleted == 1
+    assert after is None
@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from upstream import CLOSED, HALF_OPEN, OPEN, AIMDLimiter, CircuitBreaker, UpstreamGovernor, UpstreamUnavailable
+
+
+def open_breaker(breaker: CircuitBreaker):
+    for _ in range(breaker.failure_threshold):
+        assert breaker.allow()
+        breaker.record(False)
+
+
+def test_opens_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == CLOSED
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert 0 < breaker.retry_after() <= 30
+
+
+def test_success_resets_failure_count():
+    breaker = CircuitBreaker(failure_threshold=3, reset_timeout=30)
+    breaker.record(False)
+    breaker.record(False)
+    breaker.record(True)
+    breaker.record(False)
+    breaker.record(False)
+    assert breaker.state == CLOSED
+
+
+def test_half_open_allows_single_probe():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    breaker.opened_at -= 31
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()
+
+
+def test_probe_success_closes():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    breaker.opened_at -= 31
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_probe_failure_reopens():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    breaker.opened_at -= 31
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_abandoned_probe_allows_next():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+    open_breaker(breaker)
+    breaker.opened_at -= 31
+    assert breaker.allow()
+    breaker.abandon()
+    assert breaker.allow()
+
+
+def test_stage_failures_do_not_open_other_stages():
+    governor = UpstreamGovernor(
+        timeouts={"search": 1.0, "videos": 1.0},
+        limiter=AIMDLimiter(8, 1, 8),
+        breaker_failures=2,
+        breaker_reset=30,
+    )
+
+    async def fail():
+        raise RuntimeError("player down")
+
+    async def ok():
+        return "found"
+
+    async def run():
+        for _ in range(2):
+            with pytest.raises(RuntimeError):
+                await governor.call("videos", fail)
+        with pytest.raises(UpstreamUnavailable):
+            await governor.call("videos", ok)
+        return await governor.call("search", ok)
+
+    assert asyncio.run(run()) == "found"
+    assert governor.breakers["videos"].state == OPEN
+    assert governor.breakers["search"].state == CLOSED
+    assert governor.degraded()
@@ -0,0 +1,62 @@
+import pytest
+
+from video_cache import EXPIRED, FRESH, STALE, VideoEntry, parse_quality, parse_url_expiry
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("1080", 1080),
+    ("720p", 720),
+    ("HD 720", 720),
+    ("1920x1080", 1080),
+    ("4K", 2160),
+    ("fullhd", 1080),
+    ("sd", 480),
+    (480, 480),
+    (720.0, 720),
+    ("", 0),
+    (None, 0),
+    ("unknown", 0),
+    (True, 0),
+])
+def test_parse_quality(value, expected):
+    assert parse_quality(value) == expected
+
+
+@pytest.mark.parametrize("url, expected", [
+    ("https://cdn.example/v.mp4?expires=1900000000", 1900000000.0),
+    ("https://cdn.example/v.mp4?Expires=1900000000", 1900000000.0),
+    ("https://cdn.example/v.mp4?exp=1900000000123", 1900000000.0),
+    ("https://cdn.example/v.mp4?X-Amz-Date=20240101T000000Z&X-Amz-Expires=3600", 1704067200.0 + 3600),
+    ("https://cdn.example/v.mp4?X-Amz-Date=bad&X-Amz-Expires=3600", None),
+    ("https://cdn.example/v.mp4?e=1", None),
+    ("https://cdn.example/v.mp4?expires=soon", None),
+    ("https://cdn.example/v.mp4", None),
+])
+def test_parse_url_expiry(url, expected):
+    assert parse_url_expiry(url) == expected
+
+
+def test_entry_state():
+    entry = VideoEntry(url="https://cdn.example/v.mp4", quality="720", fetched_at=1000.0)
+    assert entry.state(soft_ttl=60, hard_ttl=120, now=1030) == FRESH
+    assert entry.state(soft_ttl=60, hard_ttl=120, now=1090) == STALE
+    assert entry.state(soft_ttl=60, hard_ttl=120, now=1130) == EXPIRED
+
+
+def test_entry_state_follows_signed_url_expiry():
+    entry = VideoEntry(url="https://cdn.example/v.mp4", quality="720", fetched_at=1000.0, expires_at=1100.0)
+    assert entry.state(soft_ttl=600, hard_ttl=1200, expiry_margin=60, now=1030) == FRESH
+    assert entry.state(soft_ttl=600, hard_ttl=1200, expiry_margin=60, now=1045) == EXPIRED
+
+
+def test_pick_closest_quality():
+    variants = [
+        {"url": "u1080", "quality": 1080, "source": "a"},
+        {"url": "u720", "quality": 720, "source": "a"},
+        {"url": "u360", "quality": 360, "source": "b"},
+    ]
+    entry = VideoEntry.from_variants(variants)
+    assert entry.pick() == ("u1080", "1080")
+    assert entry.pick(720) == ("u720", "720")
+    assert entry.pick(480) == ("u360", "360")
+    assert entry.pick(240) == ("u360", "360")
@@ -0,0 +1,46 @@
+import asyncio
+
+from catalog import AnimeCatalog, EpisodeRecord
+from warmer import PopularityWarmer
+
+
+def make_warmer(budgets, warmed):
+    catalog = AnimeCatalog(
+        title="Test", anime_id="1",
+        episodes=[EpisodeRecord(id=str(n), num=str(n), title="") for n in range(1, 4)],
+    )
+
+    async def warm_catalog(title):
+        warmed.append(title)
+        return catalog, f"anime:{title}"
+
+    async def warm_video(catalog, episode):
+        warmed.append(episode.num)
+        return f"video:{episode.num}"
+
+    async def cycle_budget():
+        return budgets.pop(0)
+
+    warmer = PopularityWarmer(
+        warm_catalog=warm_catalog, warm_video=warm_video,
+        interval=60, budget=20, latest_episodes=3, cycle_budget=cycle_budget,
+    )
+    for title in ("naruto", "bleach"):
+        warmer.record(title)
+    return warmer
+
+
+def test_cycle_skipped_without_budget():
+    warmed = []
+    counts = asyncio.run(make_warmer([0], warmed).run_once())
+    assert warmed == []
+    assert counts["skipped"] is True
+    assert counts["budget_used"] == 0
+
+
+def test_cycle_budget_replaces_static_budget():
+    warmed = []
+    counts = asyncio.run(make_warmer([3], warmed).run_once())
+    assert len(warmed) == 3
+    assert counts["budget_used"] == 3
+    assert counts["over_budget"] > 0
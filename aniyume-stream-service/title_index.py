@@ -0,0 +1,119 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, FrozenSet, Iterable, Optional
+import os
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE = re.compile(r'\s+')
+PUNCTUATION = re.compile(r'[^\w\s]')
+MOVIE_KEYWORDS = re.compile(
+    '|'.join(['фильм', 'movie', 'film', 'поезд', 'бесконечный',
+              'train', 'infinity', 'муген', 'mugen', 'часть', 'part'])
+)
+
+# Время жизни привязки запроса к карточке
+TITLE_INDEX_TTL = int(os.getenv("TITLE_INDEX_TTL", str(7 * 24 * 3600)))
+
+
+@lru_cache(maxsize=65536)
+def normalize_title(title: str) -> str:
+    """Нормализация названия"""
+    title = title.lower().strip()
+    title = WHITESPACE.sub(' ', title)
+    title = PUNCTUATION.sub('', title)
+    return title
+
+
+@lru_cache(maxsize=65536)
+def is_movie(title: str) -> bool:
+    """Определение фильма"""
+    return MOVIE_KEYWORDS.search(title.lower()) is not None
+
+
+@dataclass(frozen=True)
+class TitleFeatures:
+    """Предрасчитанные признаки названия для нечеткого сравнения"""
+    norm: str
+    tokens: FrozenSet[str]
+    trigrams: FrozenSet[str]
+    movie: bool
+
+
+@lru_cache(maxsize=65536)
+def title_features(title: str) -> TitleFeatures:
+    norm = normalize_title(title)
+    padded = f"  {norm} "
+    return TitleFeatures(
+        norm=norm,
+        tokens=frozenset(norm.split()),
+        trigrams=frozenset(padded[i:i + 3] for i in range(len(padded) - 2)),
+        movie=is_movie(title),
+    )
+
+
+def similarity(query: TitleFeatures, title: TitleFeatures) -> float:
+    """Схожесть по триграммам (Dice) и пересечению слов, со штрафом за фильм"""
+    # Штраф за фильм если ищется сериал
+    penalty = 0.3 if title.movie and not query.movie else 0
+
+    total = len(query.trigrams) + len(title.trigrams)
+    base_ratio = 2 * len(query.trigrams & title.trigrams) / total if total else 0.0
+
+    # Бонус за совпадение слов
+    word_overlap = len(query.tokens & title.tokens) / max(len(query.tokens), 1)
+
+    return max(0, (base_ratio * 0.6 + word_overlap * 0.4) - penalty)
+
+
+def calculate_similarity(query: str, title: str) -> float:
+    return similarity(title_features(query), title_features(title))
+
+
+def card_key(url: str, title: str) -> str:
+    """Стабильный ключ аниме: slug из URL карточки (/anime/naruto-42 -> naruto-42)"""
+    slug = url.rstrip('/').rsplit('/', 1)[-1] if url else ""
+    return slug or normalize_title(title)
+
+
+class TitleIndex:
+    """Соответствие нормализованных запросов и алиасов выбранной карточке.
+
+    Хранится через CacheManager (L1 + Redis), поэтому повторный поиск
+    по тому же или другому известному названию не ходит в a_search.
+    """
+
+    def __init__(self, cache, ttl_seconds: int = TITLE_INDEX_TTL):
+        self.cache = cache
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(alias: str) -> str:
+        return f"title:{normalize_title(alias)}"
+
+    async def lookup(self, query: str, track: bool = True) -> Optional[Dict[str, Any]]:
+        """track=False - фоновая проверка, без счетчиков попаданий"""
+        card = await self.cache.aget(self.key(query), track=track)
+        found = isinstance(card, dict) and card.get("key")
+        if track:
+            if found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return card if found else None
+
+    async def register(self, card: Dict[str, Any], aliases: Iterable[str]):
+        """Привязка всех вариантов названия (запрос, ромадзи, русское) к карточке"""
+        keys = {self.key(alias) for alias in aliases if alias and normalize_title(alias)}
+        # Под тегом аниме: сбрасываются вместе с его каталогом и ссылками
+        await self.cache.amset({key: card for key in keys}, ttl_seconds=self.ttl_seconds, tag=card["key"])
+
+    async def forget(self, query: str):
+        await self.cache.adelete(self.key(query))
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses}
@@ -0,0 +1,346 @@
+import asyncio
+import logging
+import math
+import os
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional
+
+from monitoring import (
+    track_stage,
+    upstream_breaker_state,
+    upstream_breaker_transitions_total,
+    upstream_concurrency_limit,
+    upstream_hedges_total,
+    upstream_in_flight,
+    upstream_rejected_total,
+)
+
+logger = logging.getLogger(__name__)
+
+# Таймауты одного вызова по этапам
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+STAGE_TIMEOUTS = {
+    stage: float(os.getenv(f"UPSTREAM_TIMEOUT_{stage.upper()}", str(default)))
+    for stage, default in (
+        ("search", UPSTREAM_TIMEOUT),
+        ("anime", UPSTREAM_TIMEOUT),
+        ("episodes", UPSTREAM_TIMEOUT),
+        ("sources", 8),
+        ("videos", 8),
+    )
+}
+
+# Адаптивный лимит одновременных вызовов (AIMD)
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "16"))
+UPSTREAM_MIN_CONCURRENCY = int(os.getenv("UPSTREAM_MIN_CONCURRENCY", "2"))
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv("UPSTREAM_MAX_CONCURRENCY", "64"))
+UPSTREAM_QUEUE_TIMEOUT = float(os.getenv("UPSTREAM_QUEUE_TIMEOUT", "5"))
+
+# Circuit breaker
+UPSTREAM_BREAKER_FAILURES = int(os.getenv("UPSTREAM_BREAKER_FAILURES", "5"))
+UPSTREAM_BREAKER_RESET = float(os.getenv("UPSTREAM_BREAKER_RESET", "30"))
+
+# Повторная попытка, если первая дольше наблюдаемого p95
+UPSTREAM_HEDGE = os.getenv("UPSTREAM_HEDGE", "0") == "1"
+UPSTREAM_HEDGE_MIN_DELAY = float(os.getenv("UPSTREAM_HEDGE_MIN_DELAY", "0.1"))
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+BREAKER_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class UpstreamUnavailable(Exception):
+    """Вызов не отправлен: breaker открыт или лимит исчерпан"""
+
+    def __init__(self, reason: str, retry_after: float = 1.0):
+        super().__init__(f"Upstream unavailable: {reason}")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class LatencyWindow:
+    """Последние N длительностей успешных вызовов этапа"""
+
+    def __init__(self, size: int = 200, min_samples: int = 20):
+        self.samples: Deque[float] = deque(maxlen=size)
+        self.min_samples = min_samples
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self.samples) < self.min_samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(math.ceil(q * len(ordered))) - 1)]
+
+
+class AIMDLimiter:
+    """Лимит одновременных вызовов: +1/limit за успех, *backoff за ошибку или таймаут.
+
+    Ожидающие обслуживаются по очереди; место передается следующему
+    сразу при освобождении.
+    """
+
+    def __init__(self, initial: int, min_limit: int, max_limit: int, backoff: float = 0.9):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.limit = float(max(min_limit, min(initial, max_limit)))
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._publish()
+
+    def _has_capacity(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    def try_acquire(self) -> bool:
+        if self._waiters or not self._has_capacity():
+            return False
+        self.in_flight += 1
+        self._publish()
+        return True
+
+    async def acquire(self, timeout: float):
+        if self.try_acquire():
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # Место уже передано нам - возвращаем без изменения лимита
+                self.release(None)
+            else:
+                future.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                upstream_rejected_total.labels(reason="overloaded").inc()
+                raise UpstreamUnavailable("too many pending upstream calls", retry_after=timeout)
+            raise
+        finally:
+            if future in self._waiters:
+                self._waiters.remove(future)
+
+    def release(self, ok: Optional[bool]):
+        """ok=None - вызов отменен, лимит не меняется"""
+        utilized = self.in_flight * 2 >= self.limit
+        self.in_flight -= 1
+        if ok is False:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+        elif ok and utilized:
+            # Растем только когда лимит действительно используется
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+        self._wake()
+        self._publish()
+
+    def _wake(self):
+        while self._waiters and self._has_capacity():
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    def _publish(self):
+        upstream_concurrency_limit.set(int(self.limit))
+        upstream_in_flight.set(self.in_flight)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"limit": round(self.limit, 2), "in_flight": self.in_flight, "waiting": len(self._waiters)}
+
+
+class CircuitBreaker:
+    """closed -> open после N ошибок подряд; через reset_timeout одна пробная попытка"""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, name: str = "upstream"):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.name = name
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        upstream_breaker_state.labels(stage=name).set(BREAKER_STATE_VALUES[CLOSED])
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        logger.warning(f"🔌 Upstream circuit [{self.name}] {self.state} -> {state}")
+        self.state = state
+        upstream_breaker_state.labels(stage=self.name).set(BREAKER_STATE_VALUES[state])
+        upstream_breaker_transitions_total.labels(stage=self.name, state=state).inc()
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        if self.state == OPEN:
+            if self.retry_after() > 0:
+                return False
+            self._transition(HALF_OPEN)
+            self.probing = False
+        if self.state == HALF_OPEN:
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def record(self, ok: bool):
+        self.probing = False
+        if ok:
+            self.failures = 0
+            self._transition(CLOSED)
+            return
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._transition(OPEN)
+
+    def abandon(self):
+        """Пробный вызов отменен, не дойдя до результата"""
+        self.probing = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "retry_after": round(self.retry_after(), 1) if self.state == OPEN else 0,
+        }
+
+
+class UpstreamGovernor:
+    """Все вызовы Extractor: таймаут этапа, адаптивный лимит, breaker и hedging.
+
+    Breaker свой у каждого этапа: сбои плееров на videos (чужие хосты) не
+    закрывают поиск и каталоги animego.
+    """
+
+    def __init__(
+        self,
+        timeouts: Dict[str, float],
+        limiter: AIMDLimiter,
+        breaker_failures: int = UPSTREAM_BREAKER_FAILURES,
+        breaker_reset: float = UPSTREAM_BREAKER_RESET,
+        queue_timeout: float = UPSTREAM_QUEUE_TIMEOUT,
+        hedge: bool = False,
+        hedge_min_delay: float = 0.1,
+    ):
+        self.timeouts = timeouts
+        self.limiter = limiter
+        self.breaker_failures = breaker_failures
+        self.breaker_reset = breaker_reset
+        self.breakers: Dict[str, CircuitBreaker] = {stage: self._new_breaker(stage) for stage in timeouts}
+        self.queue_timeout = queue_timeout
+        self.hedge = hedge
+        self.hedge_min_delay = hedge_min_delay
+        self.latency: Dict[str, LatencyWindow] = {stage: LatencyWindow() for stage in timeouts}
+
+    def _new_breaker(self, stage: str) -> CircuitBreaker:
+        return CircuitBreaker(self.breaker_failures, self.breaker_reset, name=stage)
+
+    def breaker(self, stage: str) -> CircuitBreaker:
+        breaker = self.breakers.get(stage)
+        if breaker is None:
+            breaker = self.breakers[stage] = self._new_breaker(stage)
+        return breaker
+
+    def degraded(self) -> bool:
+        """Хотя бы один breaker не закрыт: фоновым задачам стоит подождать"""
+        return any(breaker.state != CLOSED for breaker in self.breakers.values())
+
+    async def call(self, stage: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """fn вызывается заново для каждой попытки (hedging), поэтому это фабрика корутины"""
+        breaker = self.breaker(stage)
+        if not breaker.allow():
+            upstream_rejected_total.labels(reason="circuit_open").inc()
+            raise UpstreamUnavailable(f"{stage} circuit open", retry_after=breaker.retry_after())
+        probe = breaker.probing
+        try:
+            with track_stage(stage):
+                await self.limiter.acquire(self.queue_timeout)
+                first = asyncio.ensure_future(self._attempt(stage, fn))
+                delay = self.hedge_delay(stage)
+                if delay is None:
+                    return await first
+                return await self._race(stage, fn, first, delay)
+        finally:
+            if probe:
+                breaker.abandon()
+
+    def hedge_delay(self, stage: str) -> Optional[float]:
+        if not self.hedge or self.breaker(stage).state != CLOSED:
+            return None
+        p95 = self.latency.setdefault(stage, LatencyWindow()).quantile(0.95)
+        return None if p95 is None else max(p95, self.hedge_min_delay)
+
+    async def _attempt(self, stage: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Одна попытка; место в лимитере уже занято и освобождается здесь"""
+        timeout = self.timeouts.get(stage, UPSTREAM_TIMEOUT)
+        start = time.perf_counter()
+        ok = None
+        try:
+            result = await asyncio.wait_for(fn(), timeout=timeout)
+        except asyncio.CancelledError:
+            raise
+        except BaseException:
+            ok = False
+            self.breaker(stage).record(False)
+            raise
+        else:
+            elapsed = time.perf_counter() - start
+            # Медленный ответ - тоже признак перегрузки upstream
+            ok = elapsed < timeout / 2
+            self.latency.setdefault(stage, LatencyWindow()).add(elapsed)
+            self.breaker(stage).record(True)
+            return result
+        finally:
+            self.limiter.release(ok)
+
+    async def _race(self, stage: str, fn, first: asyncio.Future, delay: float) -> Any:
+        pending = {first}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+            # Hedge только при свободном месте: под нагрузкой не удваиваем трафик
+            if not self.limiter.try_acquire():
+                return await first
+            upstream_hedges_total.labels(stage=stage, result="sent").inc()
+            second = asyncio.ensure_future(self._attempt(stage, fn))
+            pending = {first, second}
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            upstream_hedges_total.labels(stage=stage, result="won").inc()
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "breakers": {stage: breaker.stats() for stage, breaker in self.breakers.items()},
+            "limiter": self.limiter.stats(),
+            "hedge": self.hedge,
+            "p95": {
+                stage: round(p95, 3)
+                for stage, window in self.latency.items()
+                if (p95 := window.quantile(0.95)) is not None
+            },
+        }
+
+
+upstream = UpstreamGovernor(
+    timeouts=STAGE_TIMEOUTS,
+    limiter=AIMDLimiter(UPSTREAM_CONCURRENCY, UPSTREAM_MIN_CONCURRENCY, UPSTREAM_MAX_CONCURRENCY),
+    breaker_failures=UPSTREAM_BREAKER_FAILURES,
+    breaker_reset=UPSTREAM_BREAKER_RESET,
+    queue_timeout=UPSTREAM_QUEUE_TIMEOUT,
+    hedge=UPSTREAM_HEDGE,
+    hedge_min_delay=UPSTREAM_HEDGE_MIN_DELAY,
+)
@@ -0,0 +1,150 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit, parse_qs
+from datetime import datetime, timezone
+import re
+import time
+
+# Состояния записи кэша видео
+FRESH = "fresh"
+STALE = "stale"
+EXPIRED = "expired"
+
+# Параметры подписанных ссылок с абсолютным временем истечения (unix time)
+EXPIRY_PARAMS = ("expires", "expire", "expiry", "exp", "e", "validto", "valid_to", "deadline")
+
+# Высота кадра в строке качества: "1080", "720p", "HD 720", "1920x1080"
+QUALITY_HEIGHT = re.compile(r'(?:\d{3,4}\s*[x×]\s*)?(\d{3,4})\s*p?', re.IGNORECASE)
+QUALITY_ALIASES = {"4k": 2160, "uhd": 2160, "2k": 1440, "fhd": 1080, "fullhd": 1080, "hd": 720, "sd": 480}
+
+
+def parse_quality(value: Any) -> int:
+    """Качество как высота кадра; 0, если не распознано"""
+    if isinstance(value, bool):
+        return 0
+    if isinstance(value, (int, float)):
+        return int(value)
+    text = str(value or "").strip().lower()
+    # Ширина в "1920x1080" не захватывается; из нескольких значений берем наибольшее
+    heights = [int(h) for h in QUALITY_HEIGHT.findall(text)]
+    if heights:
+        return max(heights)
+    return QUALITY_ALIASES.get(text.replace(" ", ""), 0)
+
+
+def parse_url_expiry(url: str) -> Optional[float]:
+    """Время истечения подписанной ссылки, если его можно достать из URL"""
+    try:
+        query = {k.lower(): v[0] for k, v in parse_qs(urlsplit(url).query).items() if v}
+    except ValueError:
+        return None
+
+    # AWS/S3-совместимые ссылки: X-Amz-Date + X-Amz-Expires (секунды)
+    if "x-amz-date" in query and "x-amz-expires" in query:
+        try:
+            signed = datetime.strptime(query["x-amz-date"], "%Y%m%dT%H%M%SZ")
+            return signed.replace(tzinfo=timezone.utc).timestamp() + int(query["x-amz-expires"])
+        except ValueError:
+            return None
+
+    for name in EXPIRY_PARAMS:
+        value = query.get(name)
+        if value and value.isdigit():
+            ts = int(value)
+            # Миллисекунды
+            if ts > 10 ** 12:
+                ts //= 1000
+            # Отсекаем то, что не похоже на unix time (например, e=1)
+            if ts > 10 ** 9:
+                return float(ts)
+    return None
+
+
+@dataclass
+class VideoEntry:
+    """Разрешенная ссылка с временем получения и истечения"""
+    url: str
+    quality: str
+    fetched_at: float
+    expires_at: Optional[float] = None
+    # Все найденные варианты, лучший первым: {"url", "quality", "source"}
+    variants: List[Dict[str, Any]] = field(default_factory=list)
+
+    @classmethod
+    def create(cls, url: str, quality: str, variants: Optional[List[Dict[str, Any]]] = None) -> "VideoEntry":
+        return cls(
+            url=url, quality=quality, fetched_at=time.time(),
+            expires_at=parse_url_expiry(url), variants=variants or [],
+        )
+
+    @classmethod
+    def from_variants(cls, variants: List[Dict[str, Any]]) -> "VideoEntry":
+        """Запись по ранжированному списку; основная ссылка - первая"""
+        best = variants[0]
+        return cls.create(best["url"], str(best["quality"]), variants)
+
+    def pick(self, quality: Optional[int] = None, expiry_margin: float = 60) -> Tuple[str, str]:
+        """Ближайший к желаемому вариант: лучший не выше quality, иначе наименьший выше"""
+        if not quality or not self.variants:
+            return self.as_tuple()
+        now = time.time()
+        usable = [
+            v for v in self.variants
+            if (parse_url_expiry(v["url"]) or float("inf")) > now + expiry_margin
+        ]
+        below = [v for v in usable if v["quality"] <= quality]
+        above = [v for v in usable if v["quality"] > quality]
+        if below:
+            choice = max(below, key=lambda v: v["quality"])
+        elif above:
+            choice = min(above, key=lambda v: v["quality"])
+        else:
+            return self.as_tuple()
+        return choice["url"], str(choice["quality"])
+
+    def state(self, soft_ttl: float, hard_ttl: float, expiry_margin: float = 60, now: float = None) -> str:
+        now = time.time() if now is None else now
+        if self.expires_at is not None and now >= self.expires_at - expiry_margin:
+            return EXPIRED
+        age = now - self.fetched_at
+        if age >= hard_ttl:
+            return EXPIRED
+        if age >= soft_ttl:
+            return STALE
+        return FRESH
+
+    def ttl(self, hard_ttl: float, expiry_margin: float = 60) -> int:
+        """TTL для хранилища: не дольше жесткого TTL и срока жизни ссылки"""
+        ttl = hard_ttl - (time.time() - self.fetched_at)
+        if self.expires_at is not None:
+            ttl = min(ttl, self.expires_at - expiry_margin - time.time())
+        return max(int(ttl), 0)
+
+    def as_tuple(self) -> Tuple[str, str]:
+        return self.url, self.quality
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "quality": self.quality,
+            "fetched_at": self.fetched_at,
+            "expires_at": self.expires_at,
+            "variants": self.variants,
+        }
+
+    @classmethod
+    def from_cache(cls, data: Any) -> Optional["VideoEntry"]:
+        if isinstance(data, cls):
+            return data
+        if isinstance(data, dict) and data.get("url"):
+            return cls(
+                url=data["url"],
+                quality=data.get("quality", "default"),
+                fetched_at=data.get("fetched_at", 0.0),
+                expires_at=data.get("expires_at"),
+                variants=data.get("variants") or [],
+            )
+        # Старый формат (url, quality): время получения неизвестно, обновляем сразу
+        if isinstance(data, (list, tuple)) and len(data) == 2 and data[0]:
+            return cls(url=data[0], quality=str(data[1]), fetched_at=0.0, expires_at=parse_url_expiry(data[0]))
+        return None
@@ -0,0 +1,306 @@
+"""Прогрев популярных тайтлов до истечения их записей в кэше.
+
+Частота запросов по названию и по эпизоду считается в count-min sketch с
+экспоненциальным затуханием, поэтому память не растет с числом тайтлов, а
+вчерашние хиты постепенно уступают место новым. Раз в interval секунд для
+top-K тайтлов обновляются каталог, последние эпизоды и самые запрашиваемые
+серии, если их записи истекут в ближайшие lead секунд. Число обращений к
+upstream за цикл ограничено budget.
+"""
+import array
+import asyncio
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from catalog import AnimeCatalog, EpisodeRecord
+from monitoring import warmer_refresh_total, warmer_served_total, warmer_tracked_titles
+from title_index import normalize_title
+from upstream import UpstreamUnavailable
+
+logger = logging.getLogger(__name__)
+
+# Вес добавления растет как 2^(t/half_life); при этом пороге счетчики пересчитываются
+RESCALE_WEIGHT = 2.0 ** 40
+
+
+class DecayingCountMinSketch:
+    """Count-min sketch, где вклад события убывает вдвое каждые half_life секунд.
+
+    Затухание ленивое: новые события добавляются с растущим весом, а оценка
+    делится на текущий вес, так что add и estimate - O(depth).
+    """
+
+    def __init__(self, width: int = 4096, depth: int = 4, half_life: float = 3600):
+        self.width = width
+        self.depth = depth
+        self.half_life = half_life
+        self.rows = [array.array("d", bytes(8 * width)) for _ in range(depth)]
+        self.epoch = time.monotonic()
+
+    def _indexes(self, key: str):
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        h1 = int.from_bytes(digest[:4], "little")
+        h2 = int.from_bytes(digest[4:], "little") | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def _weight(self, now: float) -> float:
+        return 2.0 ** ((now - self.epoch) / self.half_life)
+
+    def _rescale(self, now: float):
+        factor = 1 / self._weight(now)
+        for row in self.rows:
+            for i, value in enumerate(row):
+                if value:
+                    row[i] = value * factor
+        self.epoch = now
+
+    def add(self, key: str, now: Optional[float] = None) -> float:
+        """Учесть событие; возвращает новую оценку частоты"""
+        now = time.monotonic() if now is None else now
+        weight = self._weight(now)
+        if weight > RESCALE_WEIGHT:
+            self._rescale(now)
+            weight = 1.0
+        indexes = self._indexes(key)
+        # Conservative update: увеличиваем только минимальные счетчики
+        current = min(row[i] for row, i in zip(self.rows, indexes))
+        target = current + weight
+        for row, i in zip(self.rows, indexes):
+            if row[i] < target:
+                row[i] = target
+        return target / weight
+
+    def estimate(self, key: str, now: Optional[float] = None) -> float:
+        now = time.monotonic() if now is None else now
+        indexes = self._indexes(key)
+        return min(row[i] for row, i in zip(self.rows, indexes)) / self._weight(now)
+
+
+class PopularityWarmer:
+    """Периодическое обновление записей top-K тайтлов в пределах бюджета upstream.
+
+    warm_catalog(title) -> (каталог, ключ обновленной записи или None) и
+    warm_video(catalog, episode) -> ключ или None решают сами, пора ли
+    обновлять; каждый возвращенный ключ и каждая ошибка расходуют единицу бюджета.
+    Пока upstream_degraded() истинно, цикл останавливается до следующего.
+    cycle_budget() - бюджет очередного цикла вместо budget (0 - цикл пропускается),
+    чтобы несколько воркеров не тратили каждый полный бюджет.
+    """
+
+    def __init__(
+        self,
+        warm_catalog: Callable[[str], Awaitable[Tuple[Optional[AnimeCatalog], Optional[str]]]],
+        warm_video: Callable[[AnimeCatalog, EpisodeRecord], Awaitable[Optional[str]]],
+        interval: float = 60,
+        budget: int = 20,
+        top_k: int = 20,
+        latest_episodes: int = 1,
+        hot_episodes: int = 2,
+        half_life: float = 3600,
+        warmed_ttl: float = 3600,
+        upstream_degraded: Optional[Callable[[], bool]] = None,
+        cycle_budget: Optional[Callable[[], Awaitable[int]]] = None,
+    ):
+        self.warm_catalog = warm_catalog
+        self.warm_video = warm_video
+        self.interval = interval
+        self.budget = budget
+        self.top_k = top_k
+        self.latest_episodes = latest_episodes
+        self.hot_episodes = hot_episodes
+        self.warmed_ttl = warmed_ttl
+        self.upstream_degraded = upstream_degraded
+        self.cycle_budget = cycle_budget
+        self.sketch = DecayingCountMinSketch(half_life=half_life)
+        # Кандидаты в top-K: нормализованное название -> (оценка, время оценки, исходное название).
+        # Sketch хранит частоты всех тайтлов, здесь - только претенденты
+        self._titles: Dict[str, Tuple[float, float, str]] = {}
+        self._episodes: Dict[str, Dict[str, Tuple[float, float]]] = {}
+        # Ключи, обновленные прогревом: попадания по ним считаются в warmer_served_total
+        self._warmed: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        self.cycles = 0
+        self.last_cycle: Dict[str, Any] = {}
+
+    # ---------- учет запросов ----------
+    def _decayed(self, score: float, at: float, now: float) -> float:
+        return score * 2.0 ** ((at - now) / self.sketch.half_life)
+
+    def record(self, title: str, episode_num: Optional[str] = None):
+        """Запрос пользователя к тайтлу (и эпизоду)"""
+        if self.interval <= 0:
+            return
+        key = normalize_title(title)
+        if not key:
+            return
+        now = time.monotonic()
+        score = self.sketch.add(f"t:{key}", now)
+        self._titles[key] = (score, now, title)
+        if len(self._titles) > self.top_k * 4:
+            self._trim(self._titles, self.top_k * 2, now)
+            for dropped in set(self._episodes) - set(self._titles):
+                del self._episodes[dropped]
+        warmer_tracked_titles.set(len(self._titles))
+        if episode_num is not None and self.hot_episodes > 0:
+            episodes = self._episodes.setdefault(key, {})
+            episodes[episode_num] = (self.sketch.add(f"e:{key}:{episode_num}", now), now)
+            if len(episodes) > self.hot_episodes * 4:
+                self._trim(episodes, self.hot_episodes * 2, now)
+
+    def _trim(self, candidates: Dict[str, tuple], keep: int, now: float):
+        ranked = sorted(candidates, key=lambda k: self._decayed(candidates[k][0], candidates[k][1], now), reverse=True)
+        for key in ranked[keep:]:
+            del candidates[key]
+
+    def top_titles(self) -> List[Tuple[str, str, float]]:
+        """(ключ, название, текущая оценка) по убыванию популярности"""
+        now = time.monotonic()
+        ranked = [
+            (key, title, self._decayed(score, at, now))
+            for key, (score, at, title) in self._titles.items()
+        ]
+        ranked.sort(key=lambda item: item[2], reverse=True)
+        return ranked[:self.top_k]
+
+    def hot_episode_nums(self, key: str) -> List[str]:
+        now = time.monotonic()
+        episodes = self._episodes.get(key, {})
+        ranked = sorted(episodes, key=lambda n: self._decayed(*episodes[n], now), reverse=True)
+        return ranked[:self.hot_episodes]
+
+    # ---------- учет эффекта ----------
+    def _mark(self, cache_key: str, kind: str):
+        self._warmed[cache_key] = (time.monotonic() + self.warmed_ttl, kind)
+        self._warmed.move_to_end(cache_key)
+        while len(self._warmed) > 10_000:
+            self._warmed.popitem(last=False)
+
+    def observe_hit(self, cache_key: str):
+        """Запрос обслужен из кэша: засчитываем прогреву, если ключ обновил он"""
+        marked = self._warmed.get(cache_key)
+        if marked is None:
+            return
+        expires, kind = marked
+        if time.monotonic() > expires:
+            del self._warmed[cache_key]
+            return
+        warmer_served_total.labels(kind=kind).inc()
+
+    # ---------- цикл ----------
+    def _check_upstream(self):
+        if self.upstream_degraded is not None and self.upstream_degraded():
+            raise UpstreamUnavailable("circuit not closed")
+
+    def targets(self, key: str, catalog: AnimeCatalog) -> List[EpisodeRecord]:
+        """Последние эпизоды и самые запрашиваемые, без повторов"""
+        episodes = catalog.episodes[-self.latest_episodes:] if self.latest_episodes > 0 else []
+        for num in self.hot_episode_nums(key):
+            ep = catalog.find_episode(num)
+            if ep is not None and ep not in episodes:
+                episodes.append(ep)
+        return episodes
+
+    async def run_once(self) -> Dict[str, Any]:
+        start = time.perf_counter()
+        budget = self.budget if self.cycle_budget is None else await self.cycle_budget()
+        remaining = budget
+        counts = {"titles": 0, "catalogs": 0, "videos": 0, "over_budget": 0, "failed": 0}
+        if budget <= 0:
+            # Прогревает другой воркер
+            counts.update(skipped=True, budget_used=0, seconds=0.0)
+            self.cycles += 1
+            self.last_cycle = counts
+            return counts
+        try:
+            for key, title, _ in self.top_titles():
+                if remaining <= 0:
+                    counts["over_budget"] += 1
+                    warmer_refresh_total.labels(kind="catalog", result="over_budget").inc()
+                    continue
+                counts["titles"] += 1
+                self._check_upstream()
+                try:
+                    catalog, refreshed = await self.warm_catalog(title)
+                except UpstreamUnavailable:
+                    raise
+                except Exception as e:
+                    # Неудачная попытка тоже ходила в upstream
+                    remaining -= 1
+                    counts["failed"] += 1
+                    warmer_refresh_total.labels(kind="catalog", result="failed").inc()
+                    logger.warning(f"🔥 Warmer catalog '{title}' failed: {e!r}")
+                    continue
+                if refreshed:
+                    remaining -= 1
+                    counts["catalogs"] += 1
+                    self._mark(refreshed, "catalog")
+                warmer_refresh_total.labels(kind="catalog", result="refreshed" if refreshed else "fresh").inc()
+                if catalog is None:
+                    continue
+                for ep in self.targets(key, catalog):
+                    if remaining <= 0:
+                        counts["over_budget"] += 1
+                        warmer_refresh_total.labels(kind="video", result="over_budget").inc()
+                        continue
+                    self._check_upstream()
+                    try:
+                        refreshed = await self.warm_video(catalog, ep)
+                    except UpstreamUnavailable:
+                        raise
+                    except Exception as e:
+                        remaining -= 1
+                        counts["failed"] += 1
+                        warmer_refresh_total.labels(kind="video", result="failed").inc()
+                        logger.warning(f"🔥 Warmer EP{ep.num} of '{title}' failed: {e!r}")
+                        continue
+                    if refreshed:
+                        remaining -= 1
+                        counts["videos"] += 1
+                        self._mark(refreshed, "video")
+                    warmer_refresh_total.labels(kind="video", result="refreshed" if refreshed else "fresh").inc()
+        except UpstreamUnavailable as e:
+            # Upstream защищается сам (breaker, лимит) - не давим, ждем следующий цикл
+            logger.warning(f"🔥 Warmer cycle stopped: {e}")
+            counts["failed"] += 1
+        counts["budget_used"] = budget - remaining
+        counts["seconds"] = round(time.perf_counter() - start, 3)
+        self.cycles += 1
+        self.last_cycle = counts
+        if counts["budget_used"]:
+            logger.info(f"🔥 Warmer refreshed {counts['catalogs']} catalogs, {counts['videos']} episodes")
+        return counts
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ Warmer cycle failed: {e!r}")
+
+    def start(self):
+        if self._task is None and self.interval > 0 and self.budget > 0:
+            self._task = asyncio.create_task(self._loop(), name="popularity-warmer")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self._task is not None,
+            "cycles": self.cycles,
+            "tracked_titles": len(self._titles),
+            "top": [
+                {"title": title, "score": round(score, 2)}
+                for _, title, score in self.top_titles()[:10]
+            ],
+            "last_cycle": self.last_cycle,
+        }